@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+bench_server.py
+
+Hot paths of the black server: message ingestion, database access, the
+LED control rules, streaming statistics and block encoding. Uses a fake
+MQTT client and databases in a temporary directory.
+"""
+import itertools
+import json
+import os
+import random
+import tempfile
+
+import harness
+
+harness.use_device_dir("black")
+harness.quiet_logging()
+
+import server
+import storage
+import stream_stats
+import tsblocks
+
+TMP_DIR = tempfile.mkdtemp(prefix="iot-bench-")
+_db_count = itertools.count()
+ZONES = ("red", "purple")
+START_MS = 1767225600000   # 2026-01-01T00:00:00Z
+
+
+def timestamp(i):
+    # readings are unique per (zone, metric, timestamp), duplicates are dropped
+    return tsblocks.millis_to_iso(START_MS + i * 1000)
+
+
+def temp_db(rows=0):
+    db = storage.EnvironmentDB(os.path.join(TMP_DIR, "bench%d.db" % next(_db_count)))
+    rng = random.Random(1)
+    for i in range(rows):
+        db.insert(ZONES[i % 2], round(rng.uniform(18, 26), 2), round(rng.uniform(40, 70), 2), timestamp(i))
+    return db
+
+
+def temp_server(rows=0):
+    return server.BrokerServer("localhost", snapshot_path=None, archive_window=0,
+                               client=harness.FakeClient(), db=temp_db(rows))
+
+
+def _sensor_stream():
+    """Endless stream of new readings, alternating zones and metrics."""
+    rng = random.Random(2)
+    for i in itertools.count():
+        zone = ZONES[i % 2]
+        if i % 4 < 2:
+            payload = {"zone": zone, "temperature": round(rng.uniform(18, 26), 2)}
+            topic = "sensors/zone/%s/temperature" % zone
+        else:
+            payload = {"zone": zone, "humidity": round(rng.uniform(40, 70), 2)}
+            topic = "sensors/zone/%s/humidity" % zone
+        payload["timestamp"] = timestamp(i // 4)
+        yield harness.FakeMessage(topic, json.dumps(payload))
+
+
+def _sensor_messages(count):
+    return list(itertools.islice(_sensor_stream(), count))
+
+
+def bench_on_message():
+    # every message is a new reading, built in chunks outside of on_message
+    # so the stream never runs out however long the timing runs are
+    srv = temp_server()
+    stream = _sensor_stream()
+    pending = []
+
+    def on_message():
+        if not pending:
+            pending.extend(itertools.islice(stream, 4096))
+            pending.reverse()
+        srv.on_message(srv.client, None, pending.pop())
+    return on_message
+
+
+def bench_on_message_duplicate():
+    # redeliveries caught by the recent keys, no database access
+    srv = temp_server()
+    messages = _sensor_messages(256)
+    for message in messages:
+        srv.on_message(srv.client, None, message)
+    cycle = itertools.cycle(messages)
+    return lambda: srv.on_message(srv.client, None, next(cycle))
+
+
+def bench_db_insert():
+    db = temp_db()
+    counter = itertools.count()
+    return lambda: db.insert("red", 21.5, 55.0, timestamp(next(counter)))
+
+
+def bench_db_last_temperature():
+    db = temp_db(rows=10000)
+    return lambda: db.last_temperature("purple")
+
+
+def bench_db_last_humidity():
+    db = temp_db(rows=10000)
+    return lambda: db.last_humidity("red")
+
+
+def bench_evaluate_and_publish():
+    srv = temp_server()
+    srv.update_zone("red", 21.0, 65.0, "2026-01-01T00:00:00Z")
+    srv.update_zone("purple", 23.0, 50.0, "2026-01-01T00:00:00Z")
+    return srv.evaluate_and_publish
+
+
+def bench_stream_stats_update():
+    stats = stream_stats.StreamStats()
+    rng = random.Random(3)
+    values = [round(rng.uniform(18, 26), 2) for _ in range(1024)]
+    counter = itertools.count()
+
+    def update():
+        i = next(counter)
+        stats.update(ZONES[i & 1], "temperature", values[i & 1023], float(i))
+    return update
+
+
+def _block_points(count=360):
+    rng = random.Random(4)
+    t, value, points = 1767225600000, 21.0, []
+    for _ in range(count):
+        t += 10000 + rng.randint(0, 30)
+        value = round(value + rng.choice((0.0, 0.0, 0.01, -0.01)), 2)
+        points.append((t, value))
+    return points
+
+
+def bench_tsblocks_encode():
+    points = _block_points()
+    return lambda: tsblocks.encode(points)
+
+
+def bench_tsblocks_decode():
+    data = tsblocks.encode(_block_points())
+    return lambda: tsblocks.decode(data)
+
+
+BENCHMARKS = [
+    ("server.on_message", bench_on_message),
+    ("server.on_message_duplicate", bench_on_message_duplicate),
+    ("server.db_insert", bench_db_insert),
+    ("server.db_last_temperature", bench_db_last_temperature),
+    ("server.db_last_humidity", bench_db_last_humidity),
+    ("server.evaluate_and_publish", bench_evaluate_and_publish),
+    ("server.stream_stats_update", bench_stream_stats_update),
+    ("server.tsblocks_encode_360", bench_tsblocks_encode),
+    ("server.tsblocks_decode_360", bench_tsblocks_decode),
+]
+
+
+if __name__ == "__main__":
+    try:
+        harness.main(BENCHMARKS)
+    finally:
+        import shutil
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+bench_storage.py
+
+The storage engines of the server on the same workload: ingestion of new
+readings and the queries the server runs (last value, latest reading per
+zone, one hour of a series) on 10000 stored readings. The engines use
+their default (balanced) profile and files in a temporary directory.
+"""
+import itertools
+import os
+import random
+import tempfile
+
+import harness
+
+harness.use_device_dir("black")
+harness.quiet_logging()
+
+import storage
+import tsblocks
+
+TMP_DIR = tempfile.mkdtemp(prefix="iot-bench-")
+_file_count = itertools.count()
+ZONES = ("red", "purple")
+START_MS = 1767225600000   # 2026-01-01T00:00:00Z
+ROWS = 10000
+
+
+def timestamp(i):
+    return tsblocks.millis_to_iso(START_MS + i * 1000)
+
+
+def open_engine(engine, rows=0):
+    db = storage.create_storage(engine, os.path.join(TMP_DIR, "bench%d.%s" % (next(_file_count), engine)))
+    rng = random.Random(1)
+    for i in range(rows):
+        db.insert(ZONES[i % 2], round(rng.uniform(18, 26), 2), round(rng.uniform(40, 70), 2), timestamp(i))
+    return db
+
+
+def bench_insert(engine):
+    db = open_engine(engine)
+    counter = itertools.count()
+    return lambda: db.insert("red", 21.5, 55.0, timestamp(next(counter)))
+
+
+def bench_last_temperature(engine):
+    db = open_engine(engine, ROWS)
+    return lambda: db.last_temperature("purple")
+
+
+def bench_latest_per_zone(engine):
+    db = open_engine(engine, ROWS)
+    return db.latest_per_zone
+
+
+def bench_range_1h(engine):
+    db = open_engine(engine, ROWS)
+    start, end = timestamp(ROWS // 2), timestamp(ROWS // 2 + 3600)
+    return lambda: db.range("purple", "temperature", start, end)
+
+
+def _setup(bench, engine):
+    return lambda: bench(engine)
+
+
+BENCHMARKS = [("storage.%s.%s" % (engine, name), _setup(bench, engine))
+              for engine in storage.ENGINES
+              for name, bench in (("insert", bench_insert),
+                                  ("last_temperature", bench_last_temperature),
+                                  ("latest_per_zone", bench_latest_per_zone),
+                                  ("range_1h", bench_range_1h))]
+
+
+if __name__ == "__main__":
+    try:
+        harness.main(BENCHMARKS)
+    finally:
+        import shutil
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
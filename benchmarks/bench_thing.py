@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+bench_thing.py
+
+Hot paths of a thing (purple): the GrovePi interactor's queue handling,
+SHT35 reads in simulate mode, oversampled rotary angle reads and LED
+commands. The hardware is the hal
+simulator with its latencies scaled to zero, so only our own code is
+timed; MQTT goes to a fake client.
+"""
+import itertools
+from concurrent.futures import Future
+
+import harness
+
+harness.use_device_dir("purple")
+harness.quiet_logging()
+
+import threading
+
+import hal
+from grove_pi_interface import GrovePiInteractor, InteractorMember, grovepi_tx_queue, \
+                               ANALOG_READ, DIGITAL_WRITE
+from LedResource import LedResource
+from RotaryAngleResource import RotaryAngleResource
+from SHT35Resource import SHT35Resource
+
+hal.set_backend(hal.SimulatorBackend(time_scale=0.0, seed=1))
+
+_interactor = None
+
+
+def drain_tx_queue():
+    # LED commands queue up for the (not running) interactor thread
+    while not grovepi_tx_queue.empty():
+        grovepi_tx_queue.get()
+        grovepi_tx_queue.task_done()
+
+
+def bench_work_queue_entry_read():
+    member = InteractorMember(2, 'INPUT', ANALOG_READ)
+
+    def read():
+        future = Future()
+        GrovePiInteractor.work_queue_entry((member, None, future))
+        return future.result()
+    return read
+
+
+def bench_work_queue_entry_write():
+    member = InteractorMember(5, 'OUTPUT', DIGITAL_WRITE)
+    values = itertools.cycle((0, 1))
+    return lambda: GrovePiInteractor.work_queue_entry((member, next(values)))
+
+
+def start_interactor():
+    global _interactor
+    if _interactor is None:
+        drain_tx_queue()
+        _interactor = GrovePiInteractor()
+        _interactor.daemon = True
+        _interactor.start()
+
+
+def bench_interactor_roundtrip():
+    # submit -> interactor thread -> future, as sensors read through it
+    start_interactor()
+    member = InteractorMember(3, 'INPUT', ANALOG_READ)
+    return lambda: GrovePiInteractor.read(member)
+
+
+def bench_rotary_read_sensor():
+    # 4 samples in one bulk request, median and quantisation
+    start_interactor()
+    sensor = RotaryAngleResource(1, threading.Lock(), harness.FakeClient(), True,
+                                 "sensors/zone/purple/rotary", 1.0, 2, oversampling=4)
+    return sensor.read_sensor
+
+
+def bench_sht35_read_sensor():
+    # DHT wiring as in config/purple.json; the I2C path waits 15 ms for the
+    # conversion, which would dominate the measurement
+    sensor = SHT35Resource(0, threading.Lock(), harness.FakeClient(), True,
+                           "sensors/zone/purple/temperature", simulate=True,
+                           use_dht=True, dht_port=3)
+    return sensor.read_sensor
+
+
+def bench_led_on_mqtt_message():
+    led = LedResource(6, harness.FakeClient(), "actuators/zone/purple/led", 2)
+    messages = itertools.cycle((harness.FakeMessage(led.sub_topic, b"ON"),
+                                harness.FakeMessage(led.sub_topic, b"OFF")))
+
+    def command():
+        led.on_mqtt_message(None, None, next(messages))
+        if grovepi_tx_queue.qsize() > 1000:
+            drain_tx_queue()
+    return command
+
+
+BENCHMARKS = [
+    ("thing.work_queue_entry_read", bench_work_queue_entry_read),
+    ("thing.work_queue_entry_write", bench_work_queue_entry_write),
+    ("thing.sht35_read_sensor_sim", bench_sht35_read_sensor),
+    ("thing.led_on_mqtt_message", bench_led_on_mqtt_message),
+    ("thing.interactor_roundtrip", bench_interactor_roundtrip),
+    ("thing.rotary_read_sensor_x4", bench_rotary_read_sensor),
+]
+
+
+if __name__ == "__main__":
+    harness.main(BENCHMARKS)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+harness.py
+
+Shared pieces of the benchmark suite: the timing loop, a fake MQTT client
+and message (no broker or network needed) and the result format that
+run.py compares against baseline.json.
+
+A bench script calls main(BENCHMARKS) where BENCHMARKS is a list of
+(name, setup) pairs; setup() returns the zero-argument callable to time.
+"""
+import gc
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_REPEAT = 5
+DEFAULT_MIN_TIME = 0.2   # seconds per repeat after calibration
+
+
+def use_device_dir(name):
+    """Puts black/, red/ or purple/ first on sys.path (their modules share names)."""
+    sys.path.insert(0, os.path.join(ROOT, name))
+
+
+def quiet_logging():
+    import logging
+    import log
+    log.configure(level=logging.WARNING)
+
+
+class FakeMessageInfo(object):
+
+    def __init__(self, mid):
+        self.rc = 0
+        self.mid = mid
+
+    def is_published(self):
+        return True
+
+
+class FakeClient(object):
+    """Stands in for paho's Client; publish() only counts messages."""
+
+    def __init__(self):
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+        self.published = 0
+        self.mid = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published += 1
+        self.mid += 1
+        return FakeMessageInfo(self.mid)
+
+    def subscribe(self, topic, qos=0):
+        return 0, self.mid
+
+    def unsubscribe(self, topic):
+        return 0, self.mid
+
+    def message_callback_add(self, topic, callback):
+        pass
+
+    def message_callback_remove(self, topic):
+        pass
+
+
+class FakeMessage(object):
+
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload if isinstance(payload, bytes) else payload.encode("utf-8")
+        self.qos = qos
+        self.retain = retain
+
+
+def time_callable(func, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    """Best (lowest) seconds per call over `repeat` calibrated runs."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10 or number >= 1 << 20:
+            break
+        number *= 4
+    number = max(1, int(number * (min_time / max(elapsed, 1e-9))))
+
+    best = None
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            per_call = (time.perf_counter() - start) / number
+            best = per_call if best is None else min(best, per_call)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return best
+
+
+def main(benchmarks, argv=None):
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--json", action="store_true", help="Print results as JSON (used by run.py)")
+    parser.add_argument("--filter", default=None, help="Only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, setup in benchmarks:
+        if args.filter and args.filter not in name:
+            continue
+        func = setup()
+        seconds = time_callable(func, min_time=args.min_time)
+        results[name] = {"us_per_op": seconds * 1e6, "ops_per_sec": 1.0 / seconds}
+        if not args.json:
+            print("%-40s %12.2f us/op %14.0f ops/s" % (name, seconds * 1e6, 1.0 / seconds))
+
+    if args.json:
+        print(json.dumps(results))
+    return results
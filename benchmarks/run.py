@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+run.py
+
+Runs the benchmark suite and compares it with baseline.json. Every bench
+script runs in its own interpreter because black/ and purple/ contain
+modules with the same names. Exits with 1 when a benchmark is slower than
+its baseline by more than the threshold, so it can gate a change:
+
+    python3 benchmarks/run.py                    # compare with the baseline
+    python3 benchmarks/run.py --update-baseline  # record new baseline values
+    python3 benchmarks/run.py --threshold 0.5 --filter server.
+
+Baselines hold absolute timings of the machine that recorded them. The
+suite also times a fixed calibration workload (interpreter work and SQLite
+inserts) and scales the baseline by how much faster or slower the current
+machine is, so a baseline recorded elsewhere gives a rough comparison.
+For a reliable gate, regenerate the baseline with --update-baseline on the
+machine that runs the gate (e.g. the Pi itself). Keep the default
+--min-time there too: very short runs are noisy.
+"""
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import harness
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, "baseline.json")
+SUITES = ("bench_server.py", "bench_storage.py", "bench_thing.py")
+DEFAULT_THRESHOLD = 0.30   # allowed slowdown, as a fraction of the baseline
+CALIBRATION_KEY = "_calibration"
+
+
+def run_suite(script, filter_text=None, min_time=None):
+    cmd = [sys.executable, os.path.join(HERE, script), "--json"]
+    if filter_text:
+        cmd += ["--filter", filter_text]
+    if min_time is not None:
+        cmd += ["--min-time", str(min_time)]
+    output = subprocess.run(cmd, cwd=HERE, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def calibration_workload():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (k INTEGER PRIMARY KEY, v REAL)")
+    counter = itertools.count()
+
+    def work():
+        i = next(counter)
+        data = json.loads(json.dumps({"k": i, "v": [x * 0.5 for x in range(32)]}))
+        conn.execute("INSERT INTO t VALUES (?, ?)", (i, sum(data["v"])))
+    return work
+
+
+def calibrate():
+    """Microseconds per call of the calibration workload on this machine."""
+    return harness.time_callable(calibration_workload()) * 1e6
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def compare(results, baseline, threshold, scale=1.0):
+    """
+    Prints a table; returns the names of regressed benchmarks. The baseline
+    timings are multiplied by scale (this machine / baseline machine).
+    """
+    regressions = []
+    print("%-36s %12s %12s %9s" % ("benchmark", "us/op", "baseline", "change"))
+    for name in sorted(results):
+        current = results[name]["us_per_op"]
+        base = baseline.get(name, {}).get("us_per_op")
+        if base is None:
+            print("%-36s %12.2f %12s %9s" % (name, current, "-", "new"))
+            continue
+        base *= scale
+        change = current / base - 1.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("%-36s %12.2f %12.2f %+8.0f%%%s" % (name, current, base, change * 100.0, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown before failing (0.3 = 30%%)")
+    parser.add_argument("--filter", default=None, help="Only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=None, help="Seconds per timing run")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline file")
+    parser.add_argument("--no-calibration", action="store_true",
+                        help="Compare with the baseline timings as recorded, without scaling them")
+    args = parser.parse_args()
+
+    # before and after the suites, so a change of load during the run is averaged
+    calibration = calibrate()
+    results = {}
+    for script in SUITES:
+        results.update(run_suite(script, args.filter, args.min_time))
+    calibration = (calibration + calibrate()) / 2.0
+
+    baseline = load_baseline(args.baseline)
+    base_calibration = baseline.get(CALIBRATION_KEY, {}).get("us_per_op")
+    scale = 1.0
+    if base_calibration and not args.no_calibration:
+        scale = calibration / base_calibration
+        print("calibration: %.2f us/op, %.2f x the baseline machine's time" % (calibration, scale))
+    elif not args.no_calibration:
+        print("calibration: baseline has none, comparing absolute timings")
+    regressions = compare(results, baseline, args.threshold, scale)
+
+    if args.update_baseline:
+        baseline.update(results)
+        # a partial update keeps the calibration the other entries were recorded with
+        if not args.filter or base_calibration is None:
+            baseline[CALIBRATION_KEY] = {"us_per_op": calibration}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("baseline updated: %s" % args.baseline)
+        return 0
+
+    if regressions:
+        print("%d benchmark(s) regressed by more than %.0f%%: %s"
+              % (len(regressions), args.threshold * 100.0, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,67 @@
 #!/usr/bin/env python3
 
 import time
-import threading 
+import threading
+import mqttconfig
+import scheduler
+import telemetry
+
+
+class AdaptivePollingPolicy( object ):
+
+  # Lengthens the polling interval while consecutive readings stay within
+  # stable_delta and shortens it (never below min_interval) as soon as the
+  # rate of change exceeds rate_limit (units per second).
+  def __init__( self, min_interval = float( 1.0 ), \
+                max_interval = float( 60.0 ), \
+                stable_delta = float( 0.1 ), \
+                rate_limit = float( 0.05 ), \
+                stable_samples = int( 3 ), \
+                growth_factor = float( 1.5 ), \
+                shrink_factor = float( 0.25 ) ):
+
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self.stable_delta = stable_delta
+    self.rate_limit = rate_limit
+    self.stable_samples = stable_samples
+    self.growth_factor = growth_factor
+    self.shrink_factor = shrink_factor
+
+    self.last_value = None
+    self.last_time = None
+    self.stable_count = int( 0 )
+
+
+  def next_interval( self, current_interval, value, now ):
+    if value is None:
+      return current_interval
+
+    value = float( value )
+
+    if self.last_value is None:
+      self.last_value = value
+      self.last_time = now
+      return current_interval
+
+    delta = abs( value - self.last_value )
+    elapsed = max( now - self.last_time, 1e-6 )
+    self.last_value = value
+    self.last_time = now
+
+    if delta / elapsed > self.rate_limit:
+      self.stable_count = 0
+      return max( self.min_interval, current_interval * self.shrink_factor )
+
+    if delta <= self.stable_delta:
+      self.stable_count += 1
+      if self.stable_count >= self.stable_samples:
+        self.stable_count = 0
+        return min( self.max_interval, current_interval * self.growth_factor )
+    else:
+      self.stable_count = 0
+
+    return current_interval
 
 
 class Sensor( threading.Thread ):
@@ -10,8 +70,9 @@ class Sensor( threading.Thread ):
                 mqtt_client, running, \
                 pub_topic, \
                 polling_interval = float( 1.0 ), \
-                sampling_resolution = int( 2 ) ):
-    
+                sampling_resolution = int( 2 ), \
+                polling_policy = None ):
+
     # must be called ...
     threading.Thread.__init__( self )
 
@@ -24,6 +85,25 @@ class Sensor( threading.Thread ):
     self.sampling_resolution = sampling_resolution
     self.grovepi_interactor_member = None
 
+    # adaptive scheduling (None keeps the fixed polling_interval)
+    self.polling_policy = polling_policy
+    self.current_interval = polling_interval
+    self.poll_count = int( 0 )
+    self.poll_started_at = None
+
+    # reads happen on wall-clock aligned deadlines; the thing may set
+    # schedule.phase to spread its sensors over the bus
+    self.schedule = scheduler.Schedule( polling_interval )
+
+    # maintained by the connection manager through on_connection_state
+    self.broker_connected = False
+
+    # set by the thing when an outbound publisher owns the client
+    self.publisher = None
+
+    # poll periods, read durations, failed reads and publishes
+    self.telemetry = telemetry.ResourceTelemetry()
+
 
   def poll_sensor( self ):
     still_polling = False
@@ -31,16 +111,95 @@ class Sensor( threading.Thread ):
     self.lock.acquire()
     still_polling = self.running
     self.lock.release()
-    
+
+    self.poll_started_at = time.monotonic()
+
     while still_polling:
+      started = time.monotonic()
+      self.schedule.fired( started )
       self.read_sensor()
-      time.sleep( self.polling_interval )
+      self.telemetry.poll( started, time.monotonic() - started )
+      self.poll_count += 1
+      self.update_interval()
+      time.sleep( self.schedule.delay() )
 
       self.lock.acquire()
       still_polling = self.running
       self.lock.release()
 
-  
+
+  # asyncio variant of read_sensor: the blocking hardware access runs in
+  # the executor of the thing so the event loop stays responsive.
+  async def async_read_sensor( self, executor = None ):
+    import asyncio # only needed (and paid for) by the asyncio runtime
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor( executor, self.read_sensor )
+
+
+  # asyncio variant of poll_sensor, scheduled as a task on the thing's loop.
+  async def async_poll_sensor( self, executor = None ):
+    import asyncio
+    self.poll_started_at = time.monotonic()
+
+    while self.running:
+      started = time.monotonic()
+      self.schedule.fired( started )
+      await self.async_read_sensor( executor )
+      self.telemetry.poll( started, time.monotonic() - started )
+      self.poll_count += 1
+      self.update_interval()
+      await asyncio.sleep( self.schedule.delay() )
+
+
+  def update_interval( self ):
+    if self.polling_policy is None:
+      return
+
+    self.current_interval = self.polling_policy.next_interval( self.current_interval, \
+                                                               self.sampled_value(), \
+                                                               time.monotonic() )
+    self.schedule.set_interval( self.current_interval )
+
+
+  # Value the polling policy looks at; derived classes may override.
+  def sampled_value( self ):
+    return getattr( self, 'value', None )
+
+
+  # Fraction of reads saved compared to polling at the configured interval.
+  def duty_cycle_savings( self ):
+    if self.poll_started_at is None or self.polling_interval <= 0:
+      return float( 0.0 )
+
+    elapsed = time.monotonic() - self.poll_started_at
+    expected_polls = elapsed / self.polling_interval
+    if expected_polls < 1.0:
+      return float( 0.0 )
+
+    return max( float( 0.0 ), 1.0 - self.poll_count / expected_polls )
+
+
+  # Hands a message to the thing's publisher, or publishes directly when
+  # there is none. The polling lock is not needed for either.
+  def publish( self, topic, payload, retain = False ):
+    self.telemetry.published()
+    if self.publisher is not None:
+      self.publisher.publish( topic, payload, mqttconfig.QUALITY_OF_SERVICE, retain )
+    else:
+      self.mqtt_client.publish( topic, payload, mqttconfig.QUALITY_OF_SERVICE, retain )
+
+
+  # To be called by derived classes when a read yields no usable sample.
+  def read_failed( self ):
+    self.telemetry.failed_read()
+
+
+  # Called by the connection manager with 'connecting', 'connected',
+  # 'disconnected' or 'stopped'; derived classes may override.
+  def on_connection_state( self, state ):
+    self.broker_connected = ( state == 'connected' )
+
+
   # gets invoked when thread starts ...
   def run( self ):
     self.poll_sensor()
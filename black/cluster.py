@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+cluster.py
+
+Several server instances, on one host or on several, form a group that
+shares the sensor stream: they subscribe to $share/<group>/sensors/...,
+so the broker hands every reading to exactly one of them and the ingest
+work is spread over the group.
+
+The actuators must still get their commands from exactly one instance.
+That instance holds a lease: a retained message on leases/<name> that
+names the holder and is renewed every ttl/3 seconds. The others take
+over when no renewal arrived for ttl seconds, or at once when the holder
+releases the lease on shutdown or its last will (published by the broker
+when its connection drops) says so. The broker orders the messages of a
+topic, so all instances agree on the last claim, which wins.
+
+Every member registers the will, holder or not, so the will is not
+retained (it cannot replace the holder's retained claim) and names its
+sender: a release from anyone but the current holder is ignored.
+
+To decide, the holder needs the live readings of the whole group: every
+instance forwards the live readings it ingested on servers/<group>/live,
+so any of them can take over with the complete control state.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+import log
+
+DEFAULT_LEASE_TTL = 6.0     # seconds without renewal before the lease is taken over
+LEASE_QOS = 1
+
+logger = log.setup_custom_logger("cluster")
+
+
+def shared_topic(group, topic):
+    """Shared subscription of the group to topic (MQTT 5, also in Mosquitto for 3.1.1 clients)."""
+    return "$share/%s/%s" % (group, topic)
+
+
+def lease_topic(name):
+    return "leases/%s" % name
+
+
+def peer_topic(group):
+    return "servers/%s/live" % group
+
+
+def default_instance_id():
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+class Lease(threading.Thread):
+    """
+    Leadership through a retained MQTT topic. on_message must receive the
+    messages of self.topic; connected()/disconnected() follow the broker
+    connection. on_acquired and on_lost are called without the lock held,
+    from the MQTT network thread or the lease thread.
+    """
+
+    def __init__(self, name, owner, publish, ttl=DEFAULT_LEASE_TTL,
+                 on_acquired=None, on_lost=None, clock=time.monotonic):
+        threading.Thread.__init__(self, name="lease", daemon=True)
+        self.topic = lease_topic(name)
+        self.owner = owner
+        self.publish = publish      # publish(topic, payload, qos, retain)
+        self.ttl = float(ttl)
+        self.renew_interval = self.ttl / 3.0
+        self.on_acquired = on_acquired
+        self.on_lost = on_lost
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.holder = None
+        self.holder_ttl = self.ttl
+        self.seen = None            # arrival of the holder's last claim or renewal
+        self.listen_until = None    # no claims while disconnected or before the retained lease arrived
+        self.acquired_count = 0
+        self.stop_event = threading.Event()
+
+    # --- MQTT side ---
+
+    def connected(self):
+        with self.lock:
+            self.listen_until = self.clock() + self.renew_interval
+
+    def disconnected(self):
+        with self.lock:
+            self.listen_until = None
+
+    def on_message(self, client, userdata, message):
+        try:
+            data = json.loads(message.payload.decode("utf-8")) if message.payload else {}
+            holder = data.get("holder")
+            ttl = float(data.get("ttl") or self.ttl)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning("Ignoring invalid lease message on %s: %s", message.topic, e)
+            return
+        self.update(holder, bool(data.get("released")), ttl)
+
+    def update(self, holder, released=False, ttl=None, now=None):
+        """Applies a claim, renewal or release seen on the lease topic."""
+        now = self.clock() if now is None else now
+        with self.lock:
+            was_held = self.holder == self.owner
+            if released:
+                if holder != self.holder:
+                    # last will of an instance that did not hold the lease
+                    return
+                self.holder = None
+            else:
+                self.holder = holder
+                self.holder_ttl = ttl or self.ttl
+            self.seen = now
+            held = self.holder == self.owner
+
+        if held and not was_held:
+            self.acquired_count += 1
+            logger.info("Lease %s acquired by %s", self.topic, self.owner)
+            self.notify(self.on_acquired)
+        elif was_held and not held:
+            logger.warning("Lease %s taken over by %s", self.topic, holder if not released else "nobody")
+            self.notify(self.on_lost)
+        if released and not self.stop_event.is_set():
+            logger.info("Lease %s released by %s, claiming it", self.topic, holder)
+            self.claim()
+
+    # --- lease thread ---
+
+    def run(self):
+        while not self.stop_event.wait(self.renew_interval):
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("lease %s: renewal failed", self.topic)
+
+    def tick(self, now=None):
+        """Renews the lease, or claims it when the holder stopped renewing."""
+        now = self.clock() if now is None else now
+        lost = False
+        with self.lock:
+            expired = self.seen is None or now - self.seen >= self.holder_ttl
+            if self.holder == self.owner and expired:
+                # our renewals do not come back: the broker is unreachable
+                self.holder = None
+                lost = True
+            listening = self.listen_until is not None and now >= self.listen_until
+            claim = listening and (self.holder == self.owner or self.holder is None or expired)
+        if lost:
+            logger.warning("Lease %s expired, renewals of %s were not confirmed", self.topic, self.owner)
+            self.notify(self.on_lost)
+        if claim:
+            self.claim()
+
+    def claim(self):
+        self.publish(self.topic, self.payload(), LEASE_QOS, True)
+
+    def release(self):
+        """Stops renewing; hands the lease over right away if we hold it."""
+        self.stop_event.set()
+        with self.lock:
+            held = self.holder == self.owner
+            if held:
+                self.holder = None
+        if held:
+            self.publish(self.topic, self.release_payload(), LEASE_QOS, True)
+            logger.info("Lease %s released by %s", self.topic, self.owner)
+
+    # --- state ---
+
+    def is_held(self):
+        with self.lock:
+            return (self.holder == self.owner and self.seen is not None
+                    and self.clock() - self.seen < self.holder_ttl)
+
+    def payload(self):
+        return json.dumps({"holder": self.owner, "ttl": self.ttl,
+                           "renewed": datetime.utcnow().isoformat() + "Z"})
+
+    def release_payload(self):
+        """Also the last will: ignored unless its sender holds the lease."""
+        return json.dumps({"holder": self.owner, "released": True})
+
+    def set_will(self, client):
+        """Registers the release as last will of client (before it connects), not retained."""
+        client.will_set(self.topic, self.release_payload(), LEASE_QOS, retain=False)
+
+    def notify(self, callback):
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception:
+            logger.exception("lease %s: callback failed", self.topic)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+ingest.py
+
+Duplicate suppression in front of the database. A reading is identified by
+(zone, metric, timestamp): a thing that republishes after a reconnect, or
+a broker redelivering at QoS 1, sends the same key again. RecentKeys
+remembers the last keys in insertion order, so a redelivery is dropped
+without touching SQLite; older duplicates are still caught by the storage
+engine (the unique index of the readings table, or the archived blocks).
+Keys use the measurement time in milliseconds, so the same instant written
+as 'Z' or '+00:00', with or without fractions, is one reading.
+
+Watermarks give the server event-time semantics: the watermark of a zone
+and metric is the newest measurement time seen. A reading at or after it
+is live and moves the control state; an older one (a backlog replayed
+after an outage) only goes to the history.
+"""
+from collections import OrderedDict
+
+DEFAULT_RECENT_KEYS = 4096
+
+
+class RecentKeys(object):
+    """Bounded set of the most recently added keys (LRU eviction)."""
+
+    def __init__(self, capacity=DEFAULT_RECENT_KEYS):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.keys = OrderedDict()
+
+    def add(self, key):
+        """Adds key; returns False if it was already there."""
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            return False
+        self.keys[key] = None
+        if len(self.keys) > self.capacity:
+            self.keys.popitem(last=False)
+        return True
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class Watermarks(object):
+    """Newest event time (ms) per (zone, metric)."""
+
+    def __init__(self):
+        self.marks = {}
+
+    def advance(self, zone, metric, event_ms):
+        """True if the reading is live (not older than the watermark)."""
+        mark = self.marks.get((zone, metric))
+        if mark is not None and event_ms < mark:
+            return False
+        self.marks[(zone, metric)] = event_ms
+        return True
+
+    def get(self, zone, metric):
+        return self.marks.get((zone, metric))
+
+
+class IngestCounters(object):
+    """What happened to the readings received by the server."""
+
+    def __init__(self):
+        self.received = 0
+        self.stored = 0
+        self.duplicates = 0       # dropped by the recent keys, no DB access
+        self.duplicates_db = 0    # older duplicates rejected by the unique index
+        self.late = 0             # behind the watermark, stored as history only
+        self.expired = 0          # too old for the event-time aggregates
+        self.peer = 0             # live readings forwarded by other instances of the group
+
+    def as_dict(self):
+        return {"received": self.received, "stored": self.stored, "duplicates": self.duplicates,
+                "duplicates_db": self.duplicates_db, "late": self.late, "expired": self.expired, "peer": self.peer}
@@ -1,90 +1,198 @@
 #!/usr/bin/env python3
 
+import sys
+import startup_profile
+
+# must run before the remaining imports so that they are timed as well
+if '--profile-startup' in sys.argv:
+    startup_profile.enable()
+
 import argparse
 import json
-import sqlite3
-from datetime import datetime
+import os
 import threading
+import time
+from datetime import datetime
 
 import paho.mqtt.client as mqtt
 
-DB_FILE = "temperatures.db"
+import cluster
+import ingest
+import log
+import mqtt_connection
+import profiling
+import storage
+import stream_stats
+import telemetry
+import tsblocks
+
 SENSOR_TEMP_TOPIC = "sensors/zone/+/temperature"
 SENSOR_HUMIDITY_TOPIC = "sensors/zone/+/humidity"
 LED_TEMP_TOPIC = "actuators/zone/purple/led"
 LED_HUMIDITY_TOPIC = "actuators/zone/purple/led_humidity"
+CONTROL_ZONES = ("red", "purple")
+SNAPSHOT_FILE = "server_state.json"
+SNAPSHOT_INTERVAL = 30.0  # seconds between snapshots of the per-zone values
+ARCHIVE_CHECK_INTERVAL = 300.0  # seconds between checks for closed windows to compress
+
+logger = log.setup_custom_logger("server")
 
 
-class EnvironmentDB:
-    def __init__(self, filename=DB_FILE):
-        self.conn = sqlite3.connect(filename, check_same_thread=False)
-        self._init_db()
-        self.lock = threading.Lock()
-
-    def _init_db(self):
-        cur = self.conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS readings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                zone TEXT NOT NULL,
-                temperature REAL,
-                humidity REAL,
-                timestamp TEXT NOT NULL
-            )
-        """)
-        # Backward-compatible migration if the table already exists without humidity
-        cur.execute("PRAGMA table_info(readings)")
-        columns = {row[1] for row in cur.fetchall()}
-        if "humidity" not in columns:
-            cur.execute("ALTER TABLE readings ADD COLUMN humidity REAL")
-        self.conn.commit()
-
-    def insert(self, zone, temperature, humidity, timestamp):
-        with self.lock:
-            cur = self.conn.cursor()
-            cur.execute(
-                "INSERT INTO readings(zone, temperature, humidity, timestamp) VALUES (?, ?, ?, ?)",
-                (zone, temperature, humidity, timestamp),
-            )
-            self.conn.commit()
-
-    def last_temperature(self, zone):
-        with self.lock:
-            cur = self.conn.cursor()
-            cur.execute(
-                "SELECT temperature FROM readings WHERE zone = ? AND temperature IS NOT NULL ORDER BY id DESC LIMIT 1",
-                (zone,),
-            )
-            row = cur.fetchone()
-            return row[0] if row else None
-
-    def last_humidity(self, zone):
-        with self.lock:
-            cur = self.conn.cursor()
-            cur.execute(
-                "SELECT humidity FROM readings WHERE zone = ? AND humidity IS NOT NULL ORDER BY id DESC LIMIT 1",
-                (zone,),
-            )
-            row = cur.fetchone()
-            return row[0] if row else None
+class SnapshotWriter(threading.Thread):
+    """
+    Writes snapshots off the MQTT network thread: the write and fsync can
+    take long on an SD card. Only the latest submitted snapshot is kept, so
+    a burst of LED changes costs one write.
+    """
+
+    def __init__(self, path):
+        threading.Thread.__init__(self, name="snapshot", daemon=True)
+        self.path = path
+        self.condition = threading.Condition()
+        self.pending = None
+        self.stopping = False
+        self.written = 0
+
+    def submit(self, snapshot):
+        with self.condition:
+            self.pending = snapshot
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopping:
+                    self.condition.wait()
+                snapshot, self.pending = self.pending, None
+            if snapshot is None:
+                return
+            self.write(snapshot)
+
+    def write(self, snapshot):
+        """Atomically replaces the snapshot file."""
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.written += 1
+        except OSError as e:
+            logger.warning("Could not write snapshot %s: %s", self.path, e)
+
+    def stop(self, timeout=5.0):
+        """Writes the pending snapshot, if any, and ends the thread."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.is_alive():
+            self.join(timeout)
 
 
 class BrokerServer:
-    def __init__(self, broker, temp_threshold=22.0, humidity_threshold=60.0):
+    def __init__(self, broker, temp_threshold=22.0, humidity_threshold=60.0, prefer_latency=False,
+                 snapshot_path=SNAPSHOT_FILE, stats_window=stream_stats.DEFAULT_WINDOW,
+                 smooth_control=False, archive_window=tsblocks.DEFAULT_WINDOW,
+                 db_profile=storage.DEFAULT_DB_PROFILE, recent_keys=ingest.DEFAULT_RECENT_KEYS,
+                 aggregate_bucket=stream_stats.DEFAULT_BUCKET, share_group=None, instance_id=None,
+                 lease_ttl=cluster.DEFAULT_LEASE_TTL, storage_engine=storage.DEFAULT_ENGINE,
+                 storage_path=None, client=None, db=None):
+        """
+        client and db replace the paho client and the storage engine (benchmarks).
+        With share_group the instance joins a group of servers sharing the
+        sensor stream; only the holder of the group's lease commands the LEDs
+        and writes the snapshot, whose name then carries the instance id: it
+        must be given and stay the same across restarts.
+        """
+        if share_group and snapshot_path and not instance_id:
+            raise ValueError("a group member with a snapshot needs a stable instance_id")
         self.broker = broker
-        self.db = EnvironmentDB()
+        self.share_group = share_group
+        self.instance_id = instance_id or cluster.default_instance_id()
+        # redelivered readings are dropped before they reach the database
+        self.recent_keys = ingest.RecentKeys(recent_keys)
+        self.ingest = ingest.IngestCounters()
+        # event time: only readings at or after the watermark drive the control
+        # state, every reading lands in the bucketed aggregates
+        self.watermarks = ingest.Watermarks()
+        self.aggregates = stream_stats.EventTimeAggregates(bucket=aggregate_bucket)
+        if snapshot_path and share_group:
+            # instances of one host must not replace each other's snapshot
+            root, ext = os.path.splitext(snapshot_path)
+            snapshot_path = "%s.%s%s" % (root, self.instance_id, ext)
+        self.snapshot_path = snapshot_path
+        self.snapshot_writer = None
+        if snapshot_path:
+            self.snapshot_writer = SnapshotWriter(snapshot_path)
+            self.snapshot_writer.start()
+        # live rolling statistics per zone and metric, no SQL aggregation
+        self.stats = stream_stats.StreamStats(window=stats_window)
+        self.smooth_control = smooth_control
+        # readings older than the current archive window are compressed (0 disables)
+        self.archive_window = archive_window
+        self.next_archive = time.monotonic() + ARCHIVE_CHECK_INTERVAL
+        with startup_profile.phase("open_db"):
+            self.db = db if db is not None else storage.create_storage(storage_engine, storage_path, db_profile)
         self.temp_threshold = float(temp_threshold)
         self.humidity_threshold = float(humidity_threshold)
-        self.client = mqtt.Client()
+        self.client = client if client is not None else mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.lease = None
+        if share_group:
+            self.lease = cluster.Lease("%s/actuators" % share_group, self.instance_id, self.client.publish,
+                                       lease_ttl, on_acquired=self.on_lease_acquired,
+                                       on_lost=self.on_lease_lost)
+            # the broker releases the lease for us if the connection drops
+            self.lease.set_will(self.client)
         self.last_temp_led_state = None
         self.last_humidity_led_state = None
+        self.broker_connected = False
+        # per-zone last values, kept in memory for the control rules
+        self.zones = {}
+        self.last_snapshot = 0.0
+        with startup_profile.phase("restore_state"):
+            self.restore_state()
+            self.seed_watermarks()
+        # reconnects with backoff and re-subscribes after every reconnect;
+        # broker may be a 'host[:port],...' list of a primary and standbys
+        pool = mqtt_connection.BrokerPool(mqtt_connection.parse_brokers(broker, 1883),
+                                          prefer_latency=prefer_latency)
+        self.connection = mqtt_connection.ConnectionManager(self.client, broker, 1883, 60, pool=pool)
+        self.connection.subscribe(self.ingest_topic(SENSOR_TEMP_TOPIC))
+        self.connection.subscribe(self.ingest_topic(SENSOR_HUMIDITY_TOPIC))
+        self.connection.subscribe(self.ingest_topic(telemetry.TOPIC_FILTER), callback=self.on_telemetry)
+        if self.lease is not None:
+            self.connection.subscribe(self.lease.topic, cluster.LEASE_QOS, callback=self.lease.on_message)
+            self.connection.subscribe(cluster.peer_topic(share_group), callback=self.on_peer_reading)
+        self.connection.add_state_listener(self.on_connection_state)
+
+    def ingest_topic(self, topic):
+        # in a group every reading (and telemetry summary) goes to one instance
+        return cluster.shared_topic(self.share_group, topic) if self.share_group else topic
 
     def on_connect(self, client, userdata, flags, rc):
-        print("Server connected to broker, subscribing to sensor topics")
-        client.subscribe(SENSOR_TEMP_TOPIC)
-        client.subscribe(SENSOR_HUMIDITY_TOPIC)
+        if rc == 0:
+            startup_profile.mark("mqtt_connected")
+            logger.info("Server connected to broker %s, subscribing to sensor topics",
+                        self.connection.broker)
+
+    def on_connection_state(self, state):
+        was_connected = self.broker_connected
+        self.broker_connected = (state == mqtt_connection.CONNECTED)
+        if self.lease is not None:
+            if self.broker_connected:
+                self.lease.connected()
+            else:
+                self.lease.disconnected()
+        if self.broker_connected:
+            # the broker may have lost its retained messages (e.g. restarted
+            # without persistence): republish the restored commands right away
+            self.publish_led_states()
+        elif was_connected and state == mqtt_connection.DISCONNECTED:
+            logger.warning("Lost connection to broker %s, reconnecting (%s)",
+                           self.connection.broker, self.connection.metrics())
 
     def on_message(self, client, userdata, message):
         try:
@@ -97,74 +205,383 @@ class BrokerServer:
             temperature = float(temperature) if temperature is not None else None
             humidity = float(humidity) if humidity is not None else None
         except Exception as e:
-            print(f"Failed to parse message {message.topic}: {e}")
+            logger.warning("Failed to parse message %s: %s", message.topic, e)
             return
 
         if zone is None:
-            print(f"Ignoring message without zone: {payload}")
+            logger.warning("Ignoring message without zone: %s", payload)
             return
 
         if temperature is None and humidity is None:
-            print(f"Ignoring message without temperature or humidity: {payload}")
+            logger.warning("Ignoring message without temperature or humidity: %s", payload)
+            return
+
+        # validated before the recent keys, malformed readings must not take their slots
+        try:
+            event_ms = tsblocks.iso_to_millis(ts)
+        except (TypeError, ValueError, AttributeError):
+            logger.warning("Ignoring reading with invalid timestamp: %s", payload)
+            return
+
+        logger.debug("Received %s temp=%sC hum=%s%% @ %s", zone, temperature, humidity, ts)
+        self.ingest.received += 1
+        if not self.is_new(zone, temperature, humidity, event_ms):
+            self.ingest.duplicates += 1
+            logger.debug("Dropped duplicate reading of %s @ %s", zone, ts)
+            return
+        stored = self.db.insert(zone, temperature, humidity, ts)
+        if not stored:
+            self.ingest.duplicates_db += 1
+            logger.debug("Dropped duplicate reading of %s @ %s (already stored)", zone, ts)
             return
+        self.ingest.stored += 1
+
+        live = self.apply_event_time(zone, temperature if "temperature" in stored else None,
+                                     humidity if "humidity" in stored else None, event_ms)
+        if live:
+            self.apply_live(zone, live, ts, event_ms)
+            if self.lease is not None:
+                self.forward_live(zone, live, ts)
+        else:
+            self.ingest.late += 1
+            logger.debug("Late reading of %s @ %s amended into history and statistics", zone, ts)
+        if time.monotonic() - self.last_snapshot >= SNAPSHOT_INTERVAL:
+            self.save_snapshot()
+        if self.archive_window and time.monotonic() >= self.next_archive:
+            self.archive_readings()
+        if startup_profile.mark("first_reading_stored"):
+            startup_profile.report(logger)
 
-        print(f"Received {zone} temp={temperature}C hum={humidity}% @ {ts}")
-        self.db.insert(zone, temperature, humidity, ts)
+    def is_new(self, zone, temperature, humidity, event_ms):
+        """False if every metric of the reading was seen recently."""
+        new = False
+        # keyed by the measurement time, not by how its timestamp was written
+        for metric, value in (("temperature", temperature), ("humidity", humidity)):
+            if value is not None and self.recent_keys.add((zone, metric, event_ms)):
+                new = True
+        return new
+
+    def apply_event_time(self, zone, temperature, humidity, event_ms):
+        """
+        Adds the values to their aggregate buckets and returns {metric: value}
+        of the live ones; late values are amended into the rolling statistics.
+        """
+        live = {}
+        for metric, value in (("temperature", temperature), ("humidity", humidity)):
+            if value is None:
+                continue
+            if not self.aggregates.add(zone, metric, value, event_ms):
+                self.ingest.expired += 1
+            if self.watermarks.advance(zone, metric, event_ms):
+                live[metric] = value
+            else:
+                self.stats.amend(zone, metric, value, event_ms / 1000.0)
+        return live
+
+    def apply_live(self, zone, live, ts, event_ms):
+        """Moves the control state with the live values {metric: value} of a reading."""
+        self.update_zone(zone, live.get("temperature"), live.get("humidity"), ts)
+        for metric, value in live.items():
+            self.stats.update(zone, metric, value, event_ms / 1000.0)
         self.evaluate_and_publish()
 
+    def forward_live(self, zone, live, ts):
+        # the other instances of the group did not see this reading
+        message = {"instance": self.instance_id, "zone": zone, "timestamp": ts}
+        message.update(live)
+        self.client.publish(cluster.peer_topic(self.share_group), json.dumps(message))
+
+    def on_peer_reading(self, client, userdata, message):
+        """Live reading ingested by another instance of the group."""
+        try:
+            data = json.loads(message.payload.decode("utf-8"))
+            if data.get("instance") == self.instance_id:
+                return
+            zone, ts = data["zone"], data["timestamp"]
+            event_ms = tsblocks.iso_to_millis(ts)
+            values = {metric: float(data[metric]) for metric in ("temperature", "humidity")
+                      if data.get(metric) is not None}
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.warning("Failed to parse peer reading %s: %s", message.topic, e)
+            return
+        self.ingest.peer += 1
+        live = {metric: value for metric, value in values.items()
+                if self.watermarks.advance(zone, metric, event_ms)}
+        if live:
+            self.apply_live(zone, live, ts, event_ms)
+
+    def is_leader(self):
+        """True if this instance commands the actuators."""
+        return self.lease is None or self.lease.is_held()
+
+    def on_lease_acquired(self):
+        # the previous holder may have stopped before publishing the latest state
+        self.publish_led_states()
+
+    def on_lease_lost(self):
+        logger.warning("Instance %s no longer commands the actuators", self.instance_id)
+
+    def seed_watermarks(self):
+        # readings replayed after a restart must not overwrite the restored state
+        for zone, state in self.zones.items():
+            try:
+                event_ms = tsblocks.iso_to_millis(state.get("timestamp") or "")
+            except ValueError:
+                continue
+            for metric in ("temperature", "humidity"):
+                if state.get(metric) is not None:
+                    self.watermarks.advance(zone, metric, event_ms)
+
+    def zone_aggregates(self, zone, metric, start=None, end=None):
+        """[(bucket start, count, mean, min, max)] by event time, ISO timestamps."""
+        start_ms = tsblocks.iso_to_millis(start) if start else None
+        end_ms = tsblocks.iso_to_millis(end) if end else None
+        return [(tsblocks.millis_to_iso(bucket), count, mean, low, high)
+                for bucket, count, mean, low, high in self.aggregates.query(zone, metric, start_ms, end_ms)]
+
+    def ingest_stats(self):
+        """Received, stored, duplicate and late reading counts."""
+        stats = self.ingest.as_dict()
+        stats["recent_keys"] = len(self.recent_keys)
+        return stats
+
+    def on_telemetry(self, client, userdata, message):
+        """Stores the resource telemetry summary of a thing."""
+        try:
+            thing, ts, resources = telemetry.parse_summary(message.payload.decode("utf-8"))
+        except Exception as e:
+            logger.warning("Failed to parse telemetry %s: %s", message.topic, e)
+            return
+        thing = thing or telemetry.thing_of(message.topic)
+        ts = ts or datetime.utcnow().isoformat() + "Z"
+        try:
+            self.db.insert_telemetry(thing, ts, resources)
+        except storage.ERRORS + (AttributeError,) as e:
+            logger.warning("Failed to store telemetry of %s: %s", thing, e)
+            return
+        logger.debug("Stored telemetry of %s (%d resources)", thing, len(resources))
+
     def evaluate_and_publish(self):
-        """Check thresholds and publish LED commands"""
-        # Temperature: LED ON if temp < threshold (heating needed)
-        red_temp = self.db.last_temperature('red')
-        purple_temp = self.db.last_temperature('purple')
+        """Check thresholds and publish LED commands (only the lease holder publishes)"""
+        new_state_temp, new_state_hum = self.desired_led_states()
+        changed = False
+        leader = self.is_leader()
+
+        if new_state_temp != self.last_temp_led_state:
+            if leader:
+                self.client.publish(LED_TEMP_TOPIC, new_state_temp, retain=True)
+                logger.info("Published temperature LED command: %s", new_state_temp)
+            self.last_temp_led_state = new_state_temp
+            changed = True
+
+        if new_state_hum != self.last_humidity_led_state:
+            if leader:
+                self.client.publish(LED_HUMIDITY_TOPIC, new_state_hum, retain=True)
+                logger.info("Published humidity LED command: %s", new_state_hum)
+            self.last_humidity_led_state = new_state_hum
+            changed = True
+
+        if changed:
+            self.save_snapshot()
 
+    def desired_led_states(self):
+        # Temperature: LED ON if temp < threshold (heating needed)
         should_on_temp = False
-        for val in (red_temp, purple_temp):
+        for zone in CONTROL_ZONES:
+            val = self.control_value(zone, "temperature")
             if val is not None and val < self.temp_threshold:
                 should_on_temp = True
                 break
 
-        new_state_temp = 'ON' if should_on_temp else 'OFF'
-        if new_state_temp != self.last_temp_led_state:
-            self.client.publish(LED_TEMP_TOPIC, new_state_temp)
-            print(f"Published temperature LED command: {new_state_temp}")
-            self.last_temp_led_state = new_state_temp
-
         # Humidity: LED ON if humidity > threshold (dehumidifier needed)
-        red_hum = self.db.last_humidity('red')
-        purple_hum = self.db.last_humidity('purple')
-
         should_on_hum = False
-        for val in (red_hum, purple_hum):
+        for zone in CONTROL_ZONES:
+            val = self.control_value(zone, "humidity")
             if val is not None and val > self.humidity_threshold:  # invertito: > invece di <
                 should_on_hum = True
                 break
 
-        new_state_hum = 'ON' if should_on_hum else 'OFF'
-        if new_state_hum != self.last_humidity_led_state:
-            self.client.publish(LED_HUMIDITY_TOPIC, new_state_hum)
-            print(f"Published humidity LED command: {new_state_hum}")
-            self.last_humidity_led_state = new_state_hum
+        return ('ON' if should_on_temp else 'OFF'), ('ON' if should_on_hum else 'OFF')
+
+    def control_value(self, zone, metric):
+        """Value the control rules compare: last reading, or its EWMA when smoothing."""
+        if self.smooth_control:
+            stats = self.stats.get(zone, metric)
+            if stats is not None:
+                return stats.ewma.value
+        return self.zones.get(zone, {}).get(metric)
+
+    def zone_stats(self, zone=None):
+        """Rolling statistics per zone and metric (all zones if zone is None)."""
+        return self.stats.snapshot(zone)
+
+    def update_zone(self, zone, temperature, humidity, timestamp):
+        state = self.zones.setdefault(zone, {"temperature": None, "humidity": None, "timestamp": None})
+        if temperature is not None:
+            state["temperature"] = temperature
+        if humidity is not None:
+            state["humidity"] = humidity
+        state["timestamp"] = timestamp
+
+    def archive_readings(self):
+        self.next_archive = time.monotonic() + ARCHIVE_CHECK_INTERVAL
+        try:
+            archived = self.db.archive(self.archive_window)
+        except storage.ERRORS as e:
+            logger.warning("Archiving readings failed: %s", e)
+            return
+        if archived:
+            logger.info("Archived %d readings into compressed blocks", archived)
+
+    def publish_led_states(self):
+        """Publish the known LED commands as retained messages."""
+        if not self.is_leader():
+            return
+        if self.last_temp_led_state is not None:
+            self.client.publish(LED_TEMP_TOPIC, self.last_temp_led_state, retain=True)
+        if self.last_humidity_led_state is not None:
+            self.client.publish(LED_HUMIDITY_TOPIC, self.last_humidity_led_state, retain=True)
+
+    def restore_state(self):
+        """Warm start from the snapshot file, or from the DB in one query."""
+        snapshot = None
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path) as f:
+                    snapshot = json.load(f)
+                self.zones = dict(snapshot["zones"])
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning("Ignoring unreadable snapshot %s: %s", self.snapshot_path, e)
+                snapshot = None
+
+        if snapshot is None:
+            self.zones = self.db.latest_per_zone()
+            source = "database"
+        else:
+            source = self.snapshot_path
+
+        # the LED states follow from the restored values and thresholds, which
+        # may have changed since the snapshot was taken
+        if self.zones:
+            self.last_temp_led_state, self.last_humidity_led_state = self.desired_led_states()
+        logger.info("Restored state of %d zones from %s (LEDs: temperature %s, humidity %s)",
+                    len(self.zones), source, self.last_temp_led_state, self.last_humidity_led_state)
+
+    def save_snapshot(self):
+        """Hands the current state to the snapshot writer (lease holder only)."""
+        self.last_snapshot = time.monotonic()
+        if self.snapshot_writer is None or not self.is_leader():
+            return
+        # copied here, the writer thread must not see later updates half applied
+        self.snapshot_writer.submit({
+            "saved_at": datetime.utcnow().isoformat() + "Z",
+            "led": {"temperature": self.last_temp_led_state, "humidity": self.last_humidity_led_state},
+            "zones": {zone: dict(state) for zone, state in self.zones.items()},
+        })
 
     def start(self):
-        self.client.connect(self.broker, 1883, 60)
-        self.client.loop_forever()
+        if self.lease is not None:
+            self.lease.start()
+        # network loop in the calling thread until stop()
+        self.connection.run()
+
+    def stop(self):
+        logger.info("Ingest: %s", self.ingest_stats())
+        # while the lease is still held
+        self.save_snapshot()
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.stop()
+        if self.lease is not None:
+            # hand over before disconnecting, the group does not wait for the TTL
+            self.lease.release()
+            self.client.loop(timeout=0.5)
+        self.connection.stop()
+        self.db.close()
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--broker", default="localhost", help="Broker IP to connect to (where Mosquitto runs)")
+    parser.add_argument(
+        "--broker", default="localhost",
+        help="Broker to connect to (where Mosquitto runs); host[:port],... adds standbys for failover"
+    )
+    parser.add_argument(
+        "--prefer-latency", action="store_true", help="Connect to the reachable broker with the lowest latency"
+    )
     parser.add_argument("--threshold", type=float, default=22.0, help="Temperature threshold (C)")
     parser.add_argument(
         "--humidity-threshold", type=float, default=60.0, help="Humidity threshold (%) for green LED"
     )
+    parser.add_argument(
+        "--snapshot", default=SNAPSHOT_FILE, help="State snapshot file used for a warm start (empty to disable)"
+    )
+    parser.add_argument(
+        "--stats-window", type=int, default=stream_stats.DEFAULT_WINDOW,
+        help="Readings kept per zone and metric for the rolling statistics"
+    )
+    parser.add_argument(
+        "--aggregate-bucket", type=int, default=stream_stats.DEFAULT_BUCKET,
+        help="Seconds of event time per aggregate bucket (late readings amend their bucket)"
+    )
+    parser.add_argument(
+        "--smooth-control", action="store_true", help="Compare the EWMA of the readings against the thresholds"
+    )
+    parser.add_argument(
+        "--archive-window", type=int, default=tsblocks.DEFAULT_WINDOW,
+        help="Seconds per compressed block of archived readings (0 keeps raw rows only)"
+    )
+    parser.add_argument(
+        "--db-profile", choices=sorted(storage.DB_PROFILES), default=storage.DEFAULT_DB_PROFILE,
+        help="Durability/speed profile: safe (synchronous FULL), balanced, fast (synchronous OFF)"
+    )
+    parser.add_argument(
+        "--storage", choices=storage.SERVER_ENGINES, default=storage.DEFAULT_ENGINE,
+        help="Storage engine: sqlite, or memory (nothing persisted, tests only)"
+    )
+    parser.add_argument(
+        "--storage-path", default=None, help="File of the sqlite engine (default %s)" % storage.DB_FILE
+    )
+    parser.add_argument(
+        "--share-group", default=None,
+        help="Join a group of server instances sharing the sensor stream; the lease holder commands the LEDs"
+    )
+    parser.add_argument(
+        "--instance-id", default=None,
+        help="Name of this instance in the group, kept across restarts (names its snapshot file; "
+             "default host-pid only without --snapshot)"
+    )
+    parser.add_argument(
+        "--lease-ttl", type=float, default=cluster.DEFAULT_LEASE_TTL,
+        help="Seconds without renewal before another instance takes over the actuators"
+    )
+    parser.add_argument(
+        "--profile-startup", action="store_true", help="Log import/initialisation timings up to the first stored reading"
+    )
+    log.add_arguments(parser)
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    log.configure_from_args(args)
+    if args.share_group and args.snapshot and not args.instance_id:
+        # a host-pid id would name a new snapshot file on every start
+        parser.error("--share-group needs a stable --instance-id (or --snapshot '')")
 
-    server = BrokerServer(args.broker, args.threshold, args.humidity_threshold)
+    server = BrokerServer(args.broker, args.threshold, args.humidity_threshold, args.prefer_latency,
+                          args.snapshot, args.stats_window, args.smooth_control, args.archive_window,
+                          args.db_profile, aggregate_bucket=args.aggregate_bucket,
+                          share_group=args.share_group, instance_id=args.instance_id,
+                          lease_ttl=args.lease_ttl, storage_engine=args.storage,
+                          storage_path=args.storage_path)
+    if args.profiling_control:
+        control = profiling.ProfilingControl("server", args.profile_dir)
+        control.install_signal_handlers()
+        # in a group each instance has its own topic, a command profiles one process
+        name = "server/%s" % server.instance_id if args.share_group else "server"
+        server.connection.subscribe(profiling.control_topic(name), callback=control.on_mqtt_message)
     try:
         server.start()
     except KeyboardInterrupt:
-        print("Stopping server")
+        logger.info("Stopping server")
+        server.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+startup_profile.py
+
+Opt-in startup profiling: times every module import (self and cumulative)
+and named initialisation phases, and marks milestones such as the first
+published reading. Enable it before importing anything heavy:
+
+    import startup_profile
+    if '--profile-startup' in sys.argv:
+        startup_profile.enable()
+"""
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+_enabled = False
+_t0 = time.monotonic()
+_lock = threading.Lock()
+
+imports = {}      # module -> [self seconds, cumulative seconds]
+phases = []       # (name, start offset, duration)
+marks = {}        # name -> offset from enable()
+
+_stack = threading.local()
+
+
+def process_age():
+    """Seconds since the kernel started this process (0 if unknown)."""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except Exception:
+        return 0.0
+
+
+class _TimingLoader(object):
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        frames = getattr(_stack, 'frames', None)
+        if frames is None:
+            frames = _stack.frames = []
+        frames.append(0.0)
+        start = time.monotonic()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            total = time.monotonic() - start
+            children = frames.pop()
+            if frames:
+                frames[-1] += total
+            with _lock:
+                imports[module.__name__] = [total - children, total]
+
+
+class _TimingFinder(object):
+
+    @staticmethod
+    def find_spec(name, path=None, target=None):
+        for finder in sys.meta_path:
+            if isinstance(finder, _TimingFinder) or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimingLoader(spec.loader)
+                return spec
+        return None
+
+
+def enable():
+    global _enabled, _t0
+    if _enabled:
+        return
+    _enabled = True
+    _t0 = time.monotonic()
+    sys.meta_path.insert(0, _TimingFinder())
+
+
+def enabled():
+    return _enabled
+
+
+@contextmanager
+def phase(name):
+    if not _enabled:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        with _lock:
+            phases.append((name, start - _t0, time.monotonic() - start))
+
+
+def mark(name):
+    """Records the first time a milestone is reached; True if it was new."""
+    if not _enabled:
+        return False
+    with _lock:
+        if name in marks:
+            return False
+        marks[name] = time.monotonic() - _t0
+        return True
+
+
+def report(logger, top=10):
+    if not _enabled:
+        return
+    with _lock:
+        slowest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        logger.info("startup: process age %.3fs, profiling since %.3fs ago",
+                    process_age(), time.monotonic() - _t0)
+        for name, (own, total) in slowest:
+            logger.info("startup import %-28s self %7.1fms  cumulative %7.1fms",
+                        name, own * 1000.0, total * 1000.0)
+        for name, start, duration in phases:
+            logger.info("startup phase  %-28s at %7.1fms  took %7.1fms",
+                        name, start * 1000.0, duration * 1000.0)
+        for name, offset in sorted(marks.items(), key=lambda item: item[1]):
+            logger.info("startup mark   %-28s at %7.1fms", name, offset * 1000.0)
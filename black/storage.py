@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""
+storage.py
+
+Storage engines of the server. All of them implement Storage, so the
+server does not depend on the one selected with --storage:
+
+    sqlite  - EnvironmentDB, SQLite in WAL mode with a pool of read-only
+              connections; closed windows are archived as compressed blocks
+    log     - LogStorage, an append-only file: ingestion is a sequential
+              write, the readings are indexed in memory (benchmarks only)
+    memory  - MemoryStorage, nothing is written (tests and benchmarks)
+
+Only SERVER_ENGINES can be picked with the server's --storage: the log
+engine has no compaction, so its memory and replay time grow with every
+reading ever stored.
+
+Timestamps are ISO 8601 strings at the interface; a reading is identified
+by (zone, metric, time in milliseconds) and stored once by every engine,
+whatever form its timestamp was written in ('Z' or '+00:00', with or
+without fractions).
+"""
+import bisect
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import log
+import tsblocks
+
+ENGINES = ('sqlite', 'log', 'memory')
+SERVER_ENGINES = ('sqlite', 'memory')
+DEFAULT_ENGINE = 'sqlite'
+DB_FILE = "temperatures.db"
+LOG_FILE = "temperatures.log"
+READ_POOL_SIZE = 2  # read-only connections, reads run next to the writer in WAL mode
+LOG_BUFFER = 64 * 1024  # bytes buffered by the log file before a write reaches the OS
+LOG_FSYNC_INTERVAL = 1.0  # seconds between fsyncs of the log with the balanced profile
+
+# durability/speed trade-off per deployment (cache_size < 0 is in KiB)
+DB_PROFILES = {
+    "safe": {"synchronous": "FULL", "cache_size": -2000, "mmap_size": 0},
+    "balanced": {"synchronous": "NORMAL", "cache_size": -8000, "mmap_size": 64 * 1024 * 1024},
+    "fast": {"synchronous": "OFF", "cache_size": -32000, "mmap_size": 256 * 1024 * 1024},
+}
+DEFAULT_DB_PROFILE = "balanced"
+
+# what a failing engine raises, besides programming errors
+ERRORS = (sqlite3.Error, OSError)
+
+# PRAGMA user_version of a database whose reading timestamps are normalised
+SCHEMA_VERSION = 1
+
+logger = log.setup_custom_logger("storage")
+
+
+class Storage(object):
+    """Interface every storage engine implements."""
+
+    name = 'base'
+
+    def insert(self, zone, temperature, humidity, timestamp):
+        """Stores one reading per metric; returns the metrics that were not stored yet."""
+        raise NotImplementedError
+
+    def insert_telemetry(self, thing, timestamp, resources):
+        """Stores a telemetry summary, {resource: summary} as published by the thing."""
+        raise NotImplementedError
+
+    def last_temperature(self, zone):
+        raise NotImplementedError
+
+    def last_humidity(self, zone):
+        raise NotImplementedError
+
+    def latest_per_zone(self):
+        """{zone: {"temperature", "humidity", "timestamp"}} of the readings measured last."""
+        raise NotImplementedError
+
+    def range(self, zone, metric, start, end):
+        """[(iso timestamp, value)] of zone/metric in [start, end)."""
+        raise NotImplementedError
+
+    def archive(self, window=tsblocks.DEFAULT_WINDOW, now_ms=None):
+        """Compacts the readings of closed windows; returns how many were archived."""
+        return 0
+
+    def close(self):
+        pass
+
+
+class EnvironmentDB(Storage):
+    """
+    SQLite in WAL mode: one writer connection (serialised by self.lock) and
+    a pool of read-only connections, so queries do not wait for ingestion.
+    Timestamps are stored normalised (tsblocks.normalize_iso), so the unique
+    key and ORDER BY timestamp work on the measurement time. Archived
+    readings are no longer in the unique index; a reading at or before the
+    newest archived one is checked against the blocks instead.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, filename=DB_FILE, profile=DEFAULT_DB_PROFILE, readers=READ_POOL_SIZE):
+        self.filename = filename
+        self.profile = DB_PROFILES[profile]
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.wal = self.conn.execute("PRAGMA journal_mode=WAL").fetchone()[0].lower() == "wal"
+        self._configure(self.conn)
+        self.conn.execute("PRAGMA synchronous=%s" % self.profile["synchronous"])
+        self._init_db()
+        self.archived_until = tsblocks.archived_until(self.conn)
+        self.lock = threading.Lock()
+        self.readers = queue.Queue()
+        # an in-memory database has no WAL and cannot be shared, reads use the writer
+        for _ in range(readers if self.wal else 0):
+            self.readers.put(self._open_reader())
+
+    def _configure(self, conn):
+        conn.execute("PRAGMA cache_size=%d" % self.profile["cache_size"])
+        conn.execute("PRAGMA mmap_size=%d" % self.profile["mmap_size"])
+
+    def _open_reader(self):
+        uri = "file:%s?mode=ro" % os.path.abspath(self.filename)
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._configure(conn)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """A read-only connection from the pool (the writer's without WAL)."""
+        if not self.wal:
+            with self.lock:
+                yield self.conn
+            return
+        conn = self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
+
+    def close(self):
+        while not self.readers.empty():
+            self.readers.get().close()
+        with self.lock:
+            self.conn.close()
+
+    def _init_db(self):
+        cur = self.conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS readings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                zone TEXT NOT NULL,
+                temperature REAL,
+                humidity REAL,
+                timestamp TEXT NOT NULL,
+                metric TEXT
+            )
+        """)
+        # Backward-compatible migration if the table already exists without humidity
+        cur.execute("PRAGMA table_info(readings)")
+        columns = {row[1] for row in cur.fetchall()}
+        if "humidity" not in columns:
+            cur.execute("ALTER TABLE readings ADD COLUMN humidity REAL")
+        if "metric" not in columns:
+            cur.execute("ALTER TABLE readings ADD COLUMN metric TEXT")
+            self._migrate_to_metric_rows(cur)
+        if cur.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._normalize_timestamps(cur)
+            cur.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        # a reading is stored once, redeliveries are ignored
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS readings_key ON readings(zone, metric, timestamp)")
+        # resource telemetry summaries published by the things
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS telemetry (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                thing TEXT NOT NULL,
+                resource TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                window REAL,
+                polls INTEGER,
+                configured_period REAL,
+                period REAL,
+                period_max REAL,
+                read_ms REAL,
+                read_p50 REAL,
+                read_p95 REAL,
+                read_max REAL,
+                failed_reads INTEGER,
+                publishes INTEGER,
+                commands INTEGER,
+                wait_ms REAL,
+                jitter_ms REAL,
+                missed INTEGER
+            )
+        """)
+        cur.execute("PRAGMA table_info(telemetry)")
+        columns = {row[1] for row in cur.fetchall()}
+        if "jitter_ms" not in columns:
+            cur.execute("ALTER TABLE telemetry ADD COLUMN jitter_ms REAL")
+            cur.execute("ALTER TABLE telemetry ADD COLUMN missed INTEGER")
+        cur.execute("CREATE INDEX IF NOT EXISTS telemetry_thing_time ON telemetry(thing, timestamp)")
+        self.conn.commit()
+        # compressed blocks of archived readings
+        tsblocks.init_schema(self.conn)
+
+    @staticmethod
+    def _migrate_to_metric_rows(cur):
+        # one row per metric, then drop the duplicates the unique key forbids
+        cur.execute(
+            "INSERT INTO readings(zone, humidity, timestamp, metric) SELECT zone, humidity, timestamp, 'humidity' "
+            "FROM readings WHERE metric IS NULL AND temperature IS NOT NULL AND humidity IS NOT NULL"
+        )
+        cur.execute(
+            "UPDATE readings SET humidity = NULL, metric = 'temperature' "
+            "WHERE metric IS NULL AND temperature IS NOT NULL AND humidity IS NOT NULL"
+        )
+        cur.execute("UPDATE readings SET metric = 'temperature' WHERE metric IS NULL AND temperature IS NOT NULL")
+        cur.execute("UPDATE readings SET metric = 'humidity' WHERE metric IS NULL AND humidity IS NOT NULL")
+        cur.execute(
+            "DELETE FROM readings WHERE id NOT IN (SELECT MIN(id) FROM readings GROUP BY zone, metric, timestamp)"
+        )
+
+    @staticmethod
+    def _normalize_timestamps(cur):
+        # rows written before the timestamps were normalised; the same instant
+        # in two forms becomes a duplicate, which is dropped like above
+        cur.execute("DROP INDEX IF EXISTS readings_key")
+        updates = []
+        for row_id, timestamp in cur.execute("SELECT id, timestamp FROM readings").fetchall():
+            try:
+                normalized = tsblocks.normalize_iso(timestamp)
+            except (TypeError, ValueError):
+                continue
+            if normalized != timestamp:
+                updates.append((normalized, row_id))
+        cur.executemany("UPDATE readings SET timestamp = ? WHERE id = ?", updates)
+        cur.execute(
+            "DELETE FROM readings WHERE id NOT IN (SELECT MIN(id) FROM readings GROUP BY zone, metric, timestamp)"
+        )
+
+    def insert(self, zone, temperature, humidity, timestamp):
+        """Stores one row per metric; returns the metrics that were not stored yet."""
+        millis = tsblocks.iso_to_millis(timestamp)
+        timestamp = tsblocks.millis_to_iso(millis)
+        stored = []
+        with self.lock:
+            cur = self.conn.cursor()
+            if self.archived_until is not None and millis <= self.archived_until:
+                # redelivery of an archived reading: its raw row is gone
+                if temperature is not None and tsblocks.is_archived(self.conn, zone, "temperature", millis):
+                    temperature = None
+                if humidity is not None and tsblocks.is_archived(self.conn, zone, "humidity", millis):
+                    humidity = None
+            if temperature is not None:
+                cur.execute(
+                    "INSERT OR IGNORE INTO readings(zone, temperature, timestamp, metric) "
+                    "VALUES (?, ?, ?, 'temperature')",
+                    (zone, temperature, timestamp),
+                )
+                if cur.rowcount:
+                    stored.append("temperature")
+            if humidity is not None:
+                cur.execute(
+                    "INSERT OR IGNORE INTO readings(zone, humidity, timestamp, metric) "
+                    "VALUES (?, ?, ?, 'humidity')",
+                    (zone, humidity, timestamp),
+                )
+                if cur.rowcount:
+                    stored.append("humidity")
+            self.conn.commit()
+        return stored
+
+    def insert_telemetry(self, thing, timestamp, resources):
+        """One row per resource of a telemetry summary."""
+        rows = [(thing, name, timestamp, s.get("win"), s.get("polls"), s.get("cfg"), s.get("period"),
+                 s.get("period_max"), s.get("read_ms"), s.get("read_p50"), s.get("read_p95"),
+                 s.get("read_max"), s.get("fail"), s.get("pub"), s.get("cmd", 0), s.get("wait_ms"),
+                 s.get("jit_ms"), s.get("missed", 0))
+                for name, s in resources.items()]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO telemetry(thing, resource, timestamp, window, polls, configured_period, period,"
+                " period_max, read_ms, read_p50, read_p95, read_max, failed_reads, publishes, commands,"
+                " wait_ms, jitter_ms, missed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+    def last_temperature(self, zone):
+        """Temperature measured last (event time, not arrival order)."""
+        with self.reader() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT temperature FROM readings WHERE zone = ? AND metric = 'temperature' "
+                "ORDER BY timestamp DESC LIMIT 1",
+                (zone,),
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def last_humidity(self, zone):
+        """Humidity measured last (event time, not arrival order)."""
+        with self.reader() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT humidity FROM readings WHERE zone = ? AND metric = 'humidity' "
+                "ORDER BY timestamp DESC LIMIT 1",
+                (zone,),
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def latest_per_zone(self):
+        """Temperature and humidity measured last in every zone, in one query."""
+        with self.reader() as conn:
+            cur = conn.cursor()
+            # skip-scan of the unique index (zone, metric, timestamp): the newest
+            # reading of a series is its last index entry, the next series
+            # starts right after it; two seeks per series, no table scan
+            rows = []
+            key = cur.execute(
+                "SELECT zone, metric FROM readings WHERE metric IS NOT NULL ORDER BY zone, metric LIMIT 1"
+            ).fetchone()
+            while key is not None:
+                temperature, humidity, timestamp = cur.execute(
+                    "SELECT temperature, humidity, timestamp FROM readings WHERE zone = ? AND metric = ? "
+                    "ORDER BY timestamp DESC LIMIT 1",
+                    key,
+                ).fetchone()
+                rows.append((key[0], temperature, humidity, timestamp))
+                key = cur.execute(
+                    "SELECT zone, metric FROM readings WHERE (zone, metric, timestamp) > (?, ?, ?) AND metric IS NOT NULL "
+                    "ORDER BY zone, metric, timestamp LIMIT 1",
+                    (key[0], key[1], timestamp),
+                ).fetchone()
+
+        zones = {}
+        for zone, temperature, humidity, timestamp in rows:
+            state = zones.setdefault(zone, {"temperature": None, "humidity": None, "timestamp": None})
+            if temperature is not None:
+                state["temperature"] = temperature
+            if humidity is not None:
+                state["humidity"] = humidity
+            state["timestamp"] = max(timestamp, state["timestamp"] or timestamp)
+
+        # zones that stopped reporting may only be left in archived blocks
+        with self.reader() as conn:
+            archived = tsblocks.latest_values(conn)
+        for (zone, metric), (millis, value) in archived.items():
+            state = zones.setdefault(zone, {"temperature": None, "humidity": None, "timestamp": None})
+            if state.get(metric) is None:
+                state[metric] = value
+                state["timestamp"] = state["timestamp"] or tsblocks.millis_to_iso(millis)
+        return zones
+
+    def archive(self, window=tsblocks.DEFAULT_WINDOW, now_ms=None):
+        """Compress the readings of closed windows into blocks."""
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        with self.lock:
+            archived = tsblocks.archive_closed_windows(self.conn, now_ms, window)
+            self.archived_until = tsblocks.archived_until(self.conn)
+            return archived
+
+    def range(self, zone, metric, start, end):
+        """[(iso timestamp, value)] of zone/metric in [start, end), archived or not."""
+        with self.reader() as conn:
+            points = tsblocks.query_range(conn, zone, metric,
+                                          tsblocks.iso_to_millis(start), tsblocks.iso_to_millis(end))
+        return [(tsblocks.millis_to_iso(millis), value) for millis, value in points]
+
+
+
+class MemoryStorage(Storage):
+    """Sorted lists per zone and metric; nothing survives the process."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}  # (zone, metric) -> ([millis], [value]) in time order
+        self.telemetry = []
+
+    def _add(self, zone, metric, millis, value):
+        """False if the series already holds a reading at millis."""
+        times, values = self.series.setdefault((zone, metric), ([], []))
+        if not times or millis > times[-1]:
+            times.append(millis)
+            values.append(value)
+            return True
+        # late reading: insert it in time order
+        i = bisect.bisect_left(times, millis)
+        if i < len(times) and times[i] == millis:
+            return False
+        times.insert(i, millis)
+        values.insert(i, value)
+        return True
+
+    def _stored(self, zone, metric, millis, value):
+        """Called (under the lock) for every new reading."""
+
+    def _commit(self):
+        """Called (under the lock) after an insert stored something."""
+
+    def insert(self, zone, temperature, humidity, timestamp):
+        millis = tsblocks.iso_to_millis(timestamp)
+        stored = []
+        with self.lock:
+            for metric, value in (("temperature", temperature), ("humidity", humidity)):
+                if value is not None and self._add(zone, metric, millis, value):
+                    self._stored(zone, metric, millis, value)
+                    stored.append(metric)
+            if stored:
+                self._commit()
+        return stored
+
+    def insert_telemetry(self, thing, timestamp, resources):
+        with self.lock:
+            self.telemetry.append((thing, timestamp, resources))
+
+    def last_value(self, zone, metric):
+        with self.lock:
+            series = self.series.get((zone, metric))
+            return series[1][-1] if series else None
+
+    def last_temperature(self, zone):
+        """Temperature measured last (event time, not arrival order)."""
+        return self.last_value(zone, "temperature")
+
+    def last_humidity(self, zone):
+        """Humidity measured last (event time, not arrival order)."""
+        return self.last_value(zone, "humidity")
+
+    def latest_per_zone(self):
+        zones = {}
+        with self.lock:
+            for (zone, metric), (times, values) in self.series.items():
+                if not times:
+                    continue
+                state = zones.setdefault(zone, {"temperature": None, "humidity": None, "timestamp": None})
+                state[metric] = values[-1]
+                timestamp = tsblocks.millis_to_iso(times[-1])
+                state["timestamp"] = max(timestamp, state["timestamp"] or timestamp)
+        return zones
+
+    def range(self, zone, metric, start, end):
+        start_ms, end_ms = tsblocks.iso_to_millis(start), tsblocks.iso_to_millis(end)
+        with self.lock:
+            times, values = self.series.get((zone, metric), ((), ()))
+            lo = bisect.bisect_left(times, start_ms)
+            hi = bisect.bisect_left(times, end_ms)
+            points = list(zip(times[lo:hi], values[lo:hi]))
+        return [(tsblocks.millis_to_iso(millis), value) for millis, value in points]
+
+
+class LogStorage(MemoryStorage):
+    """
+    Append-only log: every new reading is one JSON line at the end of the
+    file, so ingestion is a sequential write and nothing on disk is updated
+    in place. The readings are indexed in memory as in MemoryStorage and
+    the log is replayed on open; a torn last line (power loss during a
+    write) is cut off. Durability follows the DB profile: safe fsyncs
+    every insert, balanced flushes every insert to the OS and fsyncs at
+    most every LOG_FSYNC_INTERVAL seconds, fast leaves the lines in the
+    file buffer. There is no archiving or compaction: the log grows by one
+    line per metric, every reading stays indexed in memory and opening
+    replays the whole file. It is kept to compare the write path in the
+    benchmarks and is not offered by the server.
+    """
+
+    name = 'log'
+
+    def __init__(self, filename=LOG_FILE, profile=DEFAULT_DB_PROFILE):
+        MemoryStorage.__init__(self)
+        self.filename = filename
+        self.synchronous = DB_PROFILES[profile]["synchronous"]
+        self.next_fsync = 0.0
+        self._replay()
+        self.log = open(filename, "a", encoding="utf-8", buffering=LOG_BUFFER)
+
+    def _replay(self):
+        try:
+            f = open(self.filename, "rb")
+        except FileNotFoundError:
+            return
+        valid = 0
+        with f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                    if record[0] == "r":
+                        self._add(record[1], record[2], record[3], record[4])
+                except (ValueError, IndexError, TypeError):
+                    break
+                valid += len(line)
+        size = os.path.getsize(self.filename)
+        if valid < size:
+            logger.warning("Cutting %d bytes of torn records off %s", size - valid, self.filename)
+            os.truncate(self.filename, valid)
+
+    def _write(self, record):
+        self.log.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def _stored(self, zone, metric, millis, value):
+        self._write(["r", zone, metric, millis, value])
+
+    def _commit(self):
+        if self.synchronous == "OFF":
+            return
+        self.log.flush()
+        now = time.monotonic()
+        if self.synchronous == "FULL" or now >= self.next_fsync:
+            os.fsync(self.log.fileno())
+            self.next_fsync = now + LOG_FSYNC_INTERVAL
+
+    def insert_telemetry(self, thing, timestamp, resources):
+        # written for offline analysis only, the server does not query it
+        with self.lock:
+            self._write(["t", thing, timestamp, resources])
+            self._commit()
+
+    def close(self):
+        with self.lock:
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.log.close()
+
+
+def create_storage(engine=DEFAULT_ENGINE, filename=None, profile=DEFAULT_DB_PROFILE):
+    """Opens the storage engine `engine`; filename defaults to DB_FILE or LOG_FILE."""
+    if engine == 'sqlite':
+        return EnvironmentDB(filename or DB_FILE, profile)
+    if engine == 'log':
+        return LogStorage(filename or LOG_FILE, profile)
+    if engine == 'memory':
+        return MemoryStorage()
+    raise ValueError("unknown storage engine: %s" % engine)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+stream_stats.py
+
+Incremental statistics per (zone, metric), updated in O(1) (amortised for
+the sliding min/max) as readings arrive: EWMA, rolling mean and variance,
+sliding min/max and rate of change over the last `window` readings. Every
+window is a fixed-size ring buffer, so memory per zone and metric is
+bounded no matter how long the server runs.
+
+Times are event times (when the reading was measured). A late reading,
+measured before the newest one, is amended into its place without
+recomputing the window: the sums of the moments take it (and the reading
+it pushes out) in O(1), the min/max deques only change when it is a new
+candidate, and the EWMA is corrected exactly from the k readings measured
+after it in O(k). A late reading older than a full window only reaches
+the aggregates below.
+
+EventTimeAggregates keeps count/sum/min/max per fixed bucket of event time
+instead: a reading that arrives late is added to the bucket it was
+measured in, in O(1), without recomputing anything.
+"""
+from collections import deque
+
+DEFAULT_WINDOW = 60   # readings
+DEFAULT_ALPHA = 0.2   # EWMA smoothing factor
+DEFAULT_BUCKET = 60          # seconds of event time per aggregate bucket
+DEFAULT_RETENTION = 86400    # seconds of buckets kept behind the newest reading
+
+
+class RingBuffer(object):
+    """Fixed capacity buffer; push() returns the value it overwrote."""
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.items = [None] * capacity
+        self.start = 0
+        self.size = 0
+
+    def push(self, value):
+        if self.size < self.capacity:
+            self.items[(self.start + self.size) % self.capacity] = value
+            self.size += 1
+            return None
+        evicted = self.items[self.start]
+        self.items[self.start] = value
+        self.start = (self.start + 1) % self.capacity
+        return evicted
+
+    def insert(self, index, value):
+        """
+        Puts value before the index-th oldest item (a late value). When full
+        the oldest item goes first and is returned; index must then be >= 1.
+        """
+        evicted = None
+        if self.size == self.capacity:
+            evicted = self.items[self.start]
+            self.start = (self.start + 1) % self.capacity
+            self.size -= 1
+            index -= 1
+        for i in range(self.size, index, -1):
+            self.items[(self.start + i) % self.capacity] = self.items[(self.start + i - 1) % self.capacity]
+        self.items[(self.start + index) % self.capacity] = value
+        self.size += 1
+        return evicted
+
+    def oldest(self):
+        return self.items[self.start] if self.size else None
+
+    def newest(self):
+        return self.items[(self.start + self.size - 1) % self.capacity] if self.size else None
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.items[(self.start + i) % self.capacity]
+
+
+class EWMA(object):
+
+    def __init__(self, alpha=DEFAULT_ALPHA):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, x):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+
+class RollingMoments(object):
+    """Mean and sample variance of the last `window` values."""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.values = RingBuffer(window)
+        self.shift = None    # first value seen, keeps the sums small
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def update(self, x):
+        self.account(x, self.values.push(x))
+
+    def insert(self, index, x):
+        """Adds a late value at position index (0 = oldest) of the window."""
+        self.account(x, self.values.insert(index, x))
+
+    def account(self, x, evicted):
+        if self.shift is None:
+            self.shift = x
+        d = x - self.shift
+        self.total += d
+        self.total_sq += d * d
+        if evicted is not None:
+            e = evicted - self.shift
+            self.total -= e
+            self.total_sq -= e * e
+
+    @property
+    def count(self):
+        return len(self.values)
+
+    @property
+    def mean(self):
+        n = self.count
+        return self.shift + self.total / n if n else None
+
+    @property
+    def variance(self):
+        n = self.count
+        if n < 2:
+            return 0.0 if n else None
+        return max(0.0, (self.total_sq - self.total * self.total / n) / (n - 1))
+
+
+class SlidingExtreme(object):
+    """
+    Min (or max) of a sliding window with a monotonic deque of (key, value)
+    candidates. By default the key is a sequence number and the window the
+    last `window` values; a caller passing its own increasing keys (event
+    times) slides the window itself with expire().
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, maximum=False):
+        self.window = window
+        self.maximum = maximum
+        self.candidates = deque()   # (key, value), both monotonic
+        self.seq = 0
+
+    def dominates(self, a, b):
+        """True if a candidate a makes an older b useless."""
+        return a >= b if self.maximum else a <= b
+
+    def update(self, x, key=None):
+        while self.candidates and self.dominates(x, self.candidates[-1][1]):
+            self.candidates.pop()
+        if key is None:
+            self.candidates.append((self.seq, x))
+            self.expire(self.seq - self.window + 1)
+        else:
+            self.candidates.append((key, x))
+        self.seq += 1
+
+    def insert(self, x, key):
+        """Adds a late value x at key (older than the newest); O(1) unless x becomes a candidate."""
+        # first candidate newer than x, the extreme of the values after it
+        newer = len(self.candidates)
+        while newer > 0 and self.candidates[newer - 1][0] > key:
+            newer -= 1
+        if newer < len(self.candidates) and self.dominates(self.candidates[newer][1], x):
+            return
+        while newer > 0 and self.dominates(x, self.candidates[newer - 1][1]):
+            newer -= 1
+            del self.candidates[newer]
+        self.candidates.insert(newer, (key, x))
+
+    def expire(self, oldest_key):
+        """Drops the candidates with keys before oldest_key (they left the window)."""
+        while self.candidates and self.candidates[0][0] < oldest_key:
+            self.candidates.popleft()
+
+    @property
+    def value(self):
+        return self.candidates[0][1] if self.candidates else None
+
+
+class MetricStats(object):
+    """All statistics of one zone/metric stream."""
+
+    def __init__(self, window=DEFAULT_WINDOW, alpha=DEFAULT_ALPHA):
+        self.window = window
+        self.ewma = EWMA(alpha)
+        self.moments = RollingMoments(window)
+        self.low = SlidingExtreme(window)
+        self.high = SlidingExtreme(window, maximum=True)
+        self.samples = RingBuffer(window)   # (t, value) in event-time order
+        self.last = None
+        self.updates = 0
+
+    def update(self, value, t):
+        self.ewma.update(value)
+        self.moments.update(value)
+        self.low.update(value, t)
+        self.high.update(value, t)
+        if self.samples.push((t, value)) is not None:
+            self.slide()
+        self.last = value
+        self.updates += 1
+
+    def amend(self, value, t):
+        """Inserts a late reading (t before the newest); False if it is older than a full window."""
+        samples = self.samples
+        if not samples or t >= samples.newest()[0]:
+            self.update(value, t)
+            return True
+        if len(samples) == self.window and t <= samples.oldest()[0]:
+            return False
+
+        # EWMA: the k readings after t keep their weights, the late one gets
+        # the weight of its position and everything before ages one step
+        alpha = self.ewma.alpha
+        newer, weight, position = 0.0, alpha, len(samples)
+        items, start, capacity = samples.items, samples.start, samples.capacity
+        while position > 0 and items[(start + position - 1) % capacity][0] > t:
+            position -= 1
+            newer += weight * items[(start + position) % capacity][1]
+            weight *= 1.0 - alpha
+        self.ewma.value = newer + weight * value + (1.0 - alpha) * (self.ewma.value - newer)
+
+        self.moments.insert(position, value)
+        self.low.insert(value, t)
+        self.high.insert(value, t)
+        if samples.insert(position, (t, value)) is not None:
+            self.slide()
+        self.updates += 1
+        return True
+
+    def slide(self):
+        # the oldest reading left the window
+        oldest = self.samples.oldest()[0]
+        self.low.expire(oldest)
+        self.high.expire(oldest)
+
+    @property
+    def rate_of_change(self):
+        """Units per second (event time) between the oldest and newest reading in the window."""
+        if len(self.samples) < 2:
+            return 0.0
+        t0, v0 = self.samples.oldest()
+        t1, v1 = self.samples.newest()
+        return (v1 - v0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def snapshot(self):
+        return {'last': self.last,
+                'ewma': self.ewma.value,
+                'mean': self.moments.mean,
+                'variance': self.moments.variance,
+                'min': self.low.value,
+                'max': self.high.value,
+                'rate_of_change': self.rate_of_change,
+                'count': self.moments.count,
+                'updates': self.updates}
+
+
+class StreamStats(object):
+    """MetricStats per (zone, metric), created on the first reading."""
+
+    def __init__(self, window=DEFAULT_WINDOW, alpha=DEFAULT_ALPHA):
+        self.window = window
+        self.alpha = alpha
+        self.streams = {}
+
+    def update(self, zone, metric, value, t):
+        stats = self.streams.get((zone, metric))
+        if stats is None:
+            stats = self.streams[(zone, metric)] = MetricStats(self.window, self.alpha)
+        stats.update(value, t)
+        return stats
+
+    def amend(self, zone, metric, value, t):
+        """Adds a reading measured at t, before the newest one; False if outside the window."""
+        stats = self.streams.get((zone, metric))
+        if stats is None:
+            self.update(zone, metric, value, t)
+            return True
+        return stats.amend(value, t)
+
+    def get(self, zone, metric):
+        return self.streams.get((zone, metric))
+
+    def snapshot(self, zone=None):
+        """{zone: {metric: stats}}, optionally for a single zone."""
+        result = {}
+        for (z, metric), stats in self.streams.items():
+            if zone is None or z == zone:
+                result.setdefault(z, {})[metric] = stats.snapshot()
+        return result
+
+
+class EventTimeAggregates(object):
+    """
+    [count, sum, min, max] per (zone, metric, bucket start) in event time.
+    Readings older than `retention` behind the newest one of their series
+    are rejected (they remain in the database).
+    """
+
+    def __init__(self, bucket=DEFAULT_BUCKET, retention=DEFAULT_RETENTION):
+        self.bucket_ms = int(bucket * 1000)
+        self.max_buckets = max(1, int(retention // bucket))
+        self.series = {}
+        self.newest = {}
+
+    def add(self, zone, metric, value, event_ms):
+        """Adds a reading to its bucket; False if it is beyond the retention."""
+        key = (zone, metric)
+        start = event_ms - event_ms % self.bucket_ms
+        newest = self.newest.get(key)
+        if newest is None or start > newest:
+            self.newest[key] = newest = start
+        elif start <= newest - self.max_buckets * self.bucket_ms:
+            return False
+
+        buckets = self.series.get(key)
+        if buckets is None:
+            buckets = self.series[key] = {}
+        aggregate = buckets.get(start)
+        if aggregate is None:
+            buckets[start] = [1, value, value, value]
+            self.expire(buckets, newest)
+            return True
+        aggregate[0] += 1
+        aggregate[1] += value
+        if value < aggregate[2]:
+            aggregate[2] = value
+        if value > aggregate[3]:
+            aggregate[3] = value
+        return True
+
+    def expire(self, buckets, newest):
+        # only runs when a bucket is created, about once per bucket period
+        oldest = newest - (self.max_buckets - 1) * self.bucket_ms
+        for start in [s for s in buckets if s < oldest]:
+            del buckets[start]
+
+    def query(self, zone, metric, start_ms=None, end_ms=None):
+        """[(bucket start ms, count, mean, min, max)] with start_ms <= start < end_ms."""
+        buckets = self.series.get((zone, metric), {})
+        result = []
+        for start in sorted(buckets):
+            if (start_ms is not None and start < start_ms) or (end_ms is not None and start >= end_ms):
+                continue
+            count, total, low, high = buckets[start]
+            result.append((start, count, total / count, low, high))
+        return result
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+telemetry.py
+
+Runtime telemetry of the resources of a thing: actual poll period versus
+the configured one, read durations (bucketed), failed reads, publishes,
+actuator commands and the time spent waiting on the GrovePi queue.
+
+Each Sensor/Actuator owns a ResourceTelemetry that only its own thread
+updates (a few additions per poll, no lock). TelemetryReporter swaps the
+counters out every `interval` seconds and publishes one compact JSON
+summary per thing on telemetry/<thing>; the server stores them in its
+telemetry table.
+"""
+import bisect
+import json
+import threading
+import time
+from datetime import datetime
+
+import log
+
+TOPIC_PREFIX = "telemetry"
+TOPIC_FILTER = TOPIC_PREFIX + "/+"
+DEFAULT_INTERVAL = 60.0     # seconds between summaries, 0 disables them
+
+# upper bounds (ms) of the read duration buckets, the last one is open
+READ_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+logger = log.setup_custom_logger("telemetry")
+
+
+def topic(thing):
+    return "%s/%s" % (TOPIC_PREFIX, thing)
+
+
+def thing_of(topic_name):
+    return topic_name.split("/", 1)[1] if "/" in topic_name else topic_name
+
+
+class Window(object):
+    """Counters of one reporting window."""
+
+    __slots__ = ("polls", "period_total", "period_max", "read_total", "read_max",
+                 "read_buckets", "failed_reads", "publishes", "commands")
+
+    def __init__(self):
+        self.polls = 0
+        self.period_total = 0.0
+        self.period_max = 0.0
+        self.read_total = 0.0
+        self.read_max = 0.0
+        self.read_buckets = [0] * (len(READ_BUCKETS_MS) + 1)
+        self.failed_reads = 0
+        self.publishes = 0
+        self.commands = 0
+
+
+def bucket_percentile(buckets, fraction):
+    """Upper bound (ms) of the bucket holding the given fraction of reads."""
+    count = sum(buckets)
+    if count == 0:
+        return None
+    rank, seen = fraction * count, 0
+    for index, n in enumerate(buckets):
+        seen += n
+        if seen >= rank:
+            break
+    return READ_BUCKETS_MS[min(index, len(READ_BUCKETS_MS) - 1)]
+
+
+class ResourceTelemetry(object):
+
+    def __init__(self):
+        self.window = Window()
+        self.window_started = time.monotonic()
+        self.last_poll = None
+
+    # --- called by the resource's own thread ---
+
+    def poll(self, started, duration):
+        window = self.window
+        if self.last_poll is not None:
+            period = started - self.last_poll
+            window.period_total += period
+            if period > window.period_max:
+                window.period_max = period
+        self.last_poll = started
+        window.polls += 1
+        window.read_total += duration
+        if duration > window.read_max:
+            window.read_max = duration
+        window.read_buckets[bisect.bisect_left(READ_BUCKETS_MS, duration * 1000.0)] += 1
+
+    def failed_read(self):
+        self.window.failed_reads += 1
+
+    def published(self):
+        self.window.publishes += 1
+
+    def command(self):
+        self.window.commands += 1
+
+    # --- called by the reporter ---
+
+    def collect(self):
+        """Summary of the window since the last call, starts a new one."""
+        # a sample recorded during the swap may land in the old window
+        window, self.window = self.window, Window()
+        now = time.monotonic()
+        elapsed, self.window_started = now - self.window_started, now
+
+        summary = {"win": round(elapsed, 1), "polls": window.polls,
+                   "fail": window.failed_reads, "pub": window.publishes}
+        if window.commands:
+            summary["cmd"] = window.commands
+        if window.polls:
+            if window.polls > 1:
+                summary["period"] = round(window.period_total / (window.polls - 1), 3)
+                summary["period_max"] = round(window.period_max, 3)
+            summary["read_ms"] = round(window.read_total * 1000.0 / window.polls, 2)
+            summary["read_p50"] = bucket_percentile(window.read_buckets, 0.5)
+            summary["read_p95"] = bucket_percentile(window.read_buckets, 0.95)
+            summary["read_max"] = round(window.read_max * 1000.0, 2)
+        return summary
+
+
+class TelemetryReporter(threading.Thread):
+    """Publishes the telemetry of all resources of a thing periodically."""
+
+    def __init__(self, thing, resources, publish, interval=DEFAULT_INTERVAL):
+        threading.Thread.__init__(self, name="telemetry", daemon=True)
+        self.thing = thing
+        self.resources = resources
+        self.publish = publish
+        self.interval = interval
+        self.topic = topic(thing)
+        self.stop_event = threading.Event()
+        # cumulative GrovePi queue counters per resource at the last summary
+        self.last_waits = {}
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.publish(self.topic, json.dumps(self.summary(), separators=(",", ":")))
+            except Exception:
+                logger.exception("could not publish telemetry")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def summary(self):
+        resources = {}
+        for name, res in self.resources.items():
+            res_telemetry = getattr(res, "telemetry", None)
+            if res_telemetry is None:
+                continue
+            summary = res_telemetry.collect()
+            if getattr(res, "polling_interval", None) is not None:
+                summary["cfg"] = res.polling_interval
+                if res.current_interval != res.polling_interval:
+                    summary["cur"] = round(res.current_interval, 3)
+            schedule = getattr(res, "schedule", None)
+            if schedule is not None:
+                jitter = schedule.stats(reset=True)
+                summary["jit_ms"] = jitter["mean_jitter_ms"]
+                if jitter["missed"]:
+                    summary["missed"] = jitter["missed"]
+            summary.update(self.queue_wait(name, getattr(res, "grovepi_interactor_member", None)))
+            resources[name] = summary
+
+        message = {"thing": self.thing,
+                   "timestamp": datetime.utcnow().isoformat() + "Z",
+                   "resources": resources}
+        queue = self.queue_stats()
+        if queue is not None:
+            message["queue"] = queue
+        return message
+
+    def queue_wait(self, name, member):
+        # the interactor keeps cumulative counters per member, report the delta
+        if member is None:
+            return {}
+        served, wait_total = member.served, member.wait_total
+        last_served, last_total = self.last_waits.get(name, (0, 0.0))
+        self.last_waits[name] = (served, wait_total)
+        if served == last_served:
+            return {}
+        return {"wait_ms": round((wait_total - last_total) * 1000.0 / (served - last_served), 2)}
+
+    def queue_stats(self):
+        if not any(getattr(res, "grovepi_interactor_member", None) is not None
+                   for res in self.resources.values()):
+            return None
+        from grove_pi_interface import GrovePiInteractor
+        stats = GrovePiInteractor.queue_stats()
+        return {"depth": stats["depth"], "dropped": stats["dropped"],
+                "max_wait_ms": round(stats["max_wait"] * 1000.0, 2)}
+
+
+def parse_summary(payload):
+    """Thing, timestamp and per-resource summaries of a telemetry message."""
+    message = json.loads(payload)
+    return message.get("thing"), message.get("timestamp"), message.get("resources", {})
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+tsblocks.py
+
+Compressed block storage for archived readings. Readings of a closed time
+window are encoded per (zone, metric) in the style of Facebook's Gorilla:
+timestamps (milliseconds) as delta-of-delta, values as deltas of scaled
+integers when they are exact decimals or else as the XOR with the previous
+value, so slowly changing series shrink to a few bits per reading.
+Blocks are stored as BLOBs in the reading_blocks table next to the raw
+readings table; query_range() decodes them transparently and merges the
+raw rows that are not archived yet.
+"""
+import struct
+from datetime import datetime, timezone
+
+DEFAULT_WINDOW = 3600        # seconds per block
+METRICS = ("temperature", "humidity")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS reading_blocks (
+        zone TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (zone, metric, start_ms)
+    )
+"""
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def iso_to_millis(text):
+    """ISO 8601 timestamp ('Z' or offset, naive means UTC) -> epoch millis."""
+    if text.endswith("Z"):
+        text = text[:-1]
+    dt = datetime.fromisoformat(text)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return round((dt - _EPOCH).total_seconds() * 1000)
+
+
+def millis_to_iso(millis):
+    dt = datetime.fromtimestamp(millis / 1000.0, timezone.utc)
+    return dt.replace(tzinfo=None).isoformat(timespec="milliseconds") + "Z"
+
+
+def normalize_iso(text):
+    """Canonical form of an ISO 8601 timestamp: UTC, milliseconds, 'Z'; sorts like its time."""
+    return millis_to_iso(iso_to_millis(text))
+
+
+def _float_bits(value):
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+
+def _bits_float(bits):
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+
+class BitWriter(object):
+
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def write(self, bits, n):
+        self.value = (self.value << n) | (bits & ((1 << n) - 1))
+        self.length += n
+
+    def to_bytes(self):
+        pad = -self.length % 8
+        return (self.value << pad).to_bytes((self.length + pad) // 8, "big")
+
+
+class BitReader(object):
+
+    def __init__(self, data):
+        self.value = int.from_bytes(data, "big")
+        self.length = len(data) * 8
+        self.pos = 0
+
+    def read(self, n):
+        self.pos += n
+        return (self.value >> (self.length - self.pos)) & ((1 << n) - 1)
+
+
+def _signed(bits, n):
+    return bits - (1 << n) if bits >> (n - 1) else bits
+
+
+# delta-of-delta buckets: (prefix, prefix length, payload bits)
+_DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+# buckets for the deltas of decimal-scaled values
+_DELTA_BUCKETS = ((0b10, 2, 4), (0b110, 3, 8), (0b1110, 4, 16))
+
+XOR_VALUES = 0xFF      # value encoding marker, otherwise the number of decimals
+MAX_DECIMALS = 6
+
+
+def _write_bucketed(writer, value, buckets):
+    if value == 0:
+        writer.write(0, 1)
+        return
+    for prefix, size, bits in buckets:
+        if -(1 << (bits - 1)) <= value < (1 << (bits - 1)):
+            writer.write(prefix, size)
+            writer.write(value, bits)
+            return
+    writer.write(0b1111, 4)
+    writer.write(value, 64)
+
+
+def _read_bucketed(reader, buckets):
+    if not reader.read(1):
+        return 0
+    for _prefix, _size, bits in buckets:
+        if not reader.read(1):
+            return _signed(reader.read(bits), bits)
+    return _signed(reader.read(64), 64)
+
+
+def _decimals(values):
+    """Fewest decimals that represent every value exactly, None if none do."""
+    for decimals in range(MAX_DECIMALS + 1):
+        scale = 10 ** decimals
+        try:
+            if all(round(v * scale) / scale == v for v in values):
+                return decimals
+        except (OverflowError, ValueError):
+            return None
+    return None
+
+
+def encode(points):
+    """
+    [(millis, float), ...] sorted by time -> bytes. Values that are exact
+    decimals (sensor readings rounded to a resolution) are stored as deltas
+    of scaled integers, anything else as XORs of the IEEE 754 bits.
+    """
+    writer = BitWriter()
+    writer.write(len(points), 32)
+    if not points:
+        return writer.to_bytes()
+
+    decimals = _decimals([v for _t, v in points])
+    writer.write(XOR_VALUES if decimals is None else decimals, 8)
+
+    t, v = points[0]
+    writer.write(t, 64)
+    prev_t, prev_delta = t, 0
+    if decimals is None:
+        prev_bits = _float_bits(v)
+        writer.write(prev_bits, 64)
+        prev_lead, prev_trail = 65, 0
+    else:
+        scale = 10 ** decimals
+        prev_scaled = round(v * scale)
+        writer.write(prev_scaled, 64)
+
+    for t, v in points[1:]:
+        delta = t - prev_t
+        _write_bucketed(writer, delta - prev_delta, _DOD_BUCKETS)
+        prev_t, prev_delta = t, delta
+
+        if decimals is not None:
+            scaled = round(v * scale)
+            _write_bucketed(writer, scaled - prev_scaled, _DELTA_BUCKETS)
+            prev_scaled = scaled
+            continue
+
+        bits = _float_bits(v)
+        xor = bits ^ prev_bits
+        prev_bits = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if lead >= prev_lead and trail >= prev_trail:
+            # meaningful bits fit in the previous window
+            writer.write(0b10, 2)
+            writer.write(xor >> prev_trail, 64 - prev_lead - prev_trail)
+        else:
+            size = 64 - lead - trail
+            writer.write(0b11, 2)
+            writer.write(lead, 5)
+            writer.write(size & 63, 6)    # 64 is stored as 0
+            writer.write(xor >> trail, size)
+            prev_lead, prev_trail = lead, trail
+
+    return writer.to_bytes()
+
+
+def decode(data):
+    """bytes -> [(millis, float), ...]."""
+    reader = BitReader(data)
+    count = reader.read(32)
+    if not count:
+        return []
+
+    decimals = reader.read(8)
+    t = reader.read(64)
+    delta = 0
+
+    if decimals != XOR_VALUES:
+        scale = 10 ** decimals
+        scaled = _signed(reader.read(64), 64)
+        points = [(t, scaled / scale)]
+        for _ in range(count - 1):
+            delta += _read_bucketed(reader, _DOD_BUCKETS)
+            t += delta
+            scaled += _read_bucketed(reader, _DELTA_BUCKETS)
+            points.append((t, scaled / scale))
+        return points
+
+    bits = reader.read(64)
+    points = [(t, _bits_float(bits))]
+    lead, trail = 0, 0
+    for _ in range(count - 1):
+        delta += _read_bucketed(reader, _DOD_BUCKETS)
+        t += delta
+
+        if reader.read(1):
+            if reader.read(1):
+                lead = reader.read(5)
+                size = reader.read(6) or 64
+                trail = 64 - lead - size
+            else:
+                size = 64 - lead - trail
+            bits ^= reader.read(size) << trail
+        points.append((t, _bits_float(bits)))
+
+    return points
+
+
+def init_schema(conn):
+    conn.execute(SCHEMA)
+    conn.commit()
+
+
+def _window_start(millis, window_ms):
+    return millis - millis % window_ms
+
+
+def archive_closed_windows(conn, now_ms, window=DEFAULT_WINDOW):
+    """
+    Moves raw readings of windows that ended before now_ms into blocks and
+    deletes them from the readings table, in one transaction. Readings that
+    arrive late for an archived window are merged into its block.
+    Returns the number of archived readings.
+    """
+    window_ms = int(window * 1000)
+    cutoff = millis_to_iso(_window_start(now_ms, window_ms))
+    cur = conn.cursor()
+    cur.execute("SELECT id, zone, temperature, humidity, timestamp FROM readings "
+                "WHERE timestamp < ? ORDER BY id", (cutoff,))
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+
+    series = {}
+    archived_ids = []
+    for row_id, zone, temperature, humidity, timestamp in rows:
+        try:
+            millis = iso_to_millis(timestamp)
+        except ValueError:
+            continue
+        archived_ids.append(row_id)
+        start = _window_start(millis, window_ms)
+        for metric, value in zip(METRICS, (temperature, humidity)):
+            if value is not None:
+                series.setdefault((zone, metric, start), []).append((millis, float(value)))
+
+    for (zone, metric, start), points in series.items():
+        cur.execute("SELECT data FROM reading_blocks WHERE zone = ? AND metric = ? AND start_ms = ?",
+                    (zone, metric, start))
+        existing = cur.fetchone()
+        if existing is not None:
+            # a point stored twice (e.g. redelivered after archiving) is kept once
+            points = list(dict(decode(existing[0]) + points).items())
+        points.sort(key=lambda point: point[0])
+        cur.execute("INSERT OR REPLACE INTO reading_blocks(zone, metric, start_ms, end_ms, count, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (zone, metric, start, points[-1][0], len(points), encode(points)))
+
+    cur.executemany("DELETE FROM readings WHERE id = ?", [(row_id,) for row_id in archived_ids])
+    conn.commit()
+    return len(archived_ids)
+
+
+def query_range(conn, zone, metric, start_ms, end_ms):
+    """[(millis, value), ...] of zone/metric with start_ms <= millis < end_ms."""
+    if metric not in METRICS:
+        raise ValueError("unknown metric %r" % metric)
+    cur = conn.cursor()
+    points = []
+    cur.execute("SELECT data FROM reading_blocks WHERE zone = ? AND metric = ? "
+                "AND end_ms >= ? AND start_ms < ? ORDER BY start_ms",
+                (zone, metric, start_ms, end_ms))
+    for (data,) in cur.fetchall():
+        points.extend(p for p in decode(data) if start_ms <= p[0] < end_ms)
+
+    # raw rows not archived yet (the timestamp bounds are widened by a second
+    # because ISO strings without fractional seconds sort after their fractions)
+    cur.execute("SELECT timestamp, %s FROM readings WHERE zone = ? AND %s IS NOT NULL "
+                "AND timestamp >= ? AND timestamp < ?" % (metric, metric),
+                (zone, millis_to_iso(start_ms - 1000), millis_to_iso(end_ms + 1000)))
+    for timestamp, value in cur.fetchall():
+        try:
+            millis = iso_to_millis(timestamp)
+        except ValueError:
+            continue
+        if start_ms <= millis < end_ms:
+            points.append((millis, value))
+
+    points.sort(key=lambda point: point[0])
+    return points
+
+
+def archived_until(conn):
+    """Time (ms) of the newest archived reading, None if nothing is archived."""
+    return conn.execute("SELECT MAX(end_ms) FROM reading_blocks").fetchone()[0]
+
+
+def is_archived(conn, zone, metric, millis):
+    """True if the blocks of zone/metric hold a reading at millis."""
+    cur = conn.execute("SELECT data FROM reading_blocks WHERE zone = ? AND metric = ? "
+                       "AND start_ms <= ? AND end_ms >= ?", (zone, metric, millis, millis))
+    return any(point[0] == millis for (data,) in cur.fetchall() for point in decode(data))
+
+
+def latest_values(conn):
+    """{(zone, metric): (millis, value)} from the newest block of each series."""
+    cur = conn.cursor()
+    cur.execute("SELECT zone, metric, data FROM reading_blocks b WHERE start_ms = "
+                "(SELECT MAX(start_ms) FROM reading_blocks WHERE zone = b.zone AND metric = b.metric)")
+    latest = {}
+    for zone, metric, data in cur.fetchall():
+        points = decode(data)
+        if points:
+            latest[(zone, metric)] = points[-1]
+    return latest
+
+
+def storage_stats(conn):
+    """Raw vs encoded size of the archived readings."""
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), COALESCE(SUM(count), 0), COALESCE(SUM(LENGTH(data)), 0) FROM reading_blocks")
+    blocks, points, encoded = cur.fetchone()
+    # a raw point is a float plus an ISO timestamp string of ~27 bytes
+    raw = points * (8 + 27)
+    return {'blocks': blocks, 'points': points, 'encoded_bytes': encoded,
+            'raw_bytes_estimate': raw, 'ratio': raw / encoded if encoded else 0.0}
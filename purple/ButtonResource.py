@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+'''
+                    ___           ___           ___     
+        ___        /\__\         /\  \         /\  \    
+       /\  \      /::|  |       /::\  \       /::\  \   
+       \:\  \    /:|:|  |      /:/\:\  \     /:/\ \  \  
+       /::\__\  /:/|:|  |__   /::\~\:\  \   _\:\~\ \  \ 
+    __/:/\/__/ /:/ |:| /\__\ /:/\:\ \:\__\ /\ \:\ \ \__\
+   /\/:/  /    \/__|:|/:/  / \:\~\:\ \/__/ \:\ \:\ \/__/
+   \::/__/         |:/:/  /   \:\ \:\__\    \:\ \:\__\  
+    \:\__\         |::/  /     \:\ \/__/     \:\/:/  /  
+     \/__/         /:/  /       \:\__\        \::/  /   
+                   \/__/         \/__/         \/__/    
+
+
+    File:          ButtonResource.py
+    
+
+    Purpose:       Derived class from the
+                   sensor class that
+                   implements the concrete
+                   behaviour of a GrovePi
+                   button.
+
+                   Class is based on
+                   the abstract sensor
+                   class.
+                   
+    
+    Remarks:       - The GrovePi module has
+                     to be installed to 
+                     interact with the GrovePi
+                     hardware.
+
+                   - This class holds the value
+                     of a button (true/false)
+                     and publishes it to a
+                     MQTT topic if it changes
+                     its state.
+
+                   - With gpio_pin (BCM number
+                     of a button wired to the
+                     Pi itself) the button is
+                     edge triggered through
+                     RPi.GPIO and debounced in
+                     software; without it, or
+                     if edge detection is not
+                     available, the GrovePi
+                     connector is polled.
+
+
+    Author:        P. Leibundgut <leiu@zhaw.ch>
+    
+    
+    Date:          10/2016
+
+'''
+
+import time
+import threading
+
+import hal
+import log
+
+from Sensor import Sensor
+from grove_pi_interface import InteractorMember, \
+                               GrovePiInteractor, \
+                               DIGITAL_READ
+
+
+# logging setup
+logger = log.setup_custom_logger( "mqtt_thing_button_resource" )
+
+
+# the level has to be stable this long after an edge
+DEFAULT_DEBOUNCE_IN_MILLIS = int( 5 )
+
+# how often an idle edge triggered button checks for a stop request
+ALIVE_CHECK_INTERVAL_IN_S = float( 1.0 )
+
+
+class ButtonResource( Sensor ):
+  
+  def __init__( self, connector, lock, \
+                mqtt_client, running, \
+                pub_topic, \
+                polling_interval, \
+                sampling_resolution, \
+                polling_policy = None, \
+                gpio_pin = None, \
+                debounce_ms = DEFAULT_DEBOUNCE_IN_MILLIS ):
+    
+    super( ButtonResource, self ).__init__( connector, lock, \
+                                            mqtt_client, running, \
+                                            pub_topic, \
+                                            polling_interval, \
+                                            sampling_resolution, \
+                                            polling_policy )
+
+    self.grovepi_interactor_member = InteractorMember( connector, \
+                                                       'INPUT', \
+                                                       DIGITAL_READ )
+    
+    self.value = False
+
+    self.gpio_pin = gpio_pin
+    self.debounce = float( debounce_ms / 1000 )
+    self.edge_event = threading.Event()
+    self.edge_triggered = False
+
+
+  def run( self ):
+    if self.gpio_pin is not None and self.watch_edges():
+      self.wait_for_edges()
+    else:
+      self.poll_sensor()
+
+
+  # asyncio runtime: the blocking edge wait gets a thread of its own
+  # instead of one of the thing's executor workers.
+  async def async_poll_sensor( self, executor = None ):
+    if self.gpio_pin is not None and self.watch_edges():
+      import asyncio
+      await asyncio.get_running_loop().run_in_executor( None, self.wait_for_edges )
+    else:
+      await super( ButtonResource, self ).async_poll_sensor( executor )
+
+
+  def watch_edges( self ):
+    try:
+      hal.get_backend().gpio_watch( self.gpio_pin, self.on_edge )
+    except Exception as e:
+      # no RPi.GPIO, not a Pi, pin in use, or a backend without GPIO
+      logger.warning( "---no edge detection on GPIO %s (%s), polling connector %s instead", \
+                      self.gpio_pin, e, self.connector )
+      return False
+
+    self.edge_triggered = True
+    return True
+
+
+  # Runs in the GPIO event thread: only wakes up the button thread.
+  def on_edge( self, pin ):
+    self.edge_event.set()
+
+
+  def is_running( self ):
+    self.lock.acquire()
+    still_running = self.running
+    self.lock.release()
+    return still_running
+
+
+  def wait_for_edges( self ):
+    self.poll_started_at = time.monotonic()
+    self.read_edge_level()
+
+    while self.is_running():
+      if self.edge_event.wait( ALIVE_CHECK_INTERVAL_IN_S ):
+        self.read_edge_level()
+
+    hal.get_backend().gpio_unwatch( self.gpio_pin )
+
+
+  # Software debounce: every further edge restarts the debounce period,
+  # the level is taken once it has been stable for that long.
+  def read_edge_level( self ):
+    started = time.monotonic()
+    self.edge_event.clear()
+    while self.edge_event.wait( self.debounce ):
+      self.edge_event.clear()
+
+    try:
+      new_value = bool( hal.get_backend().gpio_read( self.gpio_pin ) )
+    except Exception:
+      logger.debug( "---could not read GPIO %s", self.gpio_pin )
+      self.read_failed()
+      return
+
+    self.telemetry.poll( started, time.monotonic() - started )
+    self.poll_count += 1
+    self.update_value( new_value )
+
+
+  def read_sensor( self ):
+    new_value = bool( False )
+
+    try:
+      new_value = bool( GrovePiInteractor.read( self.grovepi_interactor_member ) )
+    except Exception:
+      logger.debug( "---no sample from connector %s, skipping poll", self.connector )
+      self.read_failed()
+      return
+
+    self.update_value( new_value )
+
+
+  def update_value( self, new_value ):
+    if not self.is_equal( self.value, new_value ):
+      self.value = new_value
+      self.publish( self.pub_topic, str( self.value ) )
+      logger.debug( "---button value just toggled in a ButtonResource instance" )
+
+
+  def is_equal( self, a, b ):
+    return a == b
+
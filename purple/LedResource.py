@@ -33,13 +33,16 @@ class LedResource( Actuator ):
 
   def on_mqtt_message( self, client, userdata, message ):
     payload = str( "" )
-    logger.debug( "Got message on topic: " + str( message.topic ) )
+    logger.debug( "Got message on topic: %s", message.topic )
     payload = self.decode_payload_ascii_str( message.payload )
+    self.telemetry.command()
 
     if self.input_valid( payload ):
       new_value = self.str_to_bool( payload )
 
-      if not self.is_equal( new_value, self.value ):
+      # a retained command is the state to restore right after (re)subscribing,
+      # it is applied even if it matches the value the LED was initialised with
+      if message.retain or not self.is_equal( new_value, self.value ):
         self.value = new_value
         self.set_actuator( self.value )
 
@@ -48,7 +51,7 @@ class LedResource( Actuator ):
     # usa il valore passato dal messaggio MQTT, non self.value (sempre False)
     self.value = self.str_to_bool(value) if isinstance(value, str) else bool(value)
     val = int(self.value)
-    logger.debug(f"Setting LED (connector={self.grovepi_interactor_member.connector}) -> {val}")
+    logger.debug("Setting LED (connector=%s) -> %s", self.grovepi_interactor_member.connector, val)
     self.grovepi_interactor_member.tx_queue.put(
         (self.grovepi_interactor_member, val))
       
@@ -3,7 +3,8 @@
 SHT35Resource.py
 
 Sensor subclass to read SHT35 temperature and humidity and publish via MQTT when value changes.
-If `smbus2` is not available or I2C is not configured, it can run in simulation mode.
+Hardware access goes through `hal`; in simulation mode the simulator backend supplies
+the readings (with realistic DHT/I2C latencies).
 """
 import time
 import threading
@@ -12,30 +13,16 @@ import logging
 import math
 from datetime import datetime
 
-import mqttconfig
+import hal
 from Sensor import Sensor
 
-try:
-    from smbus2 import SMBus
-    HAS_SMBUS = True
-except Exception:
-    SMBus = None
-    HAS_SMBUS = False
-
-try:
-    import grovepi
-    HAS_GROVEPI = True
-except Exception:
-    grovepi = None
-    HAS_GROVEPI = False
-
 logger = logging.getLogger("mqtt_thing_sht35_resource")
 
 
 class SHT35Resource(Sensor):
     def __init__(self, connector, lock, mqtt_client, running, pub_topic,
                  polling_interval=5.0, simulate=False, bus_num=1, i2c_addr=0x44,
-                 use_dht=False, dht_port=None, dht_type=1):
+                 use_dht=False, dht_port=None, dht_type=1, polling_policy=None):
         """
         Args:
             connector: I2C bus or connector number
@@ -44,15 +31,17 @@ class SHT35Resource(Sensor):
             running: running flag
             pub_topic: topic to publish temperature (humidity topic auto-generated)
             polling_interval: polling interval in seconds
-            simulate: if True, simulate sensor values
+            simulate: if True, read from the hal simulator instead of the active backend
             bus_num: I2C bus number (default 1)
             i2c_addr: I2C address (default 0x44 for SHT35)
             use_dht: if True, use grovepi.dht() for DHT sensor; if False, use SHT35 via smbus2
             dht_port: GrovePi connector port (if use_dht=True)
             dht_type: DHT type: 0=BLUE, 1=WHITE (default)
+            polling_policy: optional AdaptivePollingPolicy driving the interval
         """
         super(SHT35Resource, self).__init__(connector, lock, mqtt_client, running,
-                                            pub_topic, polling_interval, sampling_resolution=0)
+                                            pub_topic, polling_interval, sampling_resolution=0,
+                                            polling_policy=polling_policy)
         self.simulate = simulate
         self.bus_num = bus_num
         self.i2c_addr = i2c_addr
@@ -69,10 +58,12 @@ class SHT35Resource(Sensor):
         new_value = None
         new_humidity = None
         
-        if self.use_dht and HAS_GROVEPI and self.dht_port is not None:
+        backend = hal.get_simulator() if self.simulate else hal.get_backend()
+
+        if self.use_dht and self.dht_port is not None:
             # Usa sensore DHT via GrovePi
             try:
-                res = grovepi.dht(self.dht_port, self.dht_type)
+                res = backend.dht(self.dht_port, self.dht_type)
                 if isinstance(res, (list, tuple)) and len(res) >= 2:
                     temp, hum = res[0], res[1]
                     if not math.isnan(temp) and not math.isnan(hum):
@@ -83,36 +74,30 @@ class SHT35Resource(Sensor):
                 else:
                     logger.debug("DHT reading unexpected format: %s", res)
             except IOError:
-                logger.debug("DHT IOError - will use simulated values")
+                logger.debug("DHT IOError")
             except Exception as e:
                 logger.debug("DHT read failed: %s", e)
-        elif self.simulate or not HAS_SMBUS:
-            # Simulated values
-            import random
-            new_value = round(20.0 + random.uniform(-3.0, 3.0), 2)
-            new_humidity = round(50.0 + random.uniform(-10.0, 10.0), 2)
         else:
-            # SHT35 via smbus2
+            # SHT35 via I2C
             try:
-                with SMBus(self.bus_num) as bus:
-                    # single shot high repeatability: command 0x2C 0x06
-                    bus.write_i2c_block_data(self.i2c_addr, 0x2C, [0x06])
-                    time.sleep(0.015)
-                    data = bus.read_i2c_block_data(self.i2c_addr, 0x00, 6)
-                    # Temperature: bytes 0-1
-                    t_raw = data[0] << 8 | data[1]
-                    temp_c = -45.0 + 175.0 * (t_raw / 65535.0)
-                    new_value = round(temp_c, 2)
-                    # Humidity: bytes 3-4
-                    h_raw = data[3] << 8 | data[4]
-                    humidity_pct = 100.0 * (h_raw / 65535.0)
-                    new_humidity = round(humidity_pct, 2)
+                # single shot high repeatability: command 0x2C 0x06
+                backend.i2c_write_block(self.bus_num, self.i2c_addr, 0x2C, [0x06])
+                time.sleep(0.015)
+                data = backend.i2c_read_block(self.bus_num, self.i2c_addr, 0x00, 6)
+                # Temperature: bytes 0-1
+                t_raw = data[0] << 8 | data[1]
+                temp_c = -45.0 + 175.0 * (t_raw / 65535.0)
+                new_value = round(temp_c, 2)
+                # Humidity: bytes 3-4
+                h_raw = data[3] << 8 | data[4]
+                humidity_pct = 100.0 * (h_raw / 65535.0)
+                new_humidity = round(humidity_pct, 2)
             except Exception as e:
-                logger.debug("SHT35 read failed: %s, will use simulated values", e)
-                # fallback to simulated
-                import random
-                new_value = round(20.0 + random.uniform(-3.0, 3.0), 2)
-                new_humidity = round(50.0 + random.uniform(-10.0, 10.0), 2)
+                logger.debug("SHT35 read failed: %s", e)
+
+        if new_value is None or new_humidity is None:
+            self.read_failed()
+            return
 
         # Pubblica temperatura se cambiata
         if self.value is None or not self.is_equal(self.value, new_value):
@@ -121,11 +106,7 @@ class SHT35Resource(Sensor):
             payload = json.dumps({"zone": zone,
                                   "temperature": self.value,
                                   "timestamp": datetime.utcnow().isoformat() + 'Z'})
-            self.lock.acquire()
-            try:
-                self.mqtt_client.publish(self.pub_topic, payload, mqttconfig.QUALITY_OF_SERVICE, False)
-            finally:
-                self.lock.release()
+            self.publish(self.pub_topic, payload)
             logger.debug("Published SHT35 temperature %s to %s", self.value, self.pub_topic)
 
         # Pubblica umidità se cambiata
@@ -135,11 +116,7 @@ class SHT35Resource(Sensor):
             payload = json.dumps({"zone": zone,
                                   "humidity": self.humidity,
                                   "timestamp": datetime.utcnow().isoformat() + 'Z'})
-            self.lock.acquire()
-            try:
-                self.mqtt_client.publish(self.humidity_topic, payload, mqttconfig.QUALITY_OF_SERVICE, False)
-            finally:
-                self.lock.release()
+            self.publish(self.humidity_topic, payload)
             logger.debug("Published SHT35 humidity %s to %s", self.humidity, self.humidity_topic)
 
 
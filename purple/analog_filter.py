@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+'''
+                    ___           ___           ___
+        ___        /\__\         /\  \         /\  \
+       /\  \      /::|  |       /::\  \       /::\  \
+       \:\  \    /:|:|  |      /:/\:\  \     /:/\ \  \
+       /::\__\  /:/|:|  |__   /::\~\:\  \   _\:\~\ \  \
+    __/:/\/__/ /:/ |:| /\__\ /:/\:\ \:\__\ /\ \:\ \ \__\
+   /\/:/  /    \/__|:|/:/  / \:\~\:\ \/__/ \:\ \:\ \/__/
+   \::/__/         |:/:/  /   \:\ \:\__\    \:\ \:\__\
+    \:\__\         |::/  /     \:\ \/__/     \:\/:/  /
+     \/__/         /:/  /       \:\__\        \::/  /
+                   \/__/         \/__/         \/__/
+
+
+    File:          analog_filter.py
+
+
+    Purpose:       Filter chain for analog
+                   resources: the samples of
+                   one poll (oversampling) are
+                   reduced by median or mean,
+                   optionally averaged over the
+                   last polls and quantised to
+                   the sampling resolution.
+
+
+    Remarks:       - All buffers are allocated
+                     once, a poll does not
+                     create any list.
+
+                   - The quantiser has a
+                     hysteresis, a value that
+                     jitters around a step
+                     boundary does not toggle
+                     the output.
+
+'''
+
+
+MEDIAN = 'median'
+MEAN = 'mean'
+
+FILTER_METHODS = ( MEDIAN, MEAN )
+
+DEFAULT_OVERSAMPLING = int( 4 )
+DEFAULT_HYSTERESIS = float( 0.5 ) # fraction of a step beyond the boundary
+
+
+class AnalogFilter( object ):
+
+  def __init__( self, oversampling = DEFAULT_OVERSAMPLING, \
+                method = MEDIAN, \
+                window = int( 1 ), \
+                resolution = int( 1 ), \
+                hysteresis = DEFAULT_HYSTERESIS ):
+
+    if method not in FILTER_METHODS:
+      raise ValueError( "unknown filter method: %s" % method )
+
+    self.oversampling = max( 1, int( oversampling ) )
+    self.method = method
+    self.resolution = max( 1, int( resolution ) )
+    self.hysteresis = float( hysteresis )
+
+    # valid samples of the current poll, sorted in place for the median
+    self.samples = [ 0 ] * self.oversampling
+
+    # moving average over the last `window` polls
+    self.window = max( 1, int( window ) )
+    self.history = [ 0.0 ] * self.window
+    self.history_sum = float( 0.0 )
+    self.history_len = int( 0 )
+    self.history_pos = int( 0 )
+
+    self.level = None
+
+
+  # Takes the raw samples of one poll (None for failed reads) and returns
+  # the quantised output, or None if no sample was valid.
+  def update( self, raw_samples ):
+    reduced = self.reduce( raw_samples )
+    if reduced is None:
+      return None
+
+    return self.quantise( self.average( reduced ) )
+
+
+  def reduce( self, raw_samples ):
+    samples = self.samples
+    count = int( 0 )
+    for sample in raw_samples:
+      if sample is None or count == self.oversampling:
+        continue
+      samples[ count ] = sample
+      count += 1
+
+    if count == 0:
+      return None
+
+    if self.method == MEAN:
+      total = 0
+      for i in range( count ):
+        total += samples[ i ]
+      return total / count
+
+    # insertion sort of the valid prefix, n is small
+    for i in range( 1, count ):
+      sample = samples[ i ]
+      j = i - 1
+      while j >= 0 and samples[ j ] > sample:
+        samples[ j + 1 ] = samples[ j ]
+        j -= 1
+      samples[ j + 1 ] = sample
+
+    middle = count // 2
+    if count % 2:
+      return float( samples[ middle ] )
+    return ( samples[ middle - 1 ] + samples[ middle ] ) / 2.0
+
+
+  def average( self, value ):
+    if self.window == 1:
+      return value
+
+    if self.history_len == self.window:
+      self.history_sum -= self.history[ self.history_pos ]
+    else:
+      self.history_len += 1
+
+    self.history[ self.history_pos ] = value
+    self.history_sum += value
+    self.history_pos = ( self.history_pos + 1 ) % self.window
+    return self.history_sum / self.history_len
+
+
+  def quantise( self, value ):
+    step = self.resolution
+    nearest = int( round( value / step ) ) * step
+
+    if self.level is None or \
+       abs( value - self.level ) >= step * ( 0.5 + self.hysteresis ):
+      self.level = nearest
+
+    return self.level
+
+
+  def reset( self ):
+    self.history_sum = float( 0.0 )
+    self.history_len = int( 0 )
+    self.history_pos = int( 0 )
+    self.level = None
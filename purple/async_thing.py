@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""
+async_thing.py
+
+Runs the resources of a thing on an asyncio event loop. The paho MQTT
+client is driven by the loop through its socket callbacks instead of a
+loop_start() thread, sensors and the time resource poll as tasks, and
+actuator commands, which only queue a write for the GrovePi interactor,
+run directly in the message callbacks.
+
+The loop is not the only thread: blocking hardware reads run in a thread
+pool with one worker per polled resource (a ~250 ms DHT read does not
+delay the other sensors), broker probes and connects in the loop's default
+executor, and the outbound Publisher, the TelemetryReporter and the
+GrovePi interactor keep their own threads.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+import log
+import mqttconfig
+from mqtt_connection import backoff_delay
+
+MISC_LOOP_INTERVAL = 1.0   # unit is seconds
+
+logger = log.setup_custom_logger("mqtt_thing_async")
+
+
+class AsyncMqttHelper(object):
+    """Hooks the socket of a paho client into an asyncio event loop."""
+
+    def __init__(self, loop, client, stop_event, pool, keepalive):
+        self.loop = loop
+        self.client = client
+        self.stop_event = stop_event
+        self.pool = pool
+        self.keepalive = keepalive
+        self.broker = None
+        self.loop_thread = threading.get_ident()
+        self.misc_task = None
+
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    # paho may call these from executor threads (e.g. publish from a sensor)
+    def call_in_loop(self, func, *args):
+        if threading.get_ident() == self.loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.call_in_loop(self.loop.add_reader, sock, client.loop_read)
+        self.call_in_loop(self.start_misc_loop)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.call_in_loop(self.loop.remove_reader, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.call_in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.call_in_loop(self.loop.remove_writer, sock)
+
+    def start_misc_loop(self):
+        if self.misc_task is None or self.misc_task.done():
+            self.misc_task = self.loop.create_task(self.misc_loop())
+
+    async def misc_loop(self):
+        # keepalive pings and retries; reconnects after a lost connection
+        # with exponential backoff, subscriptions are re-issued in on_connect
+        attempt = 0
+        while True:
+            if self.client.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+                attempt += 1
+                await asyncio.sleep(backoff_delay(attempt))
+                await self.try_connect()
+                continue
+            attempt = 0
+            await asyncio.sleep(MISC_LOOP_INTERVAL)
+
+    async def try_connect(self):
+        # the pool probes its brokers, which must not stall the loop
+        broker = await self.loop.run_in_executor(None, self.pool.select)
+        if broker != self.broker:
+            logger.info("using broker %s:%s", *broker)
+            self.broker = broker
+        try:
+            # DNS lookup and TCP connect block; the socket callbacks hop
+            # back onto the loop through call_in_loop
+            await self.loop.run_in_executor(None, self.client.connect, broker[0], broker[1], self.keepalive)
+            return True
+        except Exception as e:
+            logger.debug("connect to %s:%s failed: %s", broker[0], broker[1], e)
+            return False
+
+    async def connect(self):
+        # the first connect is retried the same way instead of failing
+        attempt = 0
+        while not self.stop_event.is_set():
+            if await self.try_connect():
+                return
+            attempt += 1
+            delay = backoff_delay(attempt)
+            logger.warning("could not connect to broker %s:%s, retrying in %.1fs",
+                           self.broker[0], self.broker[1], delay)
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        if self.misc_task is not None:
+            self.misc_task.cancel()
+
+
+def polled_resources(resources):
+    """Keys of the resources that poll; ValueError if one has no asyncio variant."""
+    polled = []
+    for key, res in resources.items():
+        if hasattr(res, 'async_poll_sensor'):
+            polled.append(key)
+        elif hasattr(res, 'poll_sensor') or hasattr(res, 'query_system_time'):
+            raise ValueError("resource %s (%s) cannot run on the asyncio loop"
+                             % (key, type(res).__name__))
+    return polled
+
+
+class AsyncThing(object):
+    """One event loop per thing, hosting all of its resources."""
+
+    def __init__(self, mqtt_client, resources, max_workers=None):
+        self.mqtt_client = mqtt_client
+        self.resources = resources
+        self.polled = polled_resources(resources)
+        # one worker per polled resource, reads do not queue behind each other
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or max(1, len(self.polled)),
+                                           thread_name_prefix="thing-hw")
+        self.loop = None
+        self.stop_event = None
+        self.helper = None
+        self.subscriptions = {}
+
+    def subscribe(self, topic, callback):
+        """Extra subscription (besides the actuators), issued on every connect."""
+        self.subscriptions[topic] = callback
+
+    def run(self, pool, keepalive):
+        asyncio.run(self.main(pool, keepalive))
+
+    async def main(self, pool, keepalive):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.helper = AsyncMqttHelper(self.loop, self.mqtt_client, self.stop_event,
+                                      pool, keepalive)
+
+        # actuator subscriptions are (re)issued on every connect
+        actuators = [res for res in self.resources.values()
+                     if getattr(res, 'sub_topic', None) and hasattr(res, 'on_mqtt_message')]
+        subscriptions = dict(self.subscriptions)
+        for res in actuators:
+            subscriptions[res.sub_topic] = res.on_mqtt_message
+        for topic, callback in subscriptions.items():
+            self.mqtt_client.message_callback_add(topic, callback)
+
+        previous_on_connect = self.mqtt_client.on_connect
+
+        def on_connect(client, userdata, flags, rc):
+            if previous_on_connect is not None:
+                previous_on_connect(client, userdata, flags, rc)
+            for topic in subscriptions:
+                client.subscribe(topic, mqttconfig.QUALITY_OF_SERVICE)
+            self.notify_connection_state('connected' if rc == 0 else 'disconnected')
+
+        previous_on_disconnect = self.mqtt_client.on_disconnect
+
+        def on_disconnect(client, userdata, rc):
+            if previous_on_disconnect is not None:
+                previous_on_disconnect(client, userdata, rc)
+            self.notify_connection_state('disconnected')
+
+        self.mqtt_client.on_connect = on_connect
+        self.mqtt_client.on_disconnect = on_disconnect
+        connecting = self.loop.create_task(self.helper.connect())
+
+        tasks = [self.loop.create_task(self.resources[key].async_poll_sensor(self.executor), name=key)
+                 for key in self.polled]
+
+        try:
+            await self.stop_event.wait()
+        finally:
+            connecting.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.helper.stop()
+            self.mqtt_client.disconnect()
+            self.executor.shutdown(wait=False)
+
+    def notify_connection_state(self, state):
+        for res in self.resources.values():
+            if hasattr(res, 'on_connection_state'):
+                res.on_connection_state(state)
+
+    # safe to call from signal handlers and other threads
+    def stop(self):
+        if self.loop is not None and self.stop_event is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
@@ -1,31 +1,202 @@
 #!/usr/bin/env python3
 
 import sys
+import time
+import heapq
 import threading
 
-# For compatibility if grovepi not present, define placeholders
-try:
-    import grovepi
-except Exception:
-    grovepi = None
+import hal
+import log
 
 from queue import Queue
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 
-DIGITAL_READ  = (lambda pin: 0)
-ANALOG_READ   = (lambda pin: 0)
+# resolved on every call, so the backend can be selected after import
+DIGITAL_READ  = (lambda pin: hal.get_backend().digital_read( pin ))
+ANALOG_READ   = (lambda pin: hal.get_backend().analog_read( pin ))
 
-DIGITAL_WRITE = (lambda pin, val: None)
-ANALOG_WRITE  = (lambda pin, val: None)
+DIGITAL_WRITE = (lambda pin, val: hal.get_backend().digital_write( pin, val ))
+ANALOG_WRITE  = (lambda pin, val: hal.get_backend().analog_write( pin, val ))
 
-if grovepi is not None:
-    DIGITAL_READ = grovepi.digitalRead
-    ANALOG_READ = grovepi.analogRead
-    DIGITAL_WRITE = grovepi.digitalWrite
-    ANALOG_WRITE = grovepi.analogWrite
+# lower value is served first
+PRIORITY_HIGH   = int( 0 )
+PRIORITY_NORMAL = int( 1 )
+PRIORITY_LOW    = int( 2 )
+
+# what to do when a member's queue is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+DEFAULT_MAX_QUEUE_LEN = int( 16 )
+
+DEFAULT_READ_TIMEOUT = float( 1.0 ) # unit is seconds
 
 running = True
 
-grovepi_tx_queue = Queue()
+# logging setup
+logger = log.setup_custom_logger( "grove_pi_interface" )
+
+
+class InteractorQueueFull( Exception ):
+    pass
+
+
+def future_of( entry ):
+    return entry[ 2 ] if len( entry ) > 2 else None
+
+
+# A timed-out read cancels its future but leaves the entry queued, so the
+# future of a superseded or rejected entry may already be done.
+def is_waited_for( entry ):
+    future = future_of( entry )
+    return future is not None and not future.done()
+
+
+class PriorityTxQueue( object ):
+    """
+    Drop-in replacement for the shared FIFO: keeps a bounded queue per
+    InteractorMember, always serves the member with the highest priority
+    (round robin between members of equal priority) and coalesces pending
+    OUTPUT writes of a member down to the latest value.
+    """
+
+    def __init__( self ):
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.ready = []
+        self.seq = 0
+        self.depth = 0
+        self.stopped = False
+
+        self.served = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+    def put( self, entry ):
+        with self.cond:
+            if entry is None:
+                self.stopped = True
+                self.cond.notify_all()
+                return
+
+            member = entry[ 0 ]
+            now = time.monotonic()
+            member_queue = self.pending.get( member )
+
+            if member_queue is None:
+                member_queue = deque()
+                self.pending[ member ] = member_queue
+                self.schedule( member )
+
+            if member.direction == 'OUTPUT' and len( member_queue ) > 0:
+                # only the latest value matters, keep the original position
+                enqueued_at, superseded = member_queue[ -1 ]
+                member_queue[ -1 ] = ( enqueued_at, entry )
+                self.coalesced += 1
+                if is_waited_for( superseded ):
+                    future_of( superseded ).set_result( None )
+                return
+
+            if len( member_queue ) >= member.max_queue_len:
+                self.purge_cancelled( member_queue )
+
+            if len( member_queue ) >= member.max_queue_len:
+                self.dropped += 1
+                member.dropped += 1
+                if member.drop_policy == DROP_NEWEST:
+                    rejected = entry
+                else:
+                    rejected = member_queue.popleft()[ 1 ]
+                    self.depth -= 1
+
+                if is_waited_for( rejected ):
+                    future_of( rejected ).set_exception( InteractorQueueFull( member.connector ) )
+                if rejected is entry:
+                    return
+
+            member_queue.append( ( now, entry ) )
+            self.depth += 1
+            self.cond.notify()
+
+
+    # Removes the entries nobody waits for any more (timed-out reads) so they
+    # do not count against the bound. Called with the lock held, before the
+    # new entry is appended, so the member's queue does not stay empty.
+    def purge_cancelled( self, member_queue ):
+        kept = [ item for item in member_queue
+                 if future_of( item[ 1 ] ) is None or not future_of( item[ 1 ] ).cancelled() ]
+        removed = len( member_queue ) - len( kept )
+        if removed:
+            member_queue.clear()
+            member_queue.extend( kept )
+            self.depth -= removed
+
+
+    def get( self ):
+        with self.cond:
+            while not self.ready and not self.stopped:
+                self.cond.wait()
+
+            if not self.ready:
+                return None
+
+            member = heapq.heappop( self.ready )[ 2 ]
+            member_queue = self.pending[ member ]
+            enqueued_at, entry = member_queue.popleft()
+            self.depth -= 1
+
+            if member_queue:
+                self.schedule( member )
+            else:
+                del self.pending[ member ]
+
+            wait = time.monotonic() - enqueued_at
+            self.served += 1
+            self.wait_total += wait
+            self.wait_max = max( self.wait_max, wait )
+            member.wait_total += wait
+            member.served += 1
+
+            return entry
+
+
+    # must be called with self.cond held
+    def schedule( self, member ):
+        self.seq += 1
+        heapq.heappush( self.ready, ( member.priority, self.seq, member ) )
+
+
+    # kept for compatibility with queue.Queue users
+    def task_done( self ):
+        pass
+
+
+    def qsize( self ):
+        with self.cond:
+            return self.depth
+
+
+    def empty( self ):
+        return self.qsize() == 0
+
+
+    def stats( self ):
+        with self.cond:
+            return { 'depth': self.depth,
+                     'depth_per_connector': dict( ( member.connector, len( q ) ) \
+                                                  for member, q in self.pending.items() ),
+                     'served': self.served,
+                     'coalesced': self.coalesced,
+                     'dropped': self.dropped,
+                     'avg_wait': self.wait_total / self.served if self.served else 0.0,
+                     'max_wait': self.wait_max }
+
+
+grovepi_tx_queue = PriorityTxQueue()
 
 
 def flush_queue( q ):
@@ -66,25 +237,87 @@ class GrovePiInteractor( threading.Thread ):
     @staticmethod
     def work_queue_entry( value ):
         member = value[ 0 ]
+        future = future_of( value )
+
+        # entries cancelled by a timed out caller are skipped
+        if future is not None and not future.set_running_or_notify_cancel():
+            return
+
+        if member.direction == 'BULK':
+            result = []
+            for input_member in member.members:
+                try:
+                    result.append( GrovePiInteractor.access_pin( input_member ) )
+                except Exception:
+                    result.append( None )
+            future.set_result( result )
+            return
+
+        try:
+            result = GrovePiInteractor.access_pin( member, value[ 1 ] if len( value ) > 1 else None )
+        except Exception as e:
+            if future is not None:
+                future.set_exception( e )
+                return
+            if member.direction == 'OUTPUT':
+                logger.error( "Error in writing to sensor at pin %s", member.connector )
+                return
+            result = 0
+
+        if future is not None:
+            future.set_result( result )
+        elif member.direction == 'INPUT':
+            member.rx_queue.put( result )
+
 
-        if not member.pin_mode_set and grovepi is not None:
-            grovepi.pinMode( member.connector, member.direction )
+    @staticmethod
+    def access_pin( member, output_val = None ):
+        if not member.pin_mode_set:
+            hal.get_backend().pin_mode( member.connector, member.direction )
             member.pin_mode_set = True
 
         if member.direction == 'OUTPUT':
-            output_val = value[ 1 ]
-            try:
-                member.grovepi_func( member.connector, int( output_val ) )
-            except Exception:
-                print( "Error in writing to sensor at pin " + str( member.connector ) )
+            member.grovepi_func( member.connector, int( output_val ) )
+            return None
+
+        return member.grovepi_func( member.connector )
 
-        elif member.direction == 'INPUT':
-            try:
-                input_val = member.grovepi_func( member.connector )
-            except Exception:
-                input_val = 0
 
-            member.rx_queue.put( input_val )
+    # Queues a request and returns a concurrent.futures.Future that is
+    # resolved by the interactor thread (None for writes).
+    @staticmethod
+    def submit( member, value = None ):
+        future = Future()
+        grovepi_tx_queue.put( ( member, value, future ) )
+        return future
+
+
+    @staticmethod
+    def read( member, timeout = DEFAULT_READ_TIMEOUT ):
+        return GrovePiInteractor.wait_for( GrovePiInteractor.submit( member ), timeout )
+
+
+    # Samples all members of a BulkRead (or a list of INPUT members) in one
+    # interactor pass. Values of pins that failed to read are None.
+    @staticmethod
+    def read_bulk( members, timeout = DEFAULT_READ_TIMEOUT ):
+        if not isinstance( members, BulkRead ):
+            members = BulkRead( members )
+        return GrovePiInteractor.wait_for( GrovePiInteractor.submit( members ), timeout )
+
+
+    @staticmethod
+    def wait_for( future, timeout ):
+        try:
+            return future.result( timeout )
+        except FutureTimeout:
+            future.cancel()
+            raise
+
+
+    @staticmethod
+    def queue_stats():
+        return grovepi_tx_queue.stats()
 
 
     def stop_interactor( self ):
@@ -97,11 +330,22 @@ class GrovePiInteractor( threading.Thread ):
 
 class InteractorMember( object ):
 
-    def __init__( self, connector, direction, grovepi_func ):
+    def __init__( self, connector, direction, grovepi_func, \
+                  priority = None, \
+                  max_queue_len = DEFAULT_MAX_QUEUE_LEN, \
+                  drop_policy = DROP_OLDEST ):
 
         self.connector = connector
         self.direction = direction
 
+        # reads are time sensitive, writes can wait
+        if priority is None:
+            priority = PRIORITY_HIGH if direction == 'INPUT' else PRIORITY_NORMAL
+
+        self.priority = priority
+        self.max_queue_len = max( 1, max_queue_len )
+        self.drop_policy = drop_policy
+
         if self.direction == 'INPUT':
             self.rx_queue = Queue()
         else:
@@ -110,3 +354,30 @@ class InteractorMember( object ):
         self.tx_queue = grovepi_tx_queue
         self.grovepi_func = grovepi_func
         self.pin_mode_set = False
+
+        # queueing statistics, updated by PriorityTxQueue
+        self.served = 0
+        self.dropped = 0
+        self.wait_total = 0.0
+
+
+    def avg_wait( self ):
+        return self.wait_total / self.served if self.served else 0.0
+
+
+class BulkRead( object ):
+
+    def __init__( self, members, \
+                  priority = PRIORITY_HIGH, \
+                  max_queue_len = DEFAULT_MAX_QUEUE_LEN ):
+
+        self.members = list( members )
+        self.connector = tuple( member.connector for member in self.members )
+        self.direction = 'BULK'
+        self.priority = priority
+        self.max_queue_len = max( 1, max_queue_len )
+        self.drop_policy = DROP_OLDEST
+
+        self.served = 0
+        self.dropped = 0
+        self.wait_total = 0.0
@@ -1,12 +1,188 @@
 #!/usr/bin/env python3
 
+import json
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
+import threading
+
+DEFAULT_LEVEL = logging.DEBUG
+
+# arguments that cannot change before the listener thread formats them
+IMMUTABLE_ARG_TYPES = ( str, bytes, int, float, complex, bool, type( None ) )
+
+# per logger token bucket, applied before a record enters the queue
+DEFAULT_RATE  = float( 20.0 ) # records per second
+DEFAULT_BURST = int( 50 )
+
+_configured = False
+_listener = None
+_queue_handler = None
+_config_lock = threading.Lock()
+
+
+class LazyQueueHandler( logging.handlers.QueueHandler ):
+
+  # The stock QueueHandler formats the message in the calling thread;
+  # here the record is queued as is and formatted by the listener thread.
+  # Mutable arguments (dicts, lists, objects) could change meanwhile, so a
+  # record that has any is merged right away.
+  def prepare( self, record ):
+    args = record.args
+    if args:
+      values = args.values() if isinstance( args, dict ) else args
+      if not all( isinstance( value, IMMUTABLE_ARG_TYPES ) for value in values ):
+        record.msg = record.getMessage()
+        record.args = None
+    return record
+
+
+class RateLimitFilter( logging.Filter ):
+
+  # Drops records of a logger that exceed rate/s (with a burst allowance).
+  # sample_every = N keeps only every N-th DEBUG record of a logger.
+  # WARNING and above always pass.
+  def __init__( self, rate = DEFAULT_RATE, burst = DEFAULT_BURST, sample_every = int( 1 ) ):
+    logging.Filter.__init__( self )
+    self.rate = rate
+    self.burst = burst
+    self.sample_every = max( 1, sample_every )
+    self.buckets = {}
+    self.debug_counts = {}
+    self.dropped = 0
+    self.lock = threading.Lock()
+
+
+  def filter( self, record ):
+    if record.levelno >= logging.WARNING:
+      return True
+
+    with self.lock:
+      if record.levelno <= logging.DEBUG and self.sample_every > 1:
+        count = self.debug_counts.get( record.name, 0 ) + 1
+        self.debug_counts[ record.name ] = count
+        if count % self.sample_every:
+          self.dropped += 1
+          return False
+
+      if self.rate is None:
+        return True
+
+      now = time.monotonic()
+      tokens, last = self.buckets.get( record.name, ( float( self.burst ), now ) )
+      tokens = min( float( self.burst ), tokens + ( now - last ) * self.rate )
+      if tokens < 1.0:
+        self.buckets[ record.name ] = ( tokens, now )
+        self.dropped += 1
+        return False
+
+      self.buckets[ record.name ] = ( tokens - 1.0, now )
+      return True
+
+
+class JsonLinesFormatter( logging.Formatter ):
+
+  # one compact JSON object per line: t, lvl, log, msg (+ thread, exc)
+  def format( self, record ):
+    entry = { 't': round( record.created, 3 ),
+              'lvl': record.levelname,
+              'log': record.name,
+              'msg': record.getMessage() }
+    if record.threadName != 'MainThread':
+      entry[ 'thread' ] = record.threadName
+    if record.exc_info:
+      entry[ 'exc' ] = self.formatException( record.exc_info )
+    return json.dumps( entry, separators = ( ',', ':' ) )
+
+
+# Routes every logger through a queue drained by a background thread,
+# writing to the console and optionally to a JSON-lines file. May be
+# called again (e.g. after parsing command line arguments) to reconfigure.
+def configure( level = DEFAULT_LEVEL, \
+               json_path = None, \
+               rate = DEFAULT_RATE, \
+               burst = DEFAULT_BURST, \
+               sample_every = int( 1 ), \
+               console = True ):
+  global _configured, _listener, _queue_handler
+
+  with _config_lock:
+    root = logging.getLogger()
+
+    if _listener is not None:
+      _listener.stop()
+      root.removeHandler( _queue_handler )
+
+    sinks = []
+    if console:
+      console_handler = logging.StreamHandler()
+      console_handler.setFormatter( logging.Formatter( "%(levelname)s:%(name)s:%(message)s" ) )
+      sinks.append( console_handler )
+    if json_path:
+      file_handler = logging.handlers.RotatingFileHandler( json_path, \
+                                                           maxBytes = 5 * 1024 * 1024, \
+                                                           backupCount = 3 )
+      file_handler.setFormatter( JsonLinesFormatter() )
+      sinks.append( file_handler )
+
+    _queue_handler = LazyQueueHandler( queue.SimpleQueue() )
+    _queue_handler.addFilter( RateLimitFilter( rate, burst, sample_every ) )
+    _listener = logging.handlers.QueueListener( _queue_handler.queue, *sinks, \
+                                                respect_handler_level = True )
+
+    root.addHandler( _queue_handler )
+    root.setLevel( level )
+    _listener.start()
+    _configured = True
+
+
+def dropped_records():
+  if _queue_handler is None:
+    return 0
+  return sum( f.dropped for f in _queue_handler.filters if isinstance( f, RateLimitFilter ) )
+
+
+# flushes the queue, called at exit
+def shutdown():
+  global _listener
+  with _config_lock:
+    if _listener is not None:
+      _listener.stop()
+      _listener = None
+
+
+atexit.register( shutdown )
 
 
 def setup_custom_logger( name ):
 
-  logging.basicConfig( level = logging.INFO )
+  # root handler setup is only needed once per process
+  if not _configured:
+    configure()
+
+  # the level is inherited from the root logger set by configure(), so
+  # disabled messages are rejected before any formatting happens
   logger = logging.getLogger( name )
-  logger.setLevel( logging.DEBUG )
-  
+
   return logger
+
+
+def add_arguments( parser ):
+  parser.add_argument( '--log-level', default = logging.getLevelName( DEFAULT_LEVEL ).lower(), \
+                       choices = [ 'debug', 'info', 'warning', 'error' ], \
+                       help = 'Logging level' )
+  parser.add_argument( '--log-json', default = None, \
+                       help = 'Also write compact JSON-lines logs to this file' )
+  parser.add_argument( '--log-rate', type = float, default = DEFAULT_RATE, \
+                       help = 'Max records per second and logger below WARNING' )
+  parser.add_argument( '--log-sample', type = int, default = 1, \
+                       help = 'Keep only every N-th DEBUG record of a logger' )
+
+
+def configure_from_args( args ):
+  configure( level = getattr( logging, args.log_level.upper() ), \
+             json_path = args.log_json, \
+             rate = args.log_rate, \
+             sample_every = args.log_sample )
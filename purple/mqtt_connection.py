@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+mqtt_connection.py
+
+Connection manager for a paho MQTT client: runs the network loop in its own
+thread (or the caller's), reconnects with exponential backoff and jitter,
+re-issues tracked subscriptions on every connect and notifies listeners
+about connection state changes. Reconnect and recovery-time metrics are
+available through metrics().
+
+A BrokerPool holds a primary broker and standbys. Before every connect
+attempt the pool probes the candidates with a plain TCP connect and picks
+the first reachable one in list order, or the fastest one with
+prefer_latency. While connected to a pool with standbys (or one that
+prefers latency), a health thread probes the current broker every
+HEALTH_CHECK_INTERVAL so a silently dead broker is left well before the
+keepalive would notice. A single broker is never probed.
+"""
+import random
+import socket
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import log
+
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+DISCONNECTED = 'disconnected'
+STOPPED = 'stopped'
+
+DEFAULT_MIN_BACKOFF = 0.5    # unit is seconds
+DEFAULT_MAX_BACKOFF = 30.0   # unit is seconds
+DEFAULT_JITTER = 0.5         # fraction of the delay that is randomised
+LOOP_TIMEOUT = 1.0           # unit is seconds
+PROBE_TIMEOUT = 0.5          # unit is seconds
+HEALTH_CHECK_INTERVAL = 5.0  # unit is seconds
+HEALTH_CHECK_FAILURES = 2    # failed probes before the broker is abandoned
+
+logger = log.setup_custom_logger("mqtt_connection")
+
+
+def backoff_delay(attempt, min_backoff=DEFAULT_MIN_BACKOFF,
+                  max_backoff=DEFAULT_MAX_BACKOFF, jitter=DEFAULT_JITTER, rng=random):
+    """Exponential backoff for the given (1-based) attempt, with jitter."""
+    delay = min(max_backoff, min_backoff * (2 ** max(0, attempt - 1)))
+    return delay * (1.0 - jitter * rng.random())
+
+
+def parse_brokers(spec, default_port=1883):
+    """'host[:port],host[:port]' (or a list of such strings) -> [(host, port)]."""
+    if isinstance(spec, str):
+        spec = spec.split(',')
+    brokers = []
+    for entry in spec:
+        if isinstance(entry, tuple):
+            brokers.append(entry)
+            continue
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, sep, port = entry.rpartition(':')
+        if sep and port.isdigit():
+            brokers.append((host, int(port)))
+        else:
+            brokers.append((entry, default_port))
+    return brokers
+
+
+def probe(host, port, timeout=PROBE_TIMEOUT):
+    """TCP connect time to host:port in seconds, None if unreachable."""
+    start = time.monotonic()
+    try:
+        sock = socket.create_connection((host, port), timeout)
+    except OSError:
+        return None
+    sock.close()
+    return time.monotonic() - start
+
+
+class BrokerPool(object):
+
+    def __init__(self, brokers, prefer_latency=False, probe_timeout=PROBE_TIMEOUT):
+        self.brokers = parse_brokers(brokers)
+        if not self.brokers:
+            raise ValueError("broker pool needs at least one broker")
+        self.prefer_latency = prefer_latency
+        self.probe_timeout = probe_timeout
+        self.latencies = {}
+        self.failovers = 0
+        self.current = None
+
+    def probe(self, broker):
+        latency = probe(broker[0], broker[1], self.probe_timeout)
+        self.latencies[broker] = latency
+        return latency
+
+    def select(self):
+        """Broker for the next connect attempt."""
+        if len(self.brokers) == 1:
+            choice = self.brokers[0]
+        elif self.prefer_latency:
+            reachable = [(self.probe(b), i, b) for i, b in enumerate(self.brokers)]
+            reachable = [r for r in reachable if r[0] is not None]
+            choice = min(reachable)[2] if reachable else self.next_after(self.current)
+        else:
+            choice = None
+            for broker in self.brokers:
+                if self.probe(broker) is not None:
+                    choice = broker
+                    break
+            if choice is None:
+                choice = self.next_after(self.current)
+
+        if self.current is not None and choice != self.current:
+            self.failovers += 1
+        self.current = choice
+        return choice
+
+    def next_after(self, broker):
+        # nothing answers the probe: keep rotating so every broker is tried
+        if broker not in self.brokers:
+            return self.brokers[0]
+        return self.brokers[(self.brokers.index(broker) + 1) % len(self.brokers)]
+
+    def healthy(self, broker):
+        return self.probe(broker) is not None
+
+    def needs_health_check(self):
+        # with nowhere to fail over to, the keepalive is enough
+        return len(self.brokers) > 1 or self.prefer_latency
+
+    @staticmethod
+    def name(broker):
+        return "%s:%s" % broker
+
+
+class ConnectionManager(object):
+
+    def __init__(self, client, host, port=1883, keepalive=60, bind_address="",
+                 min_backoff=DEFAULT_MIN_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 jitter=DEFAULT_JITTER, pool=None):
+        self.client = client
+        # host may also be a 'host[:port],...' list, giving a BrokerPool
+        if pool is None and (not isinstance(host, str) or ',' in host):
+            pool = BrokerPool(parse_brokers(host, port))
+        self.pool = pool
+        if pool is not None:
+            host, port = pool.brokers[0]
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.bind_address = bind_address
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+        self.state = DISCONNECTED
+        self.subscriptions = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.connected_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.health_thread = None
+        self.ever_connected = False
+        self.health_failures = 0
+        self.next_health_check = 0.0
+
+        # metrics
+        self.connects = 0
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.attempt = 0
+        self.down_since = time.monotonic()
+        self.connected_since = None
+        self.last_recovery_time = None
+        self.max_recovery_time = 0.0
+        self.total_downtime = 0.0
+
+        self._on_connect = client.on_connect
+        self._on_disconnect = client.on_disconnect
+        client.on_connect = self.on_connect
+        client.on_disconnect = self.on_disconnect
+
+    # --- subscriptions and listeners ---
+
+    def subscribe(self, topic, qos=0, callback=None):
+        """Subscribes now if connected and again after every reconnect."""
+        with self.lock:
+            self.subscriptions[topic] = qos
+        if callback is not None:
+            self.client.message_callback_add(topic, callback)
+        if self.connected_event.is_set():
+            self.client.subscribe(topic, qos)
+
+    def unsubscribe(self, topic):
+        with self.lock:
+            self.subscriptions.pop(topic, None)
+        self.client.message_callback_remove(topic)
+        if self.connected_event.is_set():
+            self.client.unsubscribe(topic)
+
+    def add_state_listener(self, listener):
+        """listener(state) is called on every state change."""
+        self.listeners.append(listener)
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        for listener in list(self.listeners):
+            try:
+                listener(state)
+            except Exception:
+                logger.exception("connection state listener failed")
+
+    # --- paho callbacks ---
+
+    def on_connect(self, client, userdata, flags, rc):
+        if self._on_connect is not None:
+            self._on_connect(client, userdata, flags, rc)
+        if rc != 0:
+            logger.warning("broker %s refused connection (rc=%s)", self.host, rc)
+            self.failed_attempts += 1
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            subscriptions = list(self.subscriptions.items())
+            if self.ever_connected:
+                self.reconnects += 1
+                recovery = now - self.down_since
+                self.last_recovery_time = recovery
+                self.max_recovery_time = max(self.max_recovery_time, recovery)
+                self.total_downtime += recovery
+            self.ever_connected = True
+            self.connects += 1
+            self.attempt = 0
+            self.connected_since = now
+            self.health_failures = 0
+            self.next_health_check = now + HEALTH_CHECK_INTERVAL
+
+        if subscriptions:
+            client.subscribe(subscriptions)
+        if self.last_recovery_time is not None and self.reconnects:
+            logger.info("reconnected to %s after %.1fs", self.broker, self.last_recovery_time)
+        else:
+            logger.info("connected to broker %s", self.broker)
+
+        self.connected_event.set()
+        self.set_state(CONNECTED)
+
+    def on_disconnect(self, client, userdata, rc):
+        if self._on_disconnect is not None:
+            self._on_disconnect(client, userdata, rc)
+        if self.connected_event.is_set():
+            self.down_since = time.monotonic()
+        self.connected_event.clear()
+        self.set_state(STOPPED if self.stop_event.is_set() else DISCONNECTED)
+
+    # --- network loop ---
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="mqtt-connection", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        """Network loop with reconnects; returns after stop()."""
+        self.start_health_checks()
+        while not self.stop_event.is_set():
+            if self.client.socket() is None:
+                if not self.try_connect():
+                    continue
+            rc = self.client.loop(timeout=LOOP_TIMEOUT)
+            if rc != mqtt.MQTT_ERR_SUCCESS and not self.stop_event.is_set():
+                # connection lost (on_disconnect already ran) or refused
+                self.stop_event.wait(self.next_delay())
+
+    def start_health_checks(self):
+        # probes block for up to PROBE_TIMEOUT, keep them off the network loop
+        if self.pool is None or not self.pool.needs_health_check() or self.health_thread is not None:
+            return
+        self.health_thread = threading.Thread(target=self.health_loop, name="mqtt-health", daemon=True)
+        self.health_thread.start()
+
+    def health_loop(self):
+        while not self.stop_event.wait(HEALTH_CHECK_INTERVAL):
+            try:
+                self.check_health()
+            except Exception:
+                logger.exception("broker health check failed")
+
+    @property
+    def broker(self):
+        return "%s:%s" % (self.host, self.port)
+
+    def check_health(self):
+        # a broker that died without closing the socket is only noticed by
+        # the keepalive; probing it lets the pool fail over much sooner
+        now = time.monotonic()
+        # the first probe waits HEALTH_CHECK_INTERVAL after every connect
+        if not self.connected_event.is_set() or now < self.next_health_check:
+            return
+        if self.pool.healthy((self.host, self.port)):
+            self.health_failures = 0
+            return
+        self.health_failures += 1
+        if self.health_failures >= HEALTH_CHECK_FAILURES:
+            logger.warning("broker %s failed %d health checks, failing over",
+                           self.broker, self.health_failures)
+            self.health_failures = 0
+            # paho then sees end of stream and runs its disconnect handling
+            sock = self.client.socket()
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def try_connect(self):
+        self.set_state(CONNECTING)
+        if self.pool is not None:
+            host, port = self.pool.select()
+            if (host, port) != (self.host, self.port):
+                logger.warning("switching from broker %s to %s:%s", self.broker, host, port)
+                self.host, self.port = host, port
+        try:
+            self.client.connect(self.host, self.port, self.keepalive, self.bind_address)
+            return True
+        except Exception as e:
+            self.failed_attempts += 1
+            delay = self.next_delay()
+            logger.warning("could not connect to broker %s (%s), retrying in %.1fs",
+                           self.broker, e, delay)
+            self.set_state(DISCONNECTED)
+            self.stop_event.wait(delay)
+            return False
+
+    def next_delay(self):
+        with self.lock:
+            self.attempt += 1
+            attempt = self.attempt
+        return backoff_delay(attempt, self.min_backoff, self.max_backoff, self.jitter)
+
+    def wait_connected(self, timeout=None):
+        return self.connected_event.wait(timeout)
+
+    def stop(self):
+        self.stop_event.set()
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(LOOP_TIMEOUT * 2)
+        self.set_state(STOPPED)
+
+    def metrics(self):
+        now = time.monotonic()
+        with self.lock:
+            downtime = self.total_downtime
+            if self.state not in (CONNECTED, STOPPED) and self.ever_connected:
+                downtime += now - self.down_since
+            return {'state': self.state,
+                    'broker': self.broker,
+                    'failovers': self.pool.failovers if self.pool is not None else 0,
+                    'connects': self.connects,
+                    'reconnects': self.reconnects,
+                    'failed_attempts': self.failed_attempts,
+                    'last_recovery_time': self.last_recovery_time,
+                    'max_recovery_time': self.max_recovery_time,
+                    'total_downtime': downtime,
+                    'uptime': now - self.connected_since if self.connected_event.is_set() else 0.0}
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import sys
+import threading
 import log
 import paho.mqtt.client as mqtt
 
@@ -9,40 +9,104 @@ BROKER_IP            = "172.16.32.182"
 BROKER_PORT          = int( 1883 )
 CONNECTION_KEEPALIVE = int(   60 ) # unit is seconds
 QUALITY_OF_SERVICE   = int(    0 )
+CONNECT_TIMEOUT      = float( 10.0 ) # unit is seconds
+
+# Standby brokers ( "host" or "host:port" ) tried when BROKER_IP is down,
+# in this order unless PREFER_LOWEST_LATENCY picks the fastest reachable one.
+STANDBY_BROKERS       = []
+PREFER_LOWEST_LATENCY = False
+
+# logging setup
+logger = log.setup_custom_logger( "mqtt_config" )
+
+# set while the client is connected to the broker
+connected = threading.Event()
+
+# ConnectionManager of the client created by setup_mqtt_client
+connection = None
 
 # Every publisher/subscriber requires a mqtt client instance.
-def setup_mqtt_client( local_ip ):
+# The network loop runs in the thread of a ConnectionManager that retries
+# with exponential backoff and re-issues subscriptions made through it
+# after every reconnect. With wait = False the connection is established
+# while the caller keeps initialising (see wait_for_connection); with
+# wait = True the call blocks up to CONNECT_TIMEOUT but never gives up.
+def setup_mqtt_client( local_ip, wait = True ):
+  global connection
+  from mqtt_connection import ConnectionManager
+
+  mqtt_client = create_mqtt_client()
+
+  connection = ConnectionManager( mqtt_client,
+                                  BROKER_IP,
+                                  BROKER_PORT,
+                                  CONNECTION_KEEPALIVE,
+                                  local_ip,
+                                  pool = create_broker_pool() )
+  connection.start()
+
+  if wait and not connection.wait_connected( CONNECT_TIMEOUT ):
+    logger.error( "could not establish connection to broker %s, retrying in background", current_broker() )
+
+  return mqtt_client
+
+
+# Client with the default callbacks, neither connected nor looping
+# (the asyncio thing drives the network loop itself).
+def create_mqtt_client():
 
   mqtt_client = mqtt.Client()
   mqtt_client.on_connect = on_mqtt_connect
   mqtt_client.on_publish = on_mqtt_publish
   mqtt_client.on_disconnect = on_mqtt_disconnect
 
-  try:
-    mqtt_client.connect( BROKER_IP,
-                         BROKER_PORT,
-                         CONNECTION_KEEPALIVE,
-                         local_ip )
-  except Exception:
-    print( "could not establish connection to broker with ip : " + BROKER_IP )
-    sys.exit( 1 )
-    
-  mqtt_client.loop_start()
-
   return mqtt_client
 
 
+# Primary broker first, then the standbys.
+def create_broker_pool():
+  from mqtt_connection import BrokerPool
+
+  return BrokerPool( [ ( BROKER_IP, BROKER_PORT ) ] + list( STANDBY_BROKERS ),
+                     prefer_latency = PREFER_LOWEST_LATENCY )
+
+
+# broker the client is currently on ( "host:port" )
+def current_broker():
+  if connection is None:
+    return "%s:%s" % ( BROKER_IP, BROKER_PORT )
+  return connection.broker
+
+
+def wait_for_connection( timeout = None ):
+  return connected.wait( timeout )
+
+
+# Subscribes through the connection manager when there is one, so that the
+# subscription survives reconnects.
+def subscribe( mqtt_client, topic, qos = QUALITY_OF_SERVICE, callback = None ):
+  if connection is not None and connection.client is mqtt_client:
+    connection.subscribe( topic, qos, callback )
+    return
+  if callback is not None:
+    mqtt_client.message_callback_add( topic, callback )
+  mqtt_client.subscribe( topic, qos )
+
+
 # functions where the instance of the mqtt client points on
 def on_mqtt_publish( client, userdata, mid ):
-  print( "MQTT client successfully published a message to broker " + BROKER_IP )
+  logger.debug( "MQTT client successfully published a message to broker %s", current_broker() )
 
 
 def on_mqtt_connect( client, userdata, flags, rc ):
-  print( "connected to broker with result code: " + str( rc ) )
+  logger.info( "connected to broker with result code: %s", rc )
+  if rc == 0:
+    connected.set()
 
 
 def on_mqtt_disconnect( client, userdata, rc ):
+  connected.clear()
   if rc != 0:
-    print( "Unexpected disconnection." )
+    logger.warning( "Unexpected disconnection." )
   else:
-    print( "MQTT client disconnected without errors." )
+    logger.info( "MQTT client disconnected without errors." )
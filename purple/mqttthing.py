@@ -4,21 +4,30 @@
 mqttthing.py
 
 Main program that creates resources using the project's Sensor/Actuator
-architecture. This version creates two SHT35 sensors (red and purple) and
-an LED actuator on the purple Pi. The GrovePi interactor is started if
-required by actuators.
+architecture. The resources of a thing (type, connector, topics, intervals)
+and its hardware backend are declared in a JSON config file, see
+thing_config.py; `--role red|purple` picks config/<role>.json. Driver
+modules are only imported for declared resource types and the GrovePi
+interactor is only started if a resource needs it.
 
-Usage: python3 mqttthing.py
+Usage: python3 mqttthing.py --role purple
+       python3 mqttthing.py --config /path/to/thing.json
 """
 
+import sys
+import startup_profile
+
+# must run before the remaining imports so that they are timed as well
+if '--profile-startup' in sys.argv:
+    startup_profile.enable()
+
 import signal
 import threading
+import hal
 import log
 import mqttconfig
-
-from SHT35Resource import SHT35Resource
-from LedResource import LedResource
-from grove_pi_interface import GrovePiInteractor
+import thing_config
+import profiling
 
 # network and pins config (adapt to your hardware)
 NETWORK_INTERFACE = "eth0"
@@ -34,15 +43,35 @@ lock = threading.Lock()
 resources = {}
 mqtt_client = None
 
-# create a single instance of GrovePi interactor (used by LedResource)
-gpi = GrovePiInteractor()
+# single instance of GrovePi interactor, created when a resource needs it
+gpi = None
+
+# outbound publisher thread, owns publishing on the mqtt client
+publisher = None
+
+# publishes the resource telemetry summaries
+telemetry_reporter = None
+
+# set once the resources are torn down, ends the main loop
+shutdown = threading.Event()
+
+# how long sensors wait for the broker before they start polling anyway
+CONNECT_WAIT_TIMEOUT = 10.0
 
 
 def signal_handler(*args):
+    if shutdown.is_set():
+        return
     logger.debug("Shutting down, tearing down resources...")
     # stop sensor threads and actuators
     for key, res in resources.items():
         try:
+            if hasattr(res, 'current_interval'):
+                logger.debug("%s: interval %.1fs (configured %.1fs), duty-cycle savings %.0f%%",
+                             key, res.current_interval, res.polling_interval,
+                             100.0 * res.duty_cycle_savings())
+            if hasattr(res, 'schedule'):
+                logger.debug("%s: schedule %s", key, res.schedule.stats())
             if hasattr(res, 'running'):
                 res.running = False
             if hasattr(res, 'tear_down'):
@@ -50,84 +79,182 @@ def signal_handler(*args):
         except Exception:
             pass
 
+    if telemetry_reporter is not None:
+        telemetry_reporter.stop()
+
+    # flush pending messages before the connection goes away
+    if publisher is not None:
+        publisher.stop()
+        logger.debug("Publisher stats: %s", publisher.stats())
+
     # stop grovepi interactor
-    try:
-        gpi.stop_interactor()
-    except Exception:
-        pass
+    if gpi is not None:
+        try:
+            logger.debug("GrovePi queue stats: %s", gpi.queue_stats())
+            gpi.stop_interactor()
+        except Exception:
+            pass
 
-    if mqtt_client:
+    if mqttconfig.connection is not None:
+        logger.debug("MQTT connection metrics: %s", mqttconfig.connection.metrics())
+        mqttconfig.connection.stop()
+    elif mqtt_client:
         try:
-            mqtt_client.loop_stop()
             mqtt_client.disconnect()
         except Exception:
             pass
 
+    shutdown.set()
+
 
 def main():
-    global mqtt_client, LOCAL_IP
+    global mqtt_client, LOCAL_IP, gpi, publisher, telemetry_reporter
 
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('--role', choices=['red', 'purple'], required=True, help='Role of this Pi: red or purple')
+    parser.add_argument('--role', choices=['red', 'purple'], help='Role of this Pi: loads config/<role>.json')
+    parser.add_argument('--config', help='Thing config file (overrides --role)')
     parser.add_argument('--simulate', action='store_true', help='Simulate sensors (no I2C)')
-    parser.add_argument('--led-pin', type=int, default=4, help='GrovePi connector pin for LED (purple)')
+    parser.add_argument('--led-pin', type=int, default=None,
+                        help='Override the GrovePi connector of the first LED in the config')
+    parser.add_argument('--adaptive-polling', action='store_true',
+                        help='Lengthen the polling interval while readings are stable')
+    parser.add_argument('--min-interval', type=float, default=2.0, help='Adaptive polling floor (s)')
+    parser.add_argument('--max-interval', type=float, default=60.0, help='Adaptive polling ceiling (s)')
+    parser.add_argument('--backend', choices=hal.BACKEND_NAMES, default=None,
+                        help='Hardware backend (default from config; --simulate implies sim)')
+    parser.add_argument('--broker', default=None,
+                        help='Broker list host[:port],... (first is primary, the others standbys)')
+    parser.add_argument('--prefer-latency', action='store_true',
+                        help='Connect to the reachable broker with the lowest latency')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='Run all resources on a single asyncio event loop')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Log import/initialisation timings up to the first published reading')
+    parser.add_argument('--telemetry-interval', type=float, default=None,
+                        help='Seconds between resource telemetry summaries (0 disables, default from config)')
+    profiling.add_arguments(parser)
+    log.add_arguments(parser)
     args = parser.parse_args()
+    log.configure_from_args(args)
+
+    if args.config is None and args.role is None:
+        parser.error('one of --role or --config is required')
+
+    with startup_profile.phase("load_config"):
+        config = thing_config.load_config(args.config or thing_config.config_path_for_role(args.role))
+
+    if args.led_pin is not None:
+        for spec in config["resources"].values():
+            if spec["type"] == 'led':
+                spec["connector"] = args.led_pin
+                break
+
+    if args.broker:
+        from mqtt_connection import parse_brokers
+        brokers = parse_brokers(args.broker, mqttconfig.BROKER_PORT)
+        mqttconfig.BROKER_IP, mqttconfig.BROKER_PORT = brokers[0]
+        mqttconfig.STANDBY_BROKERS = brokers[1:]
+    if args.prefer_latency:
+        mqttconfig.PREFER_LOWEST_LATENCY = True
 
     signal.signal(signal.SIGINT, signal_handler)
 
-    # default broker setup
-    mqtt_client = mqttconfig.setup_mqtt_client("0.0.0.0")
-    mqtt_client.connect(mqttconfig.BROKER_IP, mqttconfig.BROKER_PORT, mqttconfig.CONNECTION_KEEPALIVE)
-    mqtt_client.loop_start()
-    # start the GrovePi interactor thread (needed by LedResource when used)
-    gpi.start()
-
-    # create resources based on role
-    if args.role == 'red':
-        resources['sht_red'] = SHT35Resource(connector=0,
-                                             lock=lock,
-                                             mqtt_client=mqtt_client,
-                                             running=True,
-                                             pub_topic='sensors/zone/red/temperature',
-                                             polling_interval=10.0,
-                                             simulate=args.simulate,
-                                             use_dht=True,
-                                             dht_port=3,
-                                             dht_type=1)  # WHITE sensor
-    elif args.role == 'purple':
-        resources['sht_purple'] = SHT35Resource(connector=0,
-                                                lock=lock,
-                                                mqtt_client=mqtt_client,
-                                                running=True,
-                                                pub_topic='sensors/zone/purple/temperature',
-                                                polling_interval=10.0,
-                                                simulate=args.simulate,
-                                                use_dht=True,
-                                                dht_port=3,
-                                                dht_type=1)  # WHITE sensor
-
-        # LED rosso (temperatura) su D5
-        led_red = LedResource(connector=args.led_pin,
-                              mqtt_client=mqtt_client,
-                              sub_topic='actuators/zone/purple/led',
-                              nuances_resolution=2)
-        resources['led_red'] = led_red
-        mqtt_client.subscribe('actuators/zone/purple/led')
-        mqtt_client.message_callback_add('actuators/zone/purple/led', led_red.on_mqtt_message)
-
-        # LED verde (umidità) su D6
-        led_green = LedResource(connector=6,
-                                mqtt_client=mqtt_client,
-                                sub_topic='actuators/zone/purple/led_humidity',
-                                nuances_resolution=2)
-        resources['led_green'] = led_green
-        mqtt_client.subscribe('actuators/zone/purple/led_humidity')
-        mqtt_client.message_callback_add('actuators/zone/purple/led_humidity', led_green.on_mqtt_message)
+    backend_name = 'sim' if args.simulate else (args.backend or config.get("backend", "auto"))
+    with startup_profile.phase("hardware_backend"):
+        backend = hal.set_backend(hal.create_backend(backend_name))
+    logger.debug("Using %s hardware backend", backend.name)
+
+    adaptive_default = None
+    if args.adaptive_polling:
+        adaptive_default = {"min_interval": args.min_interval,
+                            "max_interval": args.max_interval}
+
+    # default broker setup (the asyncio thing connects from its event loop);
+    # the connection is made in the background while resources are set up
+    with startup_profile.phase("mqtt_setup"):
+        if args.asyncio:
+            mqtt_client = mqttconfig.create_mqtt_client()
+        else:
+            mqtt_client = mqttconfig.setup_mqtt_client("0.0.0.0", wait=False)
+
+    if startup_profile.enabled():
+        on_publish = mqtt_client.on_publish
+
+        def on_first_publish(client, userdata, mid):
+            if startup_profile.mark("first_publish"):
+                startup_profile.report(logger)
+            on_publish(client, userdata, mid)
+
+        mqtt_client.on_publish = on_first_publish
+
+    thing_name = config.get("thing") or args.role or "thing"
+
+    # on-demand profiling through SIGUSR1/SIGUSR2 and control/<thing>/profiling
+    profiling_control = None
+    if args.profiling_control:
+        profiling_control = profiling.ProfilingControl(thing_name, args.profile_dir)
+        profiling_control.install_signal_handlers()
+        profiling_topic = profiling.control_topic(thing_name)
+
+    # resources queue their messages, the publisher thread sends them
+    publisher = thing_config.create_publisher(config, mqtt_client)
+    publisher.start()
+
+    # create the resources declared in the config
+    with startup_profile.phase("resources"):
+        resources.update(thing_config.build_resources(config, lock, mqtt_client,
+                                                      simulate=args.simulate,
+                                                      adaptive_default=adaptive_default,
+                                                      publisher=publisher))
+
+    # resources follow the broker connection state
+    if mqttconfig.connection is not None:
+        for res in resources.values():
+            if hasattr(res, 'on_connection_state'):
+                mqttconfig.connection.add_state_listener(res.on_connection_state)
+                res.on_connection_state(mqttconfig.connection.state)
+
+    # periodic summaries of poll periods, read durations, failures and queue waits
+    telemetry_reporter = thing_config.create_telemetry(config, thing_name, resources, publisher,
+                                                       args.telemetry_interval)
+    if telemetry_reporter is not None:
+        telemetry_reporter.start()
+
+    # start the GrovePi interactor thread only when a resource talks to it
+    if any(getattr(res, 'grovepi_interactor_member', None) is not None
+           for res in resources.values()):
+        with startup_profile.phase("grovepi_interactor"):
+            from grove_pi_interface import GrovePiInteractor
+            gpi = GrovePiInteractor()
+            gpi.start()
+
+    if args.asyncio:
+        # sensors and MQTT on one event loop, hardware reads in an executor;
+        # publisher, telemetry and GrovePi interactor keep their threads
+        from async_thing import AsyncThing
+        thing = AsyncThing(mqtt_client, resources)
+        if profiling_control is not None:
+            thing.subscribe(profiling_topic, profiling_control.on_mqtt_message)
+        signal.signal(signal.SIGINT, lambda *args: thing.stop())
+        thing.run(mqttconfig.create_broker_pool(), mqttconfig.CONNECTION_KEEPALIVE)
+        signal_handler()
+        return
+
+    with startup_profile.phase("mqtt_connect_wait"):
+        if not mqttconfig.wait_for_connection(CONNECT_WAIT_TIMEOUT):
+            logger.error("could not connect to broker %s yet, retrying in background",
+                         mqttconfig.current_broker())
+    startup_profile.mark("mqtt_connected")
+
+    thing_config.subscribe_actuators(mqtt_client, resources, mqttconfig.QUALITY_OF_SERVICE)
+    if profiling_control is not None:
+        mqttconfig.subscribe(mqtt_client, profiling_topic, mqttconfig.QUALITY_OF_SERVICE,
+                             profiling_control.on_mqtt_message)
 
     # start sensor threads
     for key, res in resources.items():
-        if hasattr(res, 'start') and callable(res.start):
+        if hasattr(res, 'poll_sensor') or hasattr(res, 'query_system_time'):
             try:
                 res.start()
             except Exception:
@@ -135,7 +262,7 @@ def main():
 
     # main thread just waits until interrupted
     try:
-        while True:
+        while not shutdown.is_set():
             signal.pause()
     except KeyboardInterrupt:
         signal_handler()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+profiling.py
+
+Opt-in profiling of a running process without stopping it: a sampling
+profiler thread (folded stacks, usable with flamegraph.pl or speedscope),
+per-thread stack dumps and tracemalloc heap snapshots, all written to an
+output directory for offline analysis.
+
+ProfilingControl executes the commands in its own worker thread; they can
+come from signals (SIGUSR1 toggles the sampling profiler, SIGUSR2 dumps
+stacks and a heap snapshot) or from an MQTT control topic whose payload
+is one of COMMANDS.
+"""
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+import log
+
+DEFAULT_INTERVAL = 0.01     # seconds between samples
+DEFAULT_OUT_DIR = "profiles"
+HEAP_FRAMES = 10            # frames kept per tracemalloc allocation
+
+COMMANDS = ('profile-start', 'profile-stop', 'profile-toggle', 'stacks', 'heap', 'heap-stop')
+
+logger = log.setup_custom_logger("profiling")
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return "%s:%s:%d" % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno)
+
+
+class SamplingProfiler(threading.Thread):
+    """Samples the stacks of all other threads every `interval` seconds."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        threading.Thread.__init__(self, name="sampling-profiler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stop_event = threading.Event()
+
+    def run(self):
+        self.started_at = time.monotonic()
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+        return path
+
+
+def format_stacks():
+    """Current stack of every thread, as text."""
+    names = {t.ident: t for t in threading.enumerate()}
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        thread = names.get(ident)
+        name = thread.name if thread is not None else str(ident)
+        daemon = " daemon" if thread is not None and thread.daemon else ""
+        lines.append("--- thread %s (%d)%s\n" % (name, ident, daemon))
+        lines.extend(traceback.format_stack(frame))
+    return "".join(lines)
+
+
+class ProfilingControl(object):
+
+    def __init__(self, name, out_dir=DEFAULT_OUT_DIR, interval=DEFAULT_INTERVAL):
+        self.name = name
+        self.out_dir = out_dir
+        self.interval = interval
+        self.profiler = None
+        self.last_heap = None
+        self.commands = queue.SimpleQueue()
+        self.worker = threading.Thread(target=self.work, name="profiling-control", daemon=True)
+        self.worker.start()
+
+    # --- triggers, they only queue a command ---
+
+    def submit(self, command):
+        if command not in COMMANDS:
+            logger.warning("unknown profiling command %r", command)
+            return
+        self.commands.put(command)
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGUSR1, lambda *args: self.submit('profile-toggle'))
+        signal.signal(signal.SIGUSR2, lambda *args: (self.submit('stacks'), self.submit('heap')))
+
+    def on_mqtt_message(self, client, userdata, message):
+        self.submit(message.payload.decode("ascii", "replace").strip().lower())
+
+    # --- worker thread ---
+
+    def work(self):
+        while True:
+            command = self.commands.get()
+            try:
+                self.execute(command)
+            except Exception:
+                logger.exception("profiling command %s failed", command)
+
+    def execute(self, command):
+        if command == 'profile-toggle':
+            command = 'profile-stop' if self.profiler is not None else 'profile-start'
+
+        if command == 'profile-start':
+            self.start_profiler()
+        elif command == 'profile-stop':
+            self.stop_profiler()
+        elif command == 'stacks':
+            path = self.output_path("stacks", "txt")
+            with open(path, "w") as f:
+                f.write(format_stacks())
+            logger.info("thread stacks written to %s", path)
+        elif command == 'heap':
+            self.heap_snapshot()
+        elif command == 'heap-stop':
+            import tracemalloc
+            tracemalloc.stop()
+            self.last_heap = None
+            logger.info("tracemalloc stopped")
+
+    def output_path(self, kind, extension):
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.out_dir, "%s-%s-%s-%d.%s" % (self.name, kind, stamp, os.getpid(), extension))
+
+    def start_profiler(self):
+        if self.profiler is not None:
+            return
+        self.profiler = SamplingProfiler(self.interval)
+        self.profiler.start()
+        logger.info("sampling profiler started (every %.0f ms)", self.interval * 1000.0)
+
+    def stop_profiler(self):
+        if self.profiler is None:
+            return
+        profiler, self.profiler = self.profiler, None
+        profiler.stop()
+        path = profiler.write_folded(self.output_path("profile", "folded"))
+        logger.info("sampling profiler stopped after %d samples, folded stacks in %s",
+                    profiler.samples, path)
+
+    def heap_snapshot(self):
+        # tracemalloc is only started on the first request, so it costs
+        # nothing until then; that first snapshot is the baseline
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(HEAP_FRAMES)
+            logger.info("tracemalloc started, request another heap snapshot to see growth")
+        snapshot = tracemalloc.take_snapshot()
+        path = self.output_path("heap", "tracemalloc")
+        snapshot.dump(path)
+        current, peak = tracemalloc.get_traced_memory()
+        logger.info("heap snapshot written to %s (traced %d kB, peak %d kB)",
+                    path, current // 1024, peak // 1024)
+        if self.last_heap is not None:
+            for stat in snapshot.compare_to(self.last_heap, 'lineno')[:5]:
+                logger.info("heap growth: %s", stat)
+        self.last_heap = snapshot
+
+
+def add_arguments(parser):
+    parser.add_argument('--profiling-control', action='store_true',
+                        help='Enable SIGUSR1/SIGUSR2 and the profiling control topic')
+    parser.add_argument('--profile-dir', default=DEFAULT_OUT_DIR,
+                        help='Directory for profiles, stack dumps and heap snapshots')
+
+
+def control_topic(name):
+    return "control/%s/profiling" % name
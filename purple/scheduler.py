@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+scheduler.py
+
+Drift-free periodic scheduling. A Schedule fires on absolute deadlines
+kept on the monotonic clock, so the time spent reading and publishing does
+not push the next run back. Deadlines are aligned to wall-clock multiples
+of the interval (plus a phase offset): things polling every 10 s all read
+at :00, :10, :20 ... and their readings line up across zones, while the
+phase spreads the resources of one thing over the GrovePi bus.
+
+A late run is recorded as jitter; deadlines that were missed completely
+are skipped instead of being fired back to back.
+"""
+import math
+import time
+
+DEFAULT_PHASE_STEP = 0.1    # seconds between the deadlines of a thing's sensors
+
+
+class Schedule(object):
+
+    def __init__(self, interval, phase=0.0, clock=time.monotonic, wall_clock=time.time):
+        self.interval = float(interval)
+        self.phase = float(phase)
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.deadline = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.fired_count = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.missed = 0
+
+    def aligned_deadline(self, now):
+        """Monotonic time of the first aligned boundary after now."""
+        wall = self.wall_clock()
+        if self.interval <= 0:
+            return now
+        boundary = math.floor((wall - self.phase) / self.interval + 1.0) * self.interval + self.phase
+        return now + (boundary - wall)
+
+    def set_interval(self, interval):
+        """Changes the period; the next deadline is re-aligned to it."""
+        if float(interval) != self.interval:
+            self.interval = float(interval)
+            self.deadline = None
+
+    def fired(self, now=None):
+        """To be called when the scheduled work starts; advances the deadline."""
+        if self.deadline is None:
+            # first run, or the first after a change of interval: not scheduled
+            return
+        if now is None:
+            now = self.clock()
+        jitter = max(0.0, now - self.deadline)
+        self.fired_count += 1
+        self.jitter_total += jitter
+        if jitter > self.jitter_max:
+            self.jitter_max = jitter
+
+        self.deadline += self.interval
+        if self.deadline <= now and self.interval > 0:
+            skipped = int((now - self.deadline) // self.interval) + 1
+            self.missed += skipped
+            self.deadline += skipped * self.interval
+
+    def delay(self, now=None):
+        """Seconds until the next deadline."""
+        if now is None:
+            now = self.clock()
+        if self.deadline is None:
+            self.deadline = self.aligned_deadline(now)
+        return max(0.0, self.deadline - now)
+
+    def wait(self, keep_waiting=None, check_interval=None):
+        """
+        Sleeps until the next deadline. With keep_waiting, sleeps in slices
+        of check_interval and returns False as soon as it returns False.
+        """
+        delay = self.delay()
+        if keep_waiting is None or not check_interval:
+            time.sleep(delay)
+            return True
+        while delay > 0:
+            time.sleep(min(delay, check_interval))
+            if not keep_waiting():
+                return False
+            delay = self.delay()
+        return keep_waiting()
+
+    def stats(self, reset=False):
+        stats = {"fired": self.fired_count,
+                 "missed": self.missed,
+                 "mean_jitter_ms": round(self.jitter_total * 1000.0 / self.fired_count, 3)
+                 if self.fired_count else 0.0,
+                 "max_jitter_ms": round(self.jitter_max * 1000.0, 3)}
+        if reset:
+            self.reset_stats()
+        return stats
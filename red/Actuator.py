@@ -2,6 +2,7 @@
 
 import threading
 import mqttconfig
+import telemetry
 
 
 class Actuator( threading.Thread ):
@@ -11,12 +12,21 @@ class Actuator( threading.Thread ):
                 sub_topic, \
                 nuances_resolution = int( 2 ) ):
 
+    # must be called ...
+    threading.Thread.__init__( self )
+
     self.connector = connector
     self.mqtt_client = mqtt_client
     self.sub_topic = sub_topic
     self.nuances_resolution = nuances_resolution
     self.grovepi_interactor_member = None
 
+    # maintained by the connection manager through on_connection_state
+    self.broker_connected = False
+
+    # commands received, queue waits come from the interactor member
+    self.telemetry = telemetry.ResourceTelemetry()
+
     # subscribe will be done by caller after mqtt client created
 
   # Function has to be overridden in derived class.
@@ -24,6 +34,12 @@ class Actuator( threading.Thread ):
     pass  
 
 
+  # Called by the connection manager with 'connecting', 'connected',
+  # 'disconnected' or 'stopped'; derived classes may override.
+  def on_connection_state( self, state ):
+    self.broker_connected = ( state == 'connected' )
+
+
   # Function has to be overridden in derived class.
   def set_actuator( self, value ):
     pass
@@ -33,13 +33,16 @@ class LedResource( Actuator ):
 
   def on_mqtt_message( self, client, userdata, message ):
     payload = str( "" )
-    logger.debug( "Got message on topic: " + str( message.topic ) )
+    logger.debug( "Got message on topic: %s", message.topic )
     payload = self.decode_payload_ascii_str( message.payload )
+    self.telemetry.command()
 
     if self.input_valid( payload ):
       new_value = self.str_to_bool( payload )
 
-      if not self.is_equal( new_value, self.value ):
+      # a retained command is the state to restore right after (re)subscribing,
+      # it is applied even if it matches the value the LED was initialised with
+      if message.retain or not self.is_equal( new_value, self.value ):
         self.value = new_value
         self.set_actuator( self.value )
 
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+'''
+                    ___           ___           ___     
+        ___        /\__\         /\  \         /\  \    
+       /\  \      /::|  |       /::\  \       /::\  \   
+       \:\  \    /:|:|  |      /:/\:\  \     /:/\ \  \  
+       /::\__\  /:/|:|  |__   /::\~\:\  \   _\:\~\ \  \ 
+    __/:/\/__/ /:/ |:| /\__\ /:/\:\ \:\__\ /\ \:\ \ \__\
+   /\/:/  /    \/__|:|/:/  / \:\~\:\ \/__/ \:\ \:\ \/__/
+   \::/__/         |:/:/  /   \:\ \:\__\    \:\ \:\__\  
+    \:\__\         |::/  /     \:\ \/__/     \:\/:/  /  
+     \/__/         /:/  /       \:\__\        \::/  /   
+                   \/__/         \/__/         \/__/    
+
+
+    File:          TimeResource.py
+    
+
+    Purpose:       Derived class from the
+                   python internal thread class.
+                   
+                   This resource's pupose
+                   is to get the operating
+                   system's time and publish
+                   it under a MQTT topic.
+                   The querying time interval of
+                   the resource is currently
+                   set to 2 seconds.
+                   
+    
+    Remarks:       - 
+
+
+    Author:        P. Leibundgut <leiu@zhaw.ch>
+    
+    
+    Date:          10/2016
+
+'''
+
+import threading
+import datetime
+
+import log
+import mqttconfig
+import scheduler
+
+
+ALIVE_CHECK_INTERVAL_IN_MILLIS = int( 100 )
+ALIVE_CHECK_INTERVAL_IN_S = float( ALIVE_CHECK_INTERVAL_IN_MILLIS / 1000 )
+
+
+# logging setup
+logger = log.setup_custom_logger( "mqtt_thing_time_resource" )
+
+
+class TimeResource( threading.Thread ):
+    
+  def __init__( self, lock, \
+                mqtt_client, \
+                running, \
+                pub_topic, \
+                pub_interval = float( 2.0 ) ):
+    
+    # must be called ...
+    threading.Thread.__init__( self )
+       
+    self.lock = lock
+    self.mqtt_client = mqtt_client
+    self.running = running
+    self.pub_topic = pub_topic
+    self.pub_interval = pub_interval # unit is seconds ...
+
+    # set by the thing when an outbound publisher owns the client
+    self.publisher = None
+
+    # publishes on wall-clock aligned deadlines, without drifting
+    self.schedule = scheduler.Schedule( pub_interval )
+
+
+  def is_running( self ):
+    self.lock.acquire()
+    keep_querying = self.running
+    self.lock.release()
+    return keep_querying
+
+
+  def query_system_time( self ):
+    keep_querying = self.is_running()
+
+    while keep_querying:
+      self.schedule.fired()
+      self.publish_time()
+
+      # still checks for a stop request every ALIVE_CHECK_INTERVAL_IN_S
+      keep_querying = self.schedule.wait( self.is_running, \
+                                          ALIVE_CHECK_INTERVAL_IN_S )
+
+
+  # asyncio variant of query_system_time, scheduled as a task on the
+  # thing's loop; publishing only queues the message, no executor needed.
+  async def async_poll_sensor( self, executor = None ):
+    import asyncio
+    while self.is_running():
+      self.schedule.fired()
+      self.publish_time()
+      await asyncio.sleep( self.schedule.delay() )
+
+
+  def publish_time( self ):
+    payload = str( datetime.datetime.now().strftime( "%Y-%m-%d %H:%M:%S" ) )
+    if self.publisher is not None:
+      self.publisher.publish( self.pub_topic, str( payload ), \
+                              mqttconfig.QUALITY_OF_SERVICE, False )
+    else:
+      self.mqtt_client.publish( self.pub_topic, str( payload ), \
+                                mqttconfig.QUALITY_OF_SERVICE, False )
+
+
+  def run( self ):
+    self.query_system_time()
+
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+hal.py
+
+Hardware abstraction layer behind the GrovePi functions (digital/analog
+read and write, pinMode, dht), the I2C bus used by the SHT35 and edge
+detection on the Raspberry Pi's own GPIO pins.
+
+Backends:
+    PiBackend        - real hardware through grovepi / smbus2 / RPi.GPIO
+                       (imported lazily)
+    NullBackend      - reads return 0 immediately, writes are ignored
+    SimulatorBackend - realistic per-call latencies, error rates and scripted
+                       signal waveforms, so interactor throughput and polling
+                       behaviour can be measured without a Raspberry Pi
+
+The active backend is process wide: select it once at startup with
+set_backend() / create_backend(); get_backend() falls back to 'auto', which
+picks PiBackend when grovepi is installed or the Pi's I2C bus exists and
+NullBackend otherwise (simulated latencies are opt-in, through 'sim').
+"""
+import math
+import os
+import random
+import threading
+import time
+
+BACKEND_NAMES = ('auto', 'pi', 'sim', 'null')
+
+# typical duration of one call on a Pi 3 with a GrovePi+ (seconds)
+DEFAULT_LATENCIES = {
+    'pin_mode': 0.002,
+    'digital_read': 0.002,
+    'analog_read': 0.003,
+    'digital_write': 0.002,
+    'analog_write': 0.002,
+    'dht': 0.25,
+    'i2c_write': 0.0005,
+    'i2c_read': 0.001,
+}
+
+SHT35_ADDR = 0x44
+I2C_DEVICE = '/dev/i2c-1'     # bus of the GrovePi and the SHT35 on a Raspberry Pi
+
+
+class Backend(object):
+    """Interface every hardware backend implements."""
+
+    name = 'base'
+
+    def pin_mode(self, pin, mode):
+        raise NotImplementedError
+
+    def digital_read(self, pin):
+        raise NotImplementedError
+
+    def analog_read(self, pin):
+        raise NotImplementedError
+
+    def digital_write(self, pin, value):
+        raise NotImplementedError
+
+    def analog_write(self, pin, value):
+        raise NotImplementedError
+
+    def dht(self, port, dht_type):
+        """Returns [temperature, humidity], NaN when the sensor gave no data."""
+        raise NotImplementedError
+
+    def i2c_write_block(self, bus_num, addr, register, data):
+        raise NotImplementedError
+
+    def i2c_read_block(self, bus_num, addr, register, length):
+        raise NotImplementedError
+
+    def gpio_watch(self, pin, callback):
+        """Calls callback(pin) from another thread on every edge of GPIO pin (BCM)."""
+        raise NotImplementedError("no GPIO edge detection on the %s backend" % self.name)
+
+    def gpio_read(self, pin):
+        raise NotImplementedError("no GPIO on the %s backend" % self.name)
+
+    def gpio_unwatch(self, pin):
+        pass
+
+
+class PiBackend(Backend):
+    """Real hardware; grovepi and smbus2 are only imported on first use."""
+
+    name = 'pi'
+
+    def __init__(self):
+        self._grovepi = None
+        self._gpio = None
+        self._buses = {}
+        self._bus_lock = threading.Lock()
+
+    @property
+    def grovepi(self):
+        if self._grovepi is None:
+            import grovepi
+            self._grovepi = grovepi
+        return self._grovepi
+
+    @property
+    def gpio(self):
+        if self._gpio is None:
+            import RPi.GPIO as GPIO
+            GPIO.setwarnings(False)
+            GPIO.setmode(GPIO.BCM)
+            self._gpio = GPIO
+        return self._gpio
+
+    def bus(self, bus_num):
+        with self._bus_lock:
+            bus = self._buses.get(bus_num)
+            if bus is None:
+                from smbus2 import SMBus
+                bus = SMBus(bus_num)
+                self._buses[bus_num] = bus
+            return bus
+
+    def pin_mode(self, pin, mode):
+        self.grovepi.pinMode(pin, mode)
+
+    def digital_read(self, pin):
+        return self.grovepi.digitalRead(pin)
+
+    def analog_read(self, pin):
+        return self.grovepi.analogRead(pin)
+
+    def digital_write(self, pin, value):
+        return self.grovepi.digitalWrite(pin, value)
+
+    def analog_write(self, pin, value):
+        return self.grovepi.analogWrite(pin, value)
+
+    def dht(self, port, dht_type):
+        return self.grovepi.dht(port, dht_type)
+
+    def i2c_write_block(self, bus_num, addr, register, data):
+        self.bus(bus_num).write_i2c_block_data(addr, register, data)
+
+    def i2c_read_block(self, bus_num, addr, register, length):
+        return self.bus(bus_num).read_i2c_block_data(addr, register, length)
+
+    def gpio_watch(self, pin, callback):
+        # raises RuntimeError when edge detection cannot be set up on the pin
+        self.gpio.setup(pin, self.gpio.IN)
+        self.gpio.add_event_detect(pin, self.gpio.BOTH, callback=callback)
+
+    def gpio_read(self, pin):
+        return self.gpio.input(pin)
+
+    def gpio_unwatch(self, pin):
+        self.gpio.remove_event_detect(pin)
+
+
+class NullBackend(Backend):
+    """Previous placeholder behaviour: no latency, reads are always 0."""
+
+    name = 'null'
+
+    def pin_mode(self, pin, mode):
+        pass
+
+    def digital_read(self, pin):
+        return 0
+
+    def analog_read(self, pin):
+        return 0
+
+    def digital_write(self, pin, value):
+        return None
+
+    def analog_write(self, pin, value):
+        return None
+
+    def dht(self, port, dht_type):
+        return [float('nan'), float('nan')]
+
+    def i2c_write_block(self, bus_num, addr, register, data):
+        pass
+
+    def i2c_read_block(self, bus_num, addr, register, length):
+        return [0] * length
+
+
+# --- waveforms: callables mapping seconds since start to a value ---
+
+def constant(value):
+    return lambda t: value
+
+
+def sine(mean, amplitude, period, phase=0.0):
+    return lambda t: mean + amplitude * math.sin(2.0 * math.pi * (t + phase) / period)
+
+
+def square(low, high, period, duty=0.5):
+    return lambda t: high if (t % period) < duty * period else low
+
+
+def scripted(points, repeat=False):
+    """Piecewise linear through [(t, value), ...]; holds the last value."""
+    points = sorted(points)
+    span = points[-1][0]
+
+    def waveform(t):
+        if repeat and span > 0:
+            t = t % span
+        if t <= points[0][0]:
+            return points[0][1]
+        for (t0, v0), (t1, v1) in zip(points, points[1:]):
+            if t <= t1:
+                return v0 + (v1 - v0) * (t - t0) / (t1 - t0) if t1 > t0 else v1
+        return points[-1][1]
+
+    return waveform
+
+
+def with_noise(waveform, sigma, rng=random):
+    return lambda t: waveform(t) + rng.gauss(0.0, sigma)
+
+
+def sht35_crc(data):
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+class SimulatorBackend(Backend):
+    """
+    Simulated GrovePi + I2C bus.
+
+    Every call sleeps for its latency (with +-jitter, scaled by time_scale)
+    while holding a bus lock, as concurrent callers would on the real bus.
+    With probability error_rate a call raises IOError like grovepi does.
+    Inputs follow waveforms keyed by ('digital', pin), ('analog', pin),
+    ('dht', port) and ('i2c', addr); the latter two map to a
+    (temperature, humidity) pair of waveforms. GPIO pins only change through
+    set_gpio(), which calls the watchers like the RPi.GPIO event thread.
+    """
+
+    name = 'sim'
+
+    def __init__(self, latencies=None, error_rate=0.0, jitter=0.2,
+                 time_scale=1.0, waveforms=None, seed=None, clock=time.monotonic):
+        self.latencies = dict(DEFAULT_LATENCIES)
+        self.latencies.update(latencies or {})
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.start = clock()
+
+        climate = (with_noise(sine(21.0, 1.5, 600.0), 0.05, self.rng),
+                   with_noise(sine(50.0, 8.0, 900.0), 0.3, self.rng))
+        self.waveforms = {'dht': climate, 'i2c': climate,
+                          'analog': with_noise(sine(512.0, 400.0, 60.0), 2.0, self.rng),
+                          'digital': square(0, 1, 10.0)}
+        self.waveforms.update(waveforms or {})
+
+        self.outputs = {}
+        self.pin_modes = {}
+        self.calls = {}
+        self.errors = 0
+        self.bus_lock = threading.Lock()
+        self._i2c_pending = {}
+        self.gpio_levels = {}
+        self.gpio_watchers = {}
+
+    def elapsed(self):
+        return self.clock() - self.start
+
+    def waveform(self, kind, key):
+        return self.waveforms.get((kind, key), self.waveforms.get(kind))
+
+    def transaction(self, op):
+        """Models one bus access: latency, serialisation and failures."""
+        latency = self.latencies.get(op, 0.0) * self.time_scale
+        if latency > 0 and self.jitter:
+            latency *= 1.0 + self.rng.uniform(-self.jitter, self.jitter)
+        with self.bus_lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+            if latency > 0:
+                time.sleep(latency)
+            if self.error_rate and self.rng.random() < self.error_rate:
+                self.errors += 1
+                raise IOError("simulated %s failure" % op)
+
+    def pin_mode(self, pin, mode):
+        self.transaction('pin_mode')
+        self.pin_modes[pin] = mode
+
+    def digital_read(self, pin):
+        self.transaction('digital_read')
+        return 1 if self.waveform('digital', pin)(self.elapsed()) else 0
+
+    def analog_read(self, pin):
+        self.transaction('analog_read')
+        return max(0, min(1023, int(round(self.waveform('analog', pin)(self.elapsed())))))
+
+    def digital_write(self, pin, value):
+        self.transaction('digital_write')
+        self.outputs[pin] = value
+
+    def analog_write(self, pin, value):
+        self.transaction('analog_write')
+        self.outputs[pin] = value
+
+    def dht(self, port, dht_type):
+        self.transaction('dht')
+        temperature, humidity = self.waveform('dht', port)
+        t = self.elapsed()
+        return [round(temperature(t), 1), round(humidity(t), 1)]
+
+    def i2c_write_block(self, bus_num, addr, register, data):
+        self.transaction('i2c_write')
+        self._i2c_pending[(bus_num, addr)] = (register, list(data), self.elapsed())
+
+    def i2c_read_block(self, bus_num, addr, register, length):
+        self.transaction('i2c_read')
+        command = self._i2c_pending.pop((bus_num, addr), None)
+        if addr != SHT35_ADDR or command is None:
+            return [0] * length
+
+        # SHT35 single shot measurement: T msb, lsb, crc, RH msb, lsb, crc
+        temperature, humidity = self.waveform('i2c', addr)
+        t = command[2]
+        t_raw = int(max(0.0, min(65535.0, (temperature(t) + 45.0) / 175.0 * 65535.0)))
+        h_raw = int(max(0.0, min(65535.0, humidity(t) / 100.0 * 65535.0)))
+        data = []
+        for raw in (t_raw, h_raw):
+            word = [raw >> 8, raw & 0xFF]
+            data += word + [sht35_crc(word)]
+        return data[:length]
+
+    def gpio_watch(self, pin, callback):
+        self.gpio_watchers[pin] = callback
+
+    def gpio_read(self, pin):
+        return self.gpio_levels.get(pin, 0)
+
+    def gpio_unwatch(self, pin):
+        self.gpio_watchers.pop(pin, None)
+
+    def set_gpio(self, pin, level):
+        """Drives a simulated GPIO input; watchers see the edge."""
+        if self.gpio_levels.get(pin, 0) == level:
+            return
+        self.gpio_levels[pin] = level
+        callback = self.gpio_watchers.get(pin)
+        if callback is not None:
+            callback(pin)
+
+
+_backend = None
+_simulator = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name='auto', **kwargs):
+    if name == 'pi':
+        return PiBackend()
+    if name == 'sim':
+        return SimulatorBackend(**kwargs)
+    if name == 'null':
+        return NullBackend()
+    if name == 'auto':
+        # real hardware on a Pi: the GrovePi driver or an I2C bus. smbus2
+        # alone proves nothing, it is installed from requirements.txt anywhere
+        import importlib.util
+        if importlib.util.find_spec('grovepi') is not None or os.path.exists(I2C_DEVICE):
+            return PiBackend()
+        return NullBackend()
+    raise ValueError("unknown hardware backend: %s" % name)
+
+
+def set_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    return backend
+
+
+def get_backend():
+    global _backend
+    # called on every hardware access: the lock is only taken until resolved
+    backend = _backend
+    if backend is not None:
+        return backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend('auto')
+        return _backend
+
+
+def get_simulator():
+    """The active backend if it simulates, otherwise a shared simulator."""
+    global _simulator
+    backend = get_backend()
+    if isinstance(backend, SimulatorBackend):
+        return backend
+    with _backend_lock:
+        if _simulator is None:
+            _simulator = SimulatorBackend()
+        return _simulator
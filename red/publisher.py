@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+publisher.py
+
+Outbound pipeline of a thing. Resources hand messages to publish(), which
+only appends to a deque and never blocks; a single publisher thread owns
+the MQTT client and sends them. Bursts are drained in one pass, topics with
+a rate limit keep only their latest message until their next slot, and
+QoS>0 messages are tracked until the broker acknowledges them (at most
+max_in_flight at a time, the rest wait in order).
+"""
+import collections
+import threading
+import time
+
+import log
+
+DEFAULT_BATCH_WINDOW = 0.005   # unit is seconds, lets a burst build up
+DEFAULT_MAX_BATCH = 32
+DEFAULT_MAX_IN_FLIGHT = 20
+IDLE_WAIT = 1.0                # unit is seconds
+EARLY_ACKS_KEPT = 256
+
+Message = collections.namedtuple("Message", ["topic", "payload", "qos", "retain", "queued_at"])
+
+logger = log.setup_custom_logger("mqtt_thing_publisher")
+
+
+class Publisher(threading.Thread):
+
+    def __init__(self, mqtt_client, rate_limits=None, default_rate=None,
+                 batch_window=DEFAULT_BATCH_WINDOW, max_batch=DEFAULT_MAX_BATCH,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """
+        rate_limits: {topic: max messages per second}; default_rate applies
+        to all other topics (None means unlimited).
+        """
+        threading.Thread.__init__(self, name="mqtt-publisher", daemon=True)
+        self.mqtt_client = mqtt_client
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_in_flight = max_in_flight
+        self.min_intervals = {}
+        for topic, rate in (rate_limits or {}).items():
+            self.set_rate_limit(topic, rate)
+        self.default_interval = 1.0 / default_rate if default_rate else 0.0
+
+        self.queue = collections.deque()
+        self.wakeup = threading.Event()
+        self.running = True
+
+        # only touched by the publisher thread
+        self.last_sent = {}
+        self.held = collections.OrderedDict()
+        self.waiting = collections.deque()
+
+        # shared with the network thread through on_publish
+        self.ack_lock = threading.Lock()
+        self.in_flight = {}
+        self.early_acks = collections.OrderedDict()
+
+        self.sent = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.acked = 0
+        self.ack_latency_total = 0.0
+        self.max_ack_latency = 0.0
+
+        self._on_publish = mqtt_client.on_publish
+        mqtt_client.on_publish = self.on_publish
+
+    def set_rate_limit(self, topic, rate):
+        if rate:
+            self.min_intervals[topic] = 1.0 / rate
+        else:
+            self.min_intervals.pop(topic, None)
+
+    # --- producer side, called from resource threads ---
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.queue.append(Message(topic, payload, qos, retain, time.monotonic()))
+        if not self.wakeup.is_set():
+            self.wakeup.set()
+
+    # --- publisher thread ---
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait(self.next_wakeup())
+            self.wakeup.clear()
+            if self.queue and self.batch_window:
+                time.sleep(self.batch_window)
+            self.drain()
+            self.release()
+
+        # flush whatever is left, ignoring rate limits
+        self.drain(limited=False)
+        for topic in list(self.held):
+            self.send(self.held.pop(topic))
+
+    def drain(self, limited=True):
+        count = 0
+        while self.queue and (count < self.max_batch or not limited):
+            message = self.queue.popleft()
+            count += 1
+            if not limited:
+                self.send(message)
+            elif message.topic in self.held:
+                # latest wins while the topic waits for its rate slot
+                self.held[message.topic] = message
+                self.coalesced += 1
+            elif self.slot_in(message.topic, time.monotonic()) > 0.0:
+                self.held[message.topic] = message
+            elif message.qos > 0 and (self.waiting or not self.has_ack_room()):
+                self.waiting.append(message)
+            else:
+                self.send(message)
+
+        if count:
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, count)
+
+    def release(self):
+        now = time.monotonic()
+        for topic in list(self.held):
+            if self.slot_in(topic, now) <= 0.0:
+                message = self.held.pop(topic)
+                if message.qos > 0 and not self.has_ack_room():
+                    self.waiting.append(message)
+                else:
+                    self.send(message)
+
+        while self.waiting and self.has_ack_room():
+            self.send(self.waiting.popleft())
+
+    def slot_in(self, topic, now):
+        interval = self.min_intervals.get(topic, self.default_interval)
+        if not interval or topic not in self.last_sent:
+            return 0.0
+        return self.last_sent[topic] + interval - now
+
+    def next_wakeup(self):
+        if self.queue:
+            return 0.0
+        if not self.held:
+            return IDLE_WAIT
+        now = time.monotonic()
+        return max(0.0, min(self.slot_in(topic, now) for topic in self.held))
+
+    def has_ack_room(self):
+        return len(self.in_flight) < self.max_in_flight
+
+    def send(self, message):
+        now = time.monotonic()
+        self.last_sent[message.topic] = now
+        try:
+            info = self.mqtt_client.publish(message.topic, message.payload,
+                                            message.qos, message.retain)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("publish to %s failed: %s", message.topic, e)
+            return
+
+        if info.rc != 0 and message.qos == 0:
+            # QoS 0 messages are dropped by paho while disconnected
+            self.errors += 1
+            logger.debug("publish to %s returned rc=%s", message.topic, info.rc)
+            return
+
+        self.sent += 1
+        if message.qos > 0:
+            # paho keeps QoS>0 messages and sends them after a reconnect
+            with self.ack_lock:
+                acked_at = self.early_acks.pop(info.mid, None)
+                if acked_at is None:
+                    self.in_flight[info.mid] = now
+                else:
+                    self.record_ack(acked_at - now)
+
+    # --- network thread ---
+
+    def on_publish(self, client, userdata, mid):
+        if self._on_publish is not None:
+            self._on_publish(client, userdata, mid)
+
+        now = time.monotonic()
+        with self.ack_lock:
+            sent_at = self.in_flight.pop(mid, None)
+            if sent_at is not None:
+                self.record_ack(now - sent_at)
+            else:
+                # acknowledged before send() recorded it (or a QoS 0 message)
+                self.early_acks[mid] = now
+                if len(self.early_acks) > EARLY_ACKS_KEPT:
+                    self.early_acks.popitem(last=False)
+
+        if self.waiting:
+            self.wakeup.set()
+
+    def record_ack(self, latency):
+        latency = max(0.0, latency)
+        self.acked += 1
+        self.ack_latency_total += latency
+        self.max_ack_latency = max(self.max_ack_latency, latency)
+
+    def stop(self, timeout=2.0):
+        self.running = False
+        self.wakeup.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self):
+        with self.ack_lock:
+            in_flight = len(self.in_flight)
+            avg_ack = self.ack_latency_total / self.acked if self.acked else 0.0
+        return {'queued': len(self.queue),
+                'held': len(self.held),
+                'waiting_for_ack_room': len(self.waiting),
+                'in_flight': in_flight,
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'batches': self.batches,
+                'largest_batch': self.largest_batch,
+                'acked': self.acked,
+                'avg_ack_latency': avg_ack,
+                'max_ack_latency': self.max_ack_latency}
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+thing_config.py
+
+Builds the resources of a thing from a JSON config file instead of
+hardcoding them per role. Driver modules are imported lazily, only when a
+resource of their type is declared.
+
+Example:
+
+    {
+      "thing": "purple",
+      "backend": "auto",
+      "resources": {
+        "sht_purple": {"type": "sht35",
+                       "pub_topic": "sensors/zone/purple/temperature",
+                       "polling_interval": 10.0,
+                       "adaptive": {"min_interval": 2.0, "max_interval": 60.0},
+                       "options": {"use_dht": true, "dht_port": 3, "dht_type": 1}},
+        "led_red":    {"type": "led", "connector": 5,
+                       "sub_topic": "actuators/zone/purple/led"}
+      }
+    }
+
+Sensor types take connector, pub_topic, polling_interval and an optional
+"phase" (seconds after the aligned polling boundary; by default the sensors
+of a thing are spread scheduler.DEFAULT_PHASE_STEP apart); actuator types
+take connector, sub_topic and nuances_resolution. Anything under "options"
+is passed to the driver constructor as keyword arguments. An optional
+top-level "publisher" object configures the outbound publisher, e.g.
+{"rate_limits": {"sensors/zone/purple/temperature": 1.0}}, and an optional
+"telemetry" object sets how often resource telemetry is published, e.g.
+{"interval": 60}.
+"""
+import importlib
+import json
+import os
+from collections import namedtuple
+
+import log
+import mqttconfig
+
+logger = log.setup_custom_logger("mqtt_thing_config")
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+
+ResourceType = namedtuple("ResourceType", ["module", "cls", "kind"])
+
+# type name -> driver module/class, imported on first use
+RESOURCE_TYPES = {
+    'sht35': ResourceType('SHT35Resource', 'SHT35Resource', 'sensor'),
+    'button': ResourceType('ButtonResource', 'ButtonResource', 'sensor'),
+    'rotary_angle': ResourceType('RotaryAngleResource', 'RotaryAngleResource', 'sensor'),
+    'led': ResourceType('LedResource', 'LedResource', 'actuator'),
+    'time': ResourceType('TimeResource', 'TimeResource', 'time'),
+}
+
+_drivers = {}
+
+
+class ConfigError(Exception):
+    pass
+
+
+def config_path_for_role(role):
+    return os.path.join(CONFIG_DIR, role + ".json")
+
+
+def load_config(path):
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError("cannot read thing config %s: %s" % (path, e))
+
+    resources = config.get("resources")
+    if not isinstance(resources, dict) or not resources:
+        raise ConfigError("%s declares no resources" % path)
+
+    for name, spec in resources.items():
+        if spec.get("type") not in RESOURCE_TYPES:
+            raise ConfigError("resource %s has unknown type %r" % (name, spec.get("type")))
+        kind = RESOURCE_TYPES[spec["type"]].kind
+        if kind in ('sensor', 'time') and not spec.get("pub_topic"):
+            raise ConfigError("resource %s needs a pub_topic" % name)
+        if kind == 'actuator' and not spec.get("sub_topic"):
+            raise ConfigError("resource %s needs a sub_topic" % name)
+
+    return config
+
+
+def load_driver(type_name):
+    driver = _drivers.get(type_name)
+    if driver is None:
+        rtype = RESOURCE_TYPES[type_name]
+        driver = getattr(importlib.import_module(rtype.module), rtype.cls)
+        _drivers[type_name] = driver
+    return driver
+
+
+def polling_policy(spec, adaptive_default=None):
+    adaptive = spec.get("adaptive", adaptive_default)
+    if not adaptive:
+        return None
+
+    from Sensor import AdaptivePollingPolicy
+    return AdaptivePollingPolicy(**adaptive)
+
+
+def build_resource(name, spec, lock, mqtt_client, simulate=False, adaptive_default=None):
+    rtype = RESOURCE_TYPES[spec["type"]]
+    driver = load_driver(spec["type"])
+
+    if rtype.kind == 'sensor':
+        kwargs = dict(connector=spec.get("connector", 0),
+                      lock=lock,
+                      mqtt_client=mqtt_client,
+                      running=True,
+                      pub_topic=spec["pub_topic"],
+                      polling_interval=float(spec.get("polling_interval", 1.0)))
+        policy = polling_policy(spec, adaptive_default)
+        if policy is not None:
+            kwargs["polling_policy"] = policy
+        if spec["type"] == 'sht35':
+            kwargs["simulate"] = simulate
+        else:
+            kwargs["sampling_resolution"] = spec.get("sampling_resolution", 2)
+    elif rtype.kind == 'actuator':
+        kwargs = dict(connector=spec["connector"],
+                      mqtt_client=mqtt_client,
+                      sub_topic=spec["sub_topic"],
+                      nuances_resolution=spec.get("nuances_resolution", 2))
+    else:
+        kwargs = dict(lock=lock,
+                      mqtt_client=mqtt_client,
+                      running=True,
+                      pub_topic=spec["pub_topic"],
+                      pub_interval=float(spec.get("polling_interval", 2.0)))
+
+    kwargs.update(spec.get("options", {}))
+    logger.debug("creating %s resource %s", spec["type"], name)
+    return driver(**kwargs)
+
+
+def build_resources(config, lock, mqtt_client, simulate=False, adaptive_default=None,
+                    publisher=None):
+    from scheduler import DEFAULT_PHASE_STEP
+    resources = {}
+    scheduled = 0
+    for name, spec in config["resources"].items():
+        resources[name] = build_resource(name, spec, lock, mqtt_client,
+                                         simulate=simulate,
+                                         adaptive_default=adaptive_default)
+        # same-interval sensors of a thing do not hit the bus at the same instant
+        schedule = getattr(resources[name], 'schedule', None)
+        if schedule is not None:
+            schedule.phase = float(spec.get("phase", scheduled * DEFAULT_PHASE_STEP))
+            scheduled += 1
+        # publishing resources hand their messages to the outbound publisher
+        if publisher is not None and hasattr(resources[name], 'publisher'):
+            resources[name].publisher = publisher
+    return resources
+
+
+def create_publisher(config, mqtt_client):
+    # optional "publisher" section: rate_limits {topic: msgs/s}, default_rate,
+    # batch_window, max_batch, max_in_flight
+    from publisher import Publisher
+    options = config.get("publisher", {})
+    if not isinstance(options, dict):
+        raise ConfigError("publisher section must be an object")
+    return Publisher(mqtt_client, **options)
+
+
+def create_telemetry(config, thing_name, resources, publisher, interval=None):
+    # optional "telemetry" section: interval (s) between summaries, 0 disables
+    import telemetry
+    options = config.get("telemetry", {})
+    if not isinstance(options, dict):
+        raise ConfigError("telemetry section must be an object")
+    if interval is None:
+        interval = float(options.get("interval", telemetry.DEFAULT_INTERVAL))
+    if interval <= 0:
+        return None
+    return telemetry.TelemetryReporter(thing_name, resources,
+                                       lambda topic, payload: publisher.publish(
+                                           topic, payload, mqttconfig.QUALITY_OF_SERVICE),
+                                       interval)
+
+
+def subscribe_actuators(mqtt_client, resources, qos=0):
+    # the callback goes in first so a retained message is not missed;
+    # subscriptions are re-issued by the connection manager on reconnect
+    for res in resources.values():
+        if getattr(res, 'sub_topic', None) and hasattr(res, 'on_mqtt_message'):
+            mqttconfig.subscribe(mqtt_client, res.sub_topic, qos, res.on_mqtt_message)
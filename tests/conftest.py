@@ -0,0 +1,76 @@
+"""
+Shared setup of the unit tests.
+
+black/, red/ and purple/ are script directories whose modules share names,
+so one test process can only import from one of them. The in-process tests
+use black/ (its shared modules are copies of the things' ones); code that
+only exists in the thing directories is run in a subprocess with the thing
+directory as working directory, see run_in_thing_dir().
+FakeClient and FakeMessage stand in for paho when a test drives the
+server or the lease by calling their callbacks.
+"""
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THING_DIRS = ("red", "purple")
+
+sys.path.insert(0, os.path.join(ROOT, "black"))
+
+import log  # noqa: E402
+
+log.configure(level=logging.WARNING)
+
+
+def run_in_thing_dir(name, script):
+    """Runs script with the thing directory name as cwd; returns the completed process."""
+    return subprocess.run([sys.executable, "-c", script], cwd=os.path.join(ROOT, name),
+                          capture_output=True, text=True, timeout=60)
+
+
+class FakeClient(object):
+    """Stands in for paho's Client; records what is published and the will."""
+
+    def __init__(self):
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+        self.published = []     # (topic, payload, qos, retain)
+        self.will = None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload, qos, retain))
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        self.will = (topic, payload, qos, retain)
+
+    def subscribe(self, topic, qos=0):
+        return 0, 0
+
+    def unsubscribe(self, topic):
+        return 0, 0
+
+    def message_callback_add(self, topic, callback):
+        pass
+
+    def message_callback_remove(self, topic):
+        pass
+
+
+class FakeMessage(object):
+
+    def __init__(self, topic, payload, retain=False):
+        self.topic = topic
+        self.payload = payload if isinstance(payload, bytes) else payload.encode("utf-8")
+        self.qos = 0
+        self.retain = retain
+
+
+@pytest.fixture
+def fake_client():
+    return FakeClient()
@@ -0,0 +1,173 @@
+"""cluster.Lease: claims, renewals, expiry and releases over a fake retained topic."""
+import json
+
+import pytest
+
+import cluster
+from conftest import FakeClient, FakeMessage
+
+TTL = 6.0
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Bus(object):
+    """Lease topic of a broker: delivers every publish to all members, in order."""
+
+    def __init__(self):
+        self.members = []
+        self.published = []     # (payload, retain)
+
+    def publish(self, topic, payload, qos, retain):
+        self.published.append((json.loads(payload), retain))
+        for lease in self.members:
+            lease.on_message(None, None, FakeMessage(topic, payload, retain))
+
+
+class Events(object):
+
+    def __init__(self):
+        self.acquired = 0
+        self.lost = 0
+
+    def on_acquired(self):
+        self.acquired += 1
+
+    def on_lost(self):
+        self.lost += 1
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def bus():
+    return Bus()
+
+
+def member(bus, clock, owner, events=None):
+    events = events or Events()
+    lease = cluster.Lease("group/actuators", owner, bus.publish, TTL, on_acquired=events.on_acquired,
+                          on_lost=events.on_lost, clock=clock)
+    bus.members.append(lease)
+    lease.connected()
+    return lease, events
+
+
+def test_no_claim_before_the_retained_lease_can_arrive(bus, clock):
+    lease, _events = member(bus, clock, "A")
+    lease.tick()
+    assert bus.published == []
+    lease.disconnected()
+    clock.now += TTL
+    lease.tick()
+    assert bus.published == []
+
+
+def test_claim_and_renew(bus, clock):
+    lease, events = member(bus, clock, "A")
+    clock.now += lease.renew_interval
+    lease.tick()
+    assert lease.is_held()
+    assert events.acquired == 1
+    payload, retain = bus.published[-1]
+    assert (payload["holder"], payload["ttl"], retain) == ("A", TTL, True)
+
+    for _ in range(5):
+        clock.now += lease.renew_interval
+        lease.tick()
+    assert lease.is_held()
+    assert events.acquired == 1 and events.lost == 0
+    assert len(bus.published) == 6
+
+
+def test_other_members_follow_the_holder(bus, clock):
+    a, _ = member(bus, clock, "A")
+    b, b_events = member(bus, clock, "B")
+    clock.now += a.renew_interval
+    a.tick()
+    b.tick()                  # the lease is held and fresh: no claim
+    assert a.is_held() and not b.is_held()
+    assert [payload["holder"] for payload, _retain in bus.published] == ["A"]
+    assert b_events.acquired == 0
+
+
+def test_unconfirmed_renewals_expire(bus, clock):
+    lease, events = member(bus, clock, "A")
+    clock.now += lease.renew_interval
+    lease.tick()
+    bus.members.remove(lease)           # the broker stops answering
+    clock.now += TTL
+    assert not lease.is_held()
+    lease.tick()
+    assert events.lost == 1
+    assert lease.holder is None
+
+
+def test_takeover_after_the_ttl(bus, clock):
+    a, a_events = member(bus, clock, "A")
+    b, b_events = member(bus, clock, "B")
+    clock.now += a.renew_interval
+    a.tick()
+    a.stop_event.set()                  # the holder hangs without releasing
+    clock.now += TTL - 0.1
+    b.tick()
+    assert not b.is_held()
+    clock.now += 0.1
+    b.tick()
+    assert b.is_held() and not a.is_held()
+    assert b_events.acquired == 1 and a_events.lost == 1
+
+
+def test_release_hands_over_at_once(bus, clock):
+    a, _ = member(bus, clock, "A")
+    b, b_events = member(bus, clock, "B")
+    clock.now += a.renew_interval
+    a.tick()
+    a.release()
+    assert ({"holder": "A", "released": True}, True) in bus.published
+    assert b.is_held()
+    assert b_events.acquired == 1
+
+
+def test_release_of_a_non_holder_is_ignored(bus, clock):
+    a, a_events = member(bus, clock, "A")
+    b, _ = member(bus, clock, "B")
+    clock.now += a.renew_interval
+    a.tick()
+    # the will of B, published by the broker when B's connection drops
+    bus.publish(a.topic, b.release_payload(), cluster.LEASE_QOS, False)
+    assert a.is_held() and a_events.lost == 0
+    assert [payload.get("holder") for payload, _retain in bus.published] == ["A", "B"]
+
+
+def test_release_without_holding_publishes_nothing(bus, clock):
+    a, _ = member(bus, clock, "A")
+    a.release()
+    assert bus.published == []
+    assert a.stop_event.is_set()
+
+
+def test_will_is_not_retained():
+    client = FakeClient()
+    lease = cluster.Lease("group/actuators", "A", client.publish)
+    lease.set_will(client)
+    topic, payload, qos, retain = client.will
+    assert topic == "leases/group/actuators"
+    assert json.loads(payload) == {"holder": "A", "released": True}
+    assert (qos, retain) == (cluster.LEASE_QOS, False)
+
+
+def test_invalid_lease_message_is_ignored(bus, clock):
+    lease, _ = member(bus, clock, "A")
+    lease.on_message(None, None, FakeMessage(lease.topic, b"{not json"))
+    assert lease.holder is None
@@ -0,0 +1,205 @@
+"""
+PriorityTxQueue: priorities, coalescing of writes and the per-member bound;
+future-based reads and entries whose caller timed out.
+"""
+from concurrent.futures import Future
+
+import pytest
+
+import hal
+from grove_pi_interface import PriorityTxQueue, InteractorMember, GrovePiInteractor, BulkRead, \
+                               InteractorQueueFull, grovepi_tx_queue, ANALOG_READ, DROP_NEWEST, PRIORITY_LOW
+
+
+def member(connector, direction="INPUT", **kwargs):
+    return InteractorMember(connector, direction, None, **kwargs)
+
+
+def drain(queue):
+    entries = []
+    while not queue.empty():
+        entries.append(queue.get())
+    return entries
+
+
+def test_reads_are_served_before_writes():
+    queue = PriorityTxQueue()
+    led, sensor = member(4, "OUTPUT"), member(3)
+    queue.put((led, 1))
+    queue.put((sensor,))
+    assert [entry[0] for entry in drain(queue)] == [sensor, led]
+
+
+def test_members_of_equal_priority_take_turns():
+    queue = PriorityTxQueue()
+    a, b = member(1), member(2)
+    for entry in [(a, "a1"), (a, "a2"), (b, "b1"), (b, "b2")]:
+        queue.put(entry)
+    assert [entry[1] for entry in drain(queue)] == ["a1", "b1", "a2", "b2"]
+
+
+def test_explicit_priority_wins_over_direction():
+    queue = PriorityTxQueue()
+    background, led = member(1, priority=PRIORITY_LOW), member(4, "OUTPUT")
+    queue.put((background,))
+    queue.put((led, 1))
+    assert [entry[0] for entry in drain(queue)] == [led, background]
+
+
+def test_pending_writes_coalesce_to_the_latest_value():
+    queue = PriorityTxQueue()
+    led = member(4, "OUTPUT")
+    for value in (1, 0, 1, 0):
+        queue.put((led, value))
+    assert queue.qsize() == 1
+    assert drain(queue) == [(led, 0)]
+    assert queue.stats()["coalesced"] == 3
+
+
+def test_full_queue_drops_the_oldest_entry():
+    queue = PriorityTxQueue()
+    sensor = member(3, max_queue_len=2)
+    for value in range(4):
+        queue.put((sensor, value))
+    assert [entry[1] for entry in drain(queue)] == [2, 3]
+    assert sensor.dropped == 2 and queue.stats()["dropped"] == 2
+
+
+def test_full_queue_rejects_the_newest_entry_with_drop_newest():
+    queue = PriorityTxQueue()
+    sensor = member(3, max_queue_len=2, drop_policy=DROP_NEWEST)
+    for value in range(4):
+        queue.put((sensor, value))
+    assert [entry[1] for entry in drain(queue)] == [0, 1]
+
+
+@pytest.mark.parametrize("max_queue_len", [1, 3])
+def test_depth_matches_the_queued_entries(max_queue_len):
+    queue = PriorityTxQueue()
+    members = [member(connector, max_queue_len=max_queue_len) for connector in range(3)]
+    for round_ in range(5):
+        for m in members:
+            queue.put((m, round_))
+    assert queue.qsize() == 3 * max_queue_len
+    assert len(drain(queue)) == 3 * max_queue_len
+    assert queue.qsize() == 0 and queue.stats()["depth_per_connector"] == {}
+
+
+def test_stop_wakes_up_get():
+    queue = PriorityTxQueue()
+    queue.put(None)
+    assert queue.get() is None
+
+
+# --- future-based reads (submit/read/read_bulk) ---
+
+@pytest.fixture
+def simulator():
+    previous = hal.get_backend()
+    backend = hal.set_backend(hal.SimulatorBackend(time_scale=0.0, seed=1,
+                                                   waveforms={('analog', 1): hal.constant(100),
+                                                              ('analog', 2): hal.constant(200)}))
+    yield backend
+    hal.set_backend(previous)
+    while not grovepi_tx_queue.empty():
+        grovepi_tx_queue.get()
+
+
+def serve_all():
+    # what the interactor thread does, without the thread
+    while not grovepi_tx_queue.empty():
+        GrovePiInteractor.work_queue_entry(grovepi_tx_queue.get())
+
+
+def test_submit_resolves_the_future(simulator):
+    sensor = InteractorMember(1, "INPUT", ANALOG_READ)
+    future = GrovePiInteractor.submit(sensor)
+    assert not future.done()
+    serve_all()
+    assert future.result(0) == 100
+
+
+def test_bulk_read_samples_every_member_in_one_entry(simulator):
+    members = [InteractorMember(1, "INPUT", ANALOG_READ), InteractorMember(2, "INPUT", ANALOG_READ)]
+    future = GrovePiInteractor.submit(BulkRead(members))
+    assert grovepi_tx_queue.qsize() == 1
+    serve_all()
+    assert future.result(0) == [100, 200]
+
+
+def test_failed_pin_of_a_bulk_read_is_none(simulator):
+    def broken(pin):
+        raise IOError("no ack")
+    members = [InteractorMember(1, "INPUT", ANALOG_READ), InteractorMember(2, "INPUT", broken)]
+    future = GrovePiInteractor.submit(BulkRead(members))
+    serve_all()
+    assert future.result(0) == [100, None]
+
+
+def test_cancelled_entry_is_skipped_by_the_interactor(simulator):
+    calls = []
+    sensor = InteractorMember(1, "INPUT", lambda pin: calls.append(pin))
+    future = GrovePiInteractor.submit(sensor)
+    future.cancel()
+    serve_all()
+    assert calls == []
+
+
+def test_read_times_out_and_cancels(simulator):
+    sensor = InteractorMember(1, "INPUT", ANALOG_READ)
+    with pytest.raises(Exception):
+        GrovePiInteractor.read(sensor, timeout=0.01)
+    entry = grovepi_tx_queue.get()
+    assert entry[2].cancelled()
+
+
+def test_rejected_read_gets_queue_full():
+    queue = PriorityTxQueue()
+    sensor = member(1, max_queue_len=1)
+    first, second = Future(), Future()
+    queue.put((sensor, None, first))
+    queue.put((sensor, None, second))
+    with pytest.raises(InteractorQueueFull):
+        first.result(0)
+    assert queue.get()[2] is second
+
+
+# regression: coalescing over a cancelled (timed out) entry raised
+# InvalidStateError under the queue lock
+def test_coalescing_over_a_cancelled_entry():
+    queue = PriorityTxQueue()
+    led = member(4, "OUTPUT")
+    stale, latest = Future(), Future()
+    queue.put((led, 1, stale))
+    stale.cancel()
+    queue.put((led, 0, latest))
+    assert queue.qsize() == 1
+    assert queue.get() == (led, 0, latest)
+
+
+# regression: dropping a cancelled entry raised InvalidStateError after the
+# depth had been decremented
+def test_dropping_a_cancelled_entry_keeps_the_depth():
+    queue = PriorityTxQueue()
+    sensor = member(1, max_queue_len=2, drop_policy=DROP_NEWEST)
+    futures = [Future() for _ in range(3)]
+    queue.put((sensor, None, futures[0]))
+    queue.put((sensor, None, futures[1]))
+    futures[2].cancel()
+    queue.put((sensor, None, futures[2]))
+    assert queue.qsize() == 2
+    assert len(drain(queue)) == 2
+
+
+def test_cancelled_entries_do_not_count_against_the_bound():
+    queue = PriorityTxQueue()
+    sensor = member(1, max_queue_len=2)
+    timed_out = [Future(), Future()]
+    for future in timed_out:
+        queue.put((sensor, None, future))
+        future.cancel()
+    waiting = Future()
+    queue.put((sensor, None, waiting))
+    assert sensor.dropped == 0
+    assert queue.qsize() == 1
+    assert queue.get()[2] is waiting
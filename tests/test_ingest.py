@@ -0,0 +1,40 @@
+"""ingest: recent keys in front of the database and event-time watermarks."""
+import pytest
+
+import ingest
+
+
+def test_recent_keys_drop_repeats():
+    keys = ingest.RecentKeys(4)
+    assert keys.add(("z1", "temperature", 1000))
+    assert not keys.add(("z1", "temperature", 1000))
+    assert keys.add(("z1", "humidity", 1000))
+    assert len(keys) == 2
+
+
+def test_recent_keys_evict_least_recently_added():
+    keys = ingest.RecentKeys(2)
+    keys.add("a")
+    keys.add("b")
+    keys.add("a")          # a repeat refreshes the key
+    keys.add("c")          # evicts b
+    assert "a" in keys and "c" in keys and "b" not in keys
+    assert len(keys) == 2
+    assert keys.add("b")
+
+
+def test_recent_keys_capacity():
+    with pytest.raises(ValueError):
+        ingest.RecentKeys(0)
+
+
+def test_watermarks_advance_with_event_time():
+    marks = ingest.Watermarks()
+    assert marks.get("z1", "temperature") is None
+    assert marks.advance("z1", "temperature", 2000)
+    assert marks.advance("z1", "temperature", 2000)       # same time is still live
+    assert not marks.advance("z1", "temperature", 1000)
+    assert marks.get("z1", "temperature") == 2000
+    assert marks.advance("z1", "humidity", 1000)          # per zone and metric
+    assert marks.advance("z1", "temperature", 3000)
+    assert marks.get("z1", "temperature") == 3000
@@ -0,0 +1,121 @@
+"""BrokerServer with a fake MQTT client, messages delivered by calling its callbacks."""
+import json
+
+import pytest
+
+import server
+import storage
+import tsblocks
+from conftest import FakeMessage
+
+HOUR_MS = 3600 * 1000
+T0 = 1700000000000 - 1700000000000 % HOUR_MS
+
+
+def iso(millis):
+    return tsblocks.millis_to_iso(millis)
+
+
+def make_server(client, **kwargs):
+    kwargs.setdefault("snapshot_path", None)
+    kwargs.setdefault("archive_window", 0)
+    kwargs.setdefault("db", storage.MemoryStorage())
+    return server.BrokerServer("localhost", client=client, **kwargs)
+
+
+def reading(srv, zone="red", timestamp=None, **values):
+    payload = dict(values, zone=zone, timestamp=timestamp)
+    metric = "temperature" if "temperature" in values else "humidity"
+    srv.on_message(srv.client, None, FakeMessage("sensors/zone/%s/%s" % (zone, metric), json.dumps(payload)))
+
+
+def test_redelivery_dropped_before_the_database(fake_client):
+    srv = make_server(fake_client)
+    reading(srv, temperature=21.0, timestamp=iso(T0))
+    reading(srv, temperature=21.0, timestamp=iso(T0))
+    assert srv.ingest_stats()["stored"] == 1
+    assert srv.ingest_stats()["duplicates"] == 1
+
+
+def test_timestamp_forms_are_one_key(fake_client):
+    srv = make_server(fake_client)
+    reading(srv, temperature=21.0, timestamp="2024-05-01T10:00:00Z")
+    reading(srv, temperature=21.0, timestamp="2024-05-01T10:00:00.000+00:00")
+    assert srv.ingest_stats()["duplicates"] == 1
+    assert srv.ingest_stats()["duplicates_db"] == 0
+
+
+def test_invalid_timestamps_do_not_take_recent_keys(fake_client):
+    srv = make_server(fake_client, recent_keys=2)
+    reading(srv, temperature=21.0, timestamp=iso(T0))
+    for bad in ("yesterday", "2024-13-01T00:00:00Z", "soon"):
+        reading(srv, temperature=21.0, timestamp=bad)
+    reading(srv, temperature=21.0, timestamp=iso(T0))
+    stats = srv.ingest_stats()
+    assert stats["received"] == 2
+    assert stats["duplicates"] == 1
+    assert stats["duplicates_db"] == 0
+    assert stats["recent_keys"] == 1
+
+
+def test_archived_redelivery_is_a_database_duplicate(fake_client, tmp_path):
+    db = storage.EnvironmentDB(str(tmp_path / "readings.db"))
+    srv = make_server(fake_client, recent_keys=1, db=db)
+    reading(srv, temperature=21.0, timestamp=iso(T0 + 1000))
+    reading(srv, temperature=22.0, timestamp=iso(T0 + HOUR_MS + 1000))   # pushes out the first key
+    db.archive(now_ms=T0 + HOUR_MS)
+
+    reading(srv, temperature=21.0, timestamp=iso(T0 + 1000))
+    stats = srv.ingest_stats()
+    assert stats["stored"] == 2
+    assert stats["duplicates_db"] == 1
+    assert stats["late"] == 0
+    db.close()
+
+
+def test_late_reading_goes_to_history_and_statistics_only(fake_client):
+    srv = make_server(fake_client)
+    reading(srv, temperature=21.0, timestamp=iso(T0 + 10000))
+    reading(srv, temperature=25.0, timestamp=iso(T0 + 20000))
+    reading(srv, temperature=10.0, timestamp=iso(T0 + 15000))       # late
+
+    assert srv.ingest_stats()["late"] == 1
+    assert srv.zones["red"]["temperature"] == 25.0
+    assert srv.zones["red"]["timestamp"] == iso(T0 + 20000)
+    stats = srv.zone_stats("red")["red"]["temperature"]
+    assert stats["count"] == 3
+    assert stats["min"] == 10.0
+    assert stats["last"] == 25.0
+    # event time: 4 degrees over the 10 s between the oldest and newest reading
+    assert stats["rate_of_change"] == pytest.approx(0.4)
+    assert [bucket[1] for bucket in srv.zone_aggregates("red", "temperature")] == [3]
+
+
+def test_group_snapshot_needs_a_stable_instance_id(fake_client, tmp_path):
+    with pytest.raises(ValueError):
+        make_server(fake_client, share_group="g", snapshot_path=str(tmp_path / "state.json"))
+
+
+def test_group_members_write_their_own_snapshot(fake_client, tmp_path):
+    srv = make_server(fake_client, share_group="g", instance_id="A", snapshot_path=str(tmp_path / "state.json"))
+    assert srv.snapshot_path == str(tmp_path / "state.A.json")
+    assert fake_client.will == ("leases/g/actuators", json.dumps({"holder": "A", "released": True}), 1, False)
+    srv.snapshot_writer.stop()
+
+
+def test_only_the_lease_holder_writes_the_snapshot(fake_client, tmp_path):
+    srv = make_server(fake_client, share_group="g", instance_id="A", snapshot_path=str(tmp_path / "state.json"))
+    reading(srv, temperature=18.0, timestamp=iso(T0))
+    srv.save_snapshot()
+    assert not any(topic == server.LED_TEMP_TOPIC for topic, _payload, _qos, _retain in fake_client.published)
+
+    srv.lease.update("A")
+    srv.save_snapshot()
+    srv.snapshot_writer.stop()
+    assert srv.snapshot_writer.written == 1
+    with open(srv.snapshot_path) as f:
+        snapshot = json.load(f)
+    assert snapshot["led"]["temperature"] == "ON"
+    assert snapshot["zones"]["red"]["temperature"] == 18.0
+    # on acquiring the lease the holder publishes the commands it did not send
+    assert (server.LED_TEMP_TOPIC, "ON", 0, True) in fake_client.published
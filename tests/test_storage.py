@@ -0,0 +1,129 @@
+"""Storage engines: one reading per (zone, metric, measurement time), archived or not."""
+import sqlite3
+
+import pytest
+
+import storage
+import tsblocks
+
+HOUR_MS = 3600 * 1000
+T0 = 1700000000000 - 1700000000000 % HOUR_MS
+
+# one instant, written the ways a thing or a broker replay may write it
+FORMS = ["2024-05-01T10:00:00Z", "2024-05-01T10:00:00+00:00", "2024-05-01T10:00:00.000Z",
+         "2024-05-01T12:00:00+02:00"]
+
+
+def iso(millis):
+    return tsblocks.millis_to_iso(millis)
+
+
+@pytest.fixture(params=storage.ENGINES)
+def db(request, tmp_path):
+    name = request.param
+    if name == 'sqlite':
+        db = storage.EnvironmentDB(str(tmp_path / "readings.db"))
+    elif name == 'log':
+        db = storage.LogStorage(str(tmp_path / "readings.log"))
+    else:
+        db = storage.MemoryStorage()
+    yield db
+    db.close()
+
+
+def test_insert_reports_new_metrics(db):
+    assert db.insert("z1", 21.0, 50.0, iso(T0)) == ["temperature", "humidity"]
+    assert db.insert("z1", 21.0, 50.0, iso(T0)) == []
+    assert db.insert("z1", None, 50.0, iso(T0 + 1000)) == ["humidity"]
+
+
+def test_timestamp_forms_are_one_reading(db):
+    assert db.insert("z1", 21.0, None, FORMS[0]) == ["temperature"]
+    for form in FORMS[1:]:
+        assert db.insert("z1", 21.0, None, form) == []
+    assert db.range("z1", "temperature", FORMS[0], "2024-05-01T11:00:00Z") == \
+        [("2024-05-01T10:00:00.000Z", 21.0)]
+
+
+def test_latest_per_zone_by_measurement_time(db):
+    # "...:01Z" sorts before "...:01.500Z" as text although it is later
+    db.insert("z1", 20.0, None, "2024-05-01T10:00:01.500Z")
+    db.insert("z1", 21.0, None, "2024-05-01T10:00:02Z")
+    db.insert("z1", 19.0, None, "2024-05-01T10:00:01Z")         # late
+    db.insert("z1", None, 55.0, "2024-05-01T10:00:00Z")
+    db.insert("z2", None, 40.0, "2024-05-01T09:00:00Z")
+    db.insert("z3", 18.0, 60.0, "2024-05-01T08:00:00Z")
+
+    assert db.latest_per_zone() == {
+        "z1": {"temperature": 21.0, "humidity": 55.0, "timestamp": "2024-05-01T10:00:02.000Z"},
+        "z2": {"temperature": None, "humidity": 40.0, "timestamp": "2024-05-01T09:00:00.000Z"},
+        "z3": {"temperature": 18.0, "humidity": 60.0, "timestamp": "2024-05-01T08:00:00.000Z"},
+    }
+    assert db.last_temperature("z1") == 21.0
+    assert db.last_humidity("z2") == 40.0
+
+
+def test_sqlite_latest_per_zone_seeks_the_index(tmp_path):
+    db = storage.EnvironmentDB(str(tmp_path / "readings.db"))
+    with db.reader() as conn:
+        plan = " ".join(row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT zone, metric FROM readings WHERE (zone, metric, timestamp) > (?, ?, ?) "
+            "AND metric IS NOT NULL ORDER BY zone, metric, timestamp LIMIT 1", ("z1", "temperature", iso(T0))))
+    db.close()
+    assert "readings_key" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_archived_redelivery_is_not_stored_again(tmp_path):
+    db = storage.EnvironmentDB(str(tmp_path / "readings.db"))
+    db.insert("z1", 21.0, 50.0, iso(T0 + 1000))
+    db.insert("z1", 22.0, None, iso(T0 + HOUR_MS + 1000))
+    assert db.archive(now_ms=T0 + HOUR_MS) == 2
+
+    # the raw rows are gone, the blocks still know the reading
+    assert db.insert("z1", 21.0, 50.0, iso(T0 + 1000)) == []
+    assert db.insert("z1", 21.0, 50.0, iso(T0 + 1000)[:-1] + "+00:00") == []
+    # a late reading of the archived window is new
+    assert db.insert("z1", 20.5, None, iso(T0 + 2000)) == ["temperature"]
+    assert db.archive(now_ms=T0 + HOUR_MS) == 1
+    assert db.range("z1", "temperature", iso(T0), iso(T0 + 2 * HOUR_MS)) == \
+        [(iso(T0 + 1000), 21.0), (iso(T0 + 2000), 20.5), (iso(T0 + HOUR_MS + 1000), 22.0)]
+    db.close()
+
+
+def test_archived_until_survives_reopen(tmp_path):
+    path = str(tmp_path / "readings.db")
+    db = storage.EnvironmentDB(path)
+    db.insert("z1", 21.0, None, iso(T0 + 1000))
+    db.archive(now_ms=T0 + HOUR_MS)
+    db.close()
+
+    db = storage.EnvironmentDB(path)
+    assert db.archived_until == T0 + 1000
+    assert db.insert("z1", 21.0, None, iso(T0 + 1000)) == []
+    db.close()
+
+
+def test_legacy_timestamps_are_normalized(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE readings (id INTEGER PRIMARY KEY AUTOINCREMENT, zone TEXT NOT NULL, "
+                 "temperature REAL, humidity REAL, timestamp TEXT NOT NULL, metric TEXT)")
+    conn.execute("CREATE UNIQUE INDEX readings_key ON readings(zone, metric, timestamp)")
+    # an unparseable timestamp is left as it is
+    rows = [("z1", 21.0, form) for form in FORMS] + [("z1", 22.0, "2024-05-01T10:00:01Z"),
+                                                     ("z1", 23.0, "garbage")]
+    conn.executemany("INSERT INTO readings(zone, temperature, timestamp, metric) VALUES (?, ?, ?, 'temperature')",
+                     rows)
+    conn.commit()
+    conn.close()
+
+    db = storage.EnvironmentDB(path)
+    with db.reader() as conn:
+        stored = conn.execute("SELECT temperature, timestamp FROM readings ORDER BY id").fetchall()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    assert stored == [(21.0, "2024-05-01T10:00:00.000Z"), (22.0, "2024-05-01T10:00:01.000Z"),
+                      (23.0, "garbage")]
+    assert version == storage.SCHEMA_VERSION
+    assert db.insert("z1", 21.0, None, FORMS[1]) == []
+    db.close()
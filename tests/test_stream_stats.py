@@ -0,0 +1,106 @@
+"""stream_stats: rolling statistics in event time and the amending of late readings."""
+import random
+
+import pytest
+
+import stream_stats
+
+WINDOW = 8
+ALPHA = 0.3
+
+
+def recompute(points):
+    """MetricStats fed with points in event-time order, the reference for amend()."""
+    stats = stream_stats.MetricStats(WINDOW, ALPHA)
+    for t, value in sorted(points):
+        stats.update(value, t)
+    return stats
+
+
+def assert_same(stats, reference):
+    assert list(stats.samples) == list(reference.samples)
+    assert stats.moments.count == reference.moments.count
+    assert stats.moments.mean == pytest.approx(reference.moments.mean)
+    assert stats.moments.variance == pytest.approx(reference.moments.variance, abs=1e-9)
+    assert stats.low.value == reference.low.value
+    assert stats.high.value == reference.high.value
+    assert stats.rate_of_change == pytest.approx(reference.rate_of_change)
+    assert stats.ewma.value == pytest.approx(reference.ewma.value)
+
+
+def test_ring_buffer_insert():
+    ring = stream_stats.RingBuffer(4)
+    for value in (1, 3, 4):
+        ring.push(value)
+    assert ring.insert(1, 2) is None
+    assert list(ring) == [1, 2, 3, 4]
+    assert ring.insert(2, 2.5) == 1          # full: the oldest leaves first
+    assert list(ring) == [2, 2.5, 3, 4]
+    assert ring.push(5) == 2
+
+
+def test_sliding_extreme_by_count():
+    low = stream_stats.SlidingExtreme(3)
+    values = [5, 3, 4, 6, 7, 2, 8]
+    for i, value in enumerate(values):
+        low.update(value)
+        assert low.value == min(values[max(0, i - 2):i + 1])
+
+
+def test_in_order_statistics():
+    stats = stream_stats.MetricStats(3, ALPHA)
+    for t, value in ((0.0, 20.0), (10.0, 22.0), (20.0, 21.0), (30.0, 25.0)):
+        stats.update(value, t)
+    snapshot = stats.snapshot()
+    assert snapshot["count"] == 3
+    assert snapshot["mean"] == pytest.approx(68.0 / 3)
+    assert (snapshot["min"], snapshot["max"]) == (21.0, 25.0)
+    assert snapshot["rate_of_change"] == pytest.approx((25.0 - 22.0) / 20.0)   # per event-time second
+    assert snapshot["last"] == 25.0 and snapshot["updates"] == 4
+
+
+def test_amend_matches_recompute():
+    rng = random.Random(3)
+    for _ in range(300):
+        # the first reading is the oldest one, so the EWMA starts where the reference does
+        times = [0.0] + [float(t) for t in rng.sample(range(1, 60), 25)]
+        stats = stream_stats.MetricStats(WINDOW, ALPHA)
+        accepted = []
+        for t in times:
+            value = float(rng.randint(0, 5))          # ties between values
+            if stats.amend(value, t):
+                accepted.append((t, value))
+            assert_same(stats, recompute(accepted))
+
+
+def test_amend_after_the_newest_is_an_update():
+    stats = stream_stats.MetricStats(WINDOW, ALPHA)
+    assert stats.amend(20.0, 5.0)
+    assert stats.amend(21.0, 6.0)
+    assert stats.last == 21.0 and list(stats.samples) == [(5.0, 20.0), (6.0, 21.0)]
+
+
+def test_late_reading_older_than_a_full_window():
+    stats = stream_stats.MetricStats(WINDOW, ALPHA)
+    for t in range(10, 10 + WINDOW):
+        stats.update(20.0, float(t))
+    before = stats.snapshot()
+    assert not stats.amend(-40.0, 10.0)
+    assert not stats.amend(-40.0, 3.0)
+    assert stats.snapshot() == before
+
+
+def test_late_reading_slides_the_extremes():
+    stats = stream_stats.MetricStats(3, ALPHA)
+    for t, value in ((1.0, 30.0), (3.0, 20.0), (4.0, 21.0)):
+        stats.update(value, t)
+    assert stats.high.value == 30.0
+    stats.amend(22.0, 2.0)                 # pushes out the reading at t=1
+    assert list(stats.samples) == [(2.0, 22.0), (3.0, 20.0), (4.0, 21.0)]
+    assert (stats.low.value, stats.high.value) == (20.0, 22.0)
+
+
+def test_stream_stats_amend_unknown_stream():
+    stats = stream_stats.StreamStats(window=WINDOW)
+    assert stats.amend("red", "temperature", 20.0, 5.0)
+    assert stats.get("red", "temperature").last == 20.0
@@ -0,0 +1,40 @@
+"""Smoke check of the shipped thing configs and of every declarable resource type."""
+import pytest
+
+from conftest import THING_DIRS, run_in_thing_dir
+
+SMOKE = '''
+import glob
+import logging
+import threading
+
+import hal
+import log
+import thing_config
+
+log.configure(level=logging.WARNING)
+hal.set_backend(hal.create_backend("null"))
+
+
+class Client(object):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+# every type a config may declare has an importable driver
+for type_name in thing_config.RESOURCE_TYPES:
+    thing_config.load_driver(type_name)
+
+for path in sorted(glob.glob("config/*.json")):
+    config = thing_config.load_config(path)
+    resources = thing_config.build_resources(config, threading.Lock(), Client(), simulate=True)
+    assert set(resources) == set(config["resources"]), path
+    print(path, len(resources))
+'''
+
+
+@pytest.mark.parametrize("thing_dir", THING_DIRS)
+def test_shipped_configs_load(thing_dir):
+    result = run_in_thing_dir(thing_dir, SMOKE)
+    assert result.returncode == 0, result.stderr
+    assert "config/" in result.stdout
@@ -0,0 +1,157 @@
+"""tsblocks: the Gorilla-style codec, timestamps and archiving of closed windows."""
+import math
+import random
+import sqlite3
+
+import pytest
+
+import tsblocks
+
+HOUR_MS = 3600 * 1000
+T0 = 1700000000000 - 1700000000000 % HOUR_MS   # start of a window
+
+
+def series(values, step=1000, start=T0):
+    return [(start + i * step, v) for i, v in enumerate(values)]
+
+
+@pytest.mark.parametrize("points", [
+    [],
+    [(T0, 21.5)],
+    series([21.5, 21.5, 21.6, 21.4, 22.0, -3.25, 0.0]),                   # exact decimals
+    series([0.1 * i + 1e-9 for i in range(50)]),                          # XOR floats
+    series([math.pi, math.e, math.pi, -math.e, 0.0, 1e300, -1e-300]),     # XOR, changing windows
+    series([1e12, -1e12, 1e12]),                                          # delta beyond 16 bits
+])
+def test_round_trip(points):
+    assert tsblocks.decode(tsblocks.encode(points)) == points
+
+
+def test_round_trip_irregular_timestamps():
+    times = [T0, T0 + 1, T0 + 1000, T0 + 1000 + 60000, T0 + 10 ** 9, T0 + 10 ** 9 + 7]  # every dod bucket
+    points = [(t, 20.0 + i / 10) for i, t in enumerate(times)]
+    assert tsblocks.decode(tsblocks.encode(points)) == points
+
+
+def test_round_trip_random():
+    rng = random.Random(7)
+    for _ in range(200):
+        t, points = T0, []
+        for _ in range(rng.randint(1, 40)):
+            t += rng.choice((1000, 1000, 999, 1001, rng.randint(1, 10 ** 7)))
+            value = rng.choice((round(rng.uniform(-40, 60), rng.randint(0, 3)), rng.uniform(-1e6, 1e6)))
+            points.append((t, value))
+        assert tsblocks.decode(tsblocks.encode(points)) == points
+
+
+def test_regular_decimal_series_is_compact():
+    points = series([round(21 + 0.1 * (i % 5), 1) for i in range(3600)])
+    assert len(tsblocks.encode(points)) < 3600     # under a byte per reading
+
+
+def test_iso_round_trip():
+    assert tsblocks.iso_to_millis("1970-01-01T00:00:01Z") == 1000
+    assert tsblocks.millis_to_iso(1500) == "1970-01-01T00:00:01.500Z"
+    assert tsblocks.iso_to_millis(tsblocks.millis_to_iso(T0 + 123)) == T0 + 123
+
+
+def test_iso_forms_of_one_instant():
+    forms = ["2024-05-01T10:00:00Z", "2024-05-01T10:00:00+00:00", "2024-05-01T10:00:00.000Z",
+             "2024-05-01T12:00:00+02:00", "2024-05-01T10:00:00"]
+    assert {tsblocks.normalize_iso(form) for form in forms} == {"2024-05-01T10:00:00.000Z"}
+
+
+def test_normalized_timestamps_sort_like_their_time():
+    # raw, "...:00Z" sorts after "...:00.5Z" although it is earlier
+    stamps = ["2024-05-01T10:00:00Z", "2024-05-01T10:00:00.5Z", "2024-05-01T10:00:01Z"]
+    normalized = [tsblocks.normalize_iso(s) for s in stamps]
+    assert sorted(normalized) == normalized
+
+
+def test_invalid_timestamp_raises():
+    with pytest.raises(ValueError):
+        tsblocks.iso_to_millis("not a time")
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE readings (id INTEGER PRIMARY KEY AUTOINCREMENT, zone TEXT NOT NULL, "
+                 "temperature REAL, humidity REAL, timestamp TEXT NOT NULL, metric TEXT)")
+    tsblocks.init_schema(conn)
+    yield conn
+    conn.close()
+
+
+def add(conn, zone, millis, temperature=None, humidity=None):
+    for metric, value in (("temperature", temperature), ("humidity", humidity)):
+        if value is not None:
+            conn.execute("INSERT INTO readings(zone, %s, timestamp, metric) VALUES (?, ?, ?, ?)" % metric,
+                         (zone, value, tsblocks.millis_to_iso(millis), metric))
+    conn.commit()
+
+
+def raw_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+
+def test_archive_only_closed_windows(conn):
+    for i in range(10):
+        add(conn, "z1", T0 + i * 1000, temperature=20 + i / 10, humidity=50.0)
+    add(conn, "z1", T0 + HOUR_MS + 5, temperature=30.0)            # still open
+
+    assert tsblocks.archive_closed_windows(conn, T0 + HOUR_MS + 10) == 20
+    assert raw_count(conn) == 1
+    assert tsblocks.archived_until(conn) == T0 + 9000
+    blocks = conn.execute("SELECT zone, metric, start_ms, count FROM reading_blocks ORDER BY metric").fetchall()
+    assert blocks == [("z1", "humidity", T0, 10), ("z1", "temperature", T0, 10)]
+    assert tsblocks.archive_closed_windows(conn, T0 + HOUR_MS + 10) == 0
+
+
+def test_late_reading_merged_into_existing_block(conn):
+    add(conn, "z1", T0 + 1000, temperature=20.0)
+    add(conn, "z1", T0 + 3000, temperature=22.0)
+    tsblocks.archive_closed_windows(conn, T0 + HOUR_MS)
+
+    add(conn, "z1", T0 + 2000, temperature=21.0)                   # late for the archived window
+    add(conn, "z1", T0 + 3000, temperature=22.0)                   # redelivered after archiving
+    assert tsblocks.archive_closed_windows(conn, T0 + HOUR_MS) == 2
+
+    assert tsblocks.query_range(conn, "z1", "temperature", T0, T0 + HOUR_MS) == \
+        [(T0 + 1000, 20.0), (T0 + 2000, 21.0), (T0 + 3000, 22.0)]
+    assert conn.execute("SELECT COUNT(*), SUM(count) FROM reading_blocks").fetchone() == (1, 3)
+
+
+def test_query_range_merges_blocks_and_raw_rows(conn):
+    for i in range(3):
+        add(conn, "z1", T0 + i * HOUR_MS + 1000, temperature=float(i))
+    add(conn, "z2", T0 + 1000, temperature=99.0)
+    tsblocks.archive_closed_windows(conn, T0 + 2 * HOUR_MS)        # first two windows
+    add(conn, "z1", T0 + 2 * HOUR_MS + 2000, humidity=40.0)
+
+    points = tsblocks.query_range(conn, "z1", "temperature", T0, T0 + 3 * HOUR_MS)
+    assert points == [(T0 + 1000, 0.0), (T0 + HOUR_MS + 1000, 1.0), (T0 + 2 * HOUR_MS + 1000, 2.0)]
+    # the end is exclusive, also across the block boundary
+    assert tsblocks.query_range(conn, "z1", "temperature", T0 + 1000, T0 + HOUR_MS + 1000) == [(T0 + 1000, 0.0)]
+    assert tsblocks.query_range(conn, "z1", "humidity", T0, T0 + 3 * HOUR_MS) == [(T0 + 2 * HOUR_MS + 2000, 40.0)]
+    with pytest.raises(ValueError):
+        tsblocks.query_range(conn, "z1", "pressure", T0, T0 + HOUR_MS)
+
+
+def test_is_archived_and_latest_values(conn):
+    add(conn, "z1", T0 + 1000, temperature=20.0)
+    add(conn, "z1", T0 + HOUR_MS + 1000, temperature=21.0, humidity=45.0)
+    tsblocks.archive_closed_windows(conn, T0 + 2 * HOUR_MS)
+
+    assert tsblocks.is_archived(conn, "z1", "temperature", T0 + 1000)
+    assert not tsblocks.is_archived(conn, "z1", "temperature", T0 + 1001)
+    assert not tsblocks.is_archived(conn, "z1", "humidity", T0 + 1000)
+    assert not tsblocks.is_archived(conn, "z2", "temperature", T0 + 1000)
+    assert tsblocks.latest_values(conn) == {("z1", "temperature"): (T0 + HOUR_MS + 1000, 21.0),
+                                            ("z1", "humidity"): (T0 + HOUR_MS + 1000, 45.0)}
+
+
+def test_empty_archive(conn):
+    assert tsblocks.archived_until(conn) is None
+    assert tsblocks.latest_values(conn) == {}
+    assert tsblocks.storage_stats(conn)["points"] == 0
@@ -43,14 +43,14 @@
 
 import sys
 
-import netifaces as ni
-from netifaces import AF_INET, AF_INET6, AF_LINK, AF_PACKET, AF_BRIDGE
-
 
+# netifaces is imported on first use, it is not needed on the startup path
 def get_ip_address_by_if_name( interface_name ):
-  return ni.ifaddresses( interface_name )[ AF_INET ][ 0 ][ 'addr' ]
+  import netifaces as ni
+  return ni.ifaddresses( interface_name )[ ni.AF_INET ][ 0 ][ 'addr' ]
 
 
 def get_hw_address_by_if_name( interface_name ):
-  return ni.ifaddresses( interface_name )[ AF_LINK ][ 0 ][ 'addr' ]
+  import netifaces as ni
+  return ni.ifaddresses( interface_name )[ ni.AF_LINK ][ 0 ][ 'addr' ]
 